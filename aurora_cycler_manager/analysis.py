@@ -9,40 +9,59 @@ summary information, per-cycle data, and summary statistics.
 """
 
 import contextlib
+import hashlib
 import json
 import logging
+import multiprocessing
+import os
+import tempfile
 import warnings
+from collections.abc import Iterable, Iterator
 from datetime import datetime, timezone
+from itertools import pairwise
+from multiprocessing.connection import Connection, wait
 from pathlib import Path
-from typing import Literal
+from time import monotonic
+from typing import Literal, TypeVar
 
 import h5py
 import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
 from tsdownsample import MinMaxLTTBDownsampler
 from xlsxwriter import Workbook
 
 import aurora_cycler_manager.database_funcs as dbf
 from aurora_cycler_manager.config import get_config
 from aurora_cycler_manager.data_parse import (
+    FULL_FILES_KEY,
+    LAKE_COLUMNS_KEY,
     SampleDataBundle,
+    get_batch_summaries,
     get_cycles_summary,
     get_cycling,
+    get_full_files,
+    get_lake_file,
     get_metadata,
     get_overall_summary,
     get_sample_folder,
     read_cycling,
     read_metadata,
+    scan_cycling,
+    scan_full_files,
 )
+from aurora_cycler_manager.dicts import storage_dtypes
 from aurora_cycler_manager.stdlib_utils import (
+    file_lock,
     json_dump_compress_lists,
     max_with_none,
     min_with_none,
     round_c_rate,
     run_from_sample,
 )
+from aurora_cycler_manager.timing import StageTimer
 from aurora_cycler_manager.utils import (
-    weighted_median,
+    weighted_median_expr,
 )
 from aurora_cycler_manager.version import __url__, __version__
 
@@ -50,6 +69,23 @@ warnings.filterwarnings("ignore", category=RuntimeWarning, message="All-NaN axis
 logger = logging.getLogger(__name__)
 
 CONFIG = get_config()
+# Key in full file parquet metadata storing what has been merged, used for incremental analysis
+ANALYSIS_STATE_KEY = "AURORA:analysis_state"
+# Columns which increment the Step when they change
+STEP_KEYS = ["job_number", "cycle_number", "loop_number"]
+# Default minimum rows per row group in full files, row groups only end where the cycle changes
+FULL_FILE_ROW_GROUP_ROWS = 250_000
+# Default maximum points in each level of detail of the time series, the full file is the finest level
+LOD_LEVELS = (5_000, 50_000, 500_000)
+# Points in the capacity and voltage grids of each half cycle curve
+CURVE_POINTS = 256
+# Seconds between checks of the memory used by analysis processes
+MEMORY_CHECK_INTERVAL = 0.1
+# Columns of the full file needed for the cycle and overall analysis
+ANALYSIS_COLUMNS = ["uts", "V (V)", "I (A)", "dQ (mAh)", "Step", "Cycle"]
+FrameT = TypeVar("FrameT", pl.DataFrame, pl.LazyFrame)
+# Version of the analysed files, bump when a change to the analysis changes them so samples are analysed again
+ANALYSIS_VERSION = "1"
 # Metadata that gets copied in the json data file for more convenient access
 SAMPLE_METADATA_TO_DATA = [
     "N:P ratio",
@@ -163,7 +199,7 @@ def read_and_order_job_files(job_files: list[Path]) -> tuple[list[Path], list[pl
     return job_files, dfs, metadatas
 
 
-def calc_dq(df: pl.DataFrame) -> pl.DataFrame:
+def calc_dq(df: FrameT) -> FrameT:
     """Calculate and add dQ (mAh) column."""
     # TODO: this should be smarter - maybe assert 0 between steps
     return (
@@ -179,25 +215,26 @@ def calc_dq(df: pl.DataFrame) -> pl.DataFrame:
     )
 
 
-def merge_dfs(dfs: list[pl.DataFrame]) -> tuple[pl.DataFrame, pl.DataFrame | None]:
-    """Merge cycling dataframes and add cycles. Seperate out EIS."""
-    for i, df in enumerate(dfs):
-        exprs = [pl.lit(i).alias("job_number")]
-        if "loop_number" not in df.columns:
-            exprs.append(pl.lit(0).alias("loop_number"))
-        if "cycle_number" not in df.columns:
-            if "Cycle" in df.columns:
-                exprs.append(pl.col("Cycle").alias("cycle_number"))
-            else:
-                exprs.append(pl.lit(0).alias("cycle_number"))
-        dfs[i] = df.with_columns(exprs)
+def _prepare_job_df(df: FrameT, job_number: int) -> FrameT:
+    """Add job, cycle and loop numbers to one job dataframe, calculate dQ if missing."""
+    columns = df.collect_schema().names()
+    exprs = [pl.lit(job_number).alias("job_number")]
+    if "loop_number" not in columns:
+        exprs.append(pl.lit(0).alias("loop_number"))
+    if "cycle_number" not in columns:
+        if "Cycle" in columns:
+            exprs.append(pl.col("Cycle").alias("cycle_number"))
+        else:
+            exprs.append(pl.lit(0).alias("cycle_number"))
+    df = df.with_columns(exprs)
 
-        if "dQ (mAh)" not in df.columns:
-            dfs[i] = calc_dq(dfs[i])
+    if "dQ (mAh)" not in columns:
+        df = calc_dq(df)
+    return df
 
-    df = pl.concat(dfs, how="diagonal")
 
-    # If EIS exists, filter into its own df
+def _split_eis(df: pl.DataFrame) -> tuple[pl.DataFrame, pl.DataFrame | None]:
+    """Separate rows with impedance data into their own dataframe."""
     eis_df = None
     if "f (Hz)" in df.columns:
         eis_mask = (df["f (Hz)"].is_not_null()) & (df["f (Hz)"] != 0)
@@ -205,51 +242,79 @@ def merge_dfs(dfs: list[pl.DataFrame]) -> tuple[pl.DataFrame, pl.DataFrame | Non
         df = df.filter(~eis_mask).drop("f (Hz)", "Re(Z) (ohm)", "Im(Z) (ohm)")
         if eis_df.is_empty():
             eis_df = None
+    return df, eis_df
+
+
+def _step_stats(df: FrameT) -> FrameT:
+    """Calculate criteria for each Step group and determine which steps are valid cycles."""
+    step_stats = df.group_by("Step").agg(
+        [
+            pl.len().alias("count"),
+            (pl.col("I (A)") > 0).sum().alias("positive_count"),
+            (pl.col("I (A)") < 0).sum().alias("negative_count"),
+            (pl.col("dQ (mAh)").clip(upper_bound=0).sum().abs() / pl.col("dQ (mAh)").clip(lower_bound=0).sum()).alias(
+                "coulombic_efficiency"
+            ),
+        ]
+    )
+    return step_stats.with_columns(
+        (
+            (pl.col("count") > 10)
+            & (pl.col("positive_count") > 5)
+            & (pl.col("negative_count") > 5)
+            & (pl.col("coulombic_efficiency") > 0.01)  # at least 1%, otherwise probably noise
+        ).alias("is_cycle")
+    )
+
+
+def _assign_eis_cycles(eis_df: pl.DataFrame, df: pl.DataFrame) -> pl.DataFrame:
+    """EIS merge - find last non-zero cycle before the EIS."""
+    return eis_df.join_asof(
+        df.filter(pl.col("Cycle") != 0).select(["uts", "Cycle"]), on="uts", strategy="backward"
+    ).with_columns(pl.col("Cycle").fill_null(0))
+
+
+def merge_dfs(dfs: list[pl.DataFrame]) -> tuple[pl.DataFrame, pl.DataFrame | None]:
+    """Merge cycling dataframes and add cycles. Seperate out EIS."""
+    df, eis_df, _last_key = _merge_dfs(dfs)
+    return df, eis_df
 
+
+def _merge_dfs(dfs: list[pl.DataFrame]) -> tuple[pl.DataFrame, pl.DataFrame | None, list | None]:
+    """Merge cycling dataframes, also return the job, cycle and loop numbers of the last row."""
+    for i, df in enumerate(dfs):
+        dfs[i] = _prepare_job_df(df, i)
+
+    df = pl.concat(dfs, how="diagonal")
+
+    # If EIS exists, filter into its own df
+    df, eis_df = _split_eis(df)
+
+    last_key = None
     if not df.is_empty():
         df = df.sort("uts")
 
         # Increment step if any job, cycle, or loop changes
-        df = df.with_columns(pl.struct(["job_number", "cycle_number", "loop_number"]).rle_id().add(1).alias("Step"))
+        df = df.with_columns(pl.struct(STEP_KEYS).rle_id().add(1).alias("Step"))
+        last_key = list(df.select(STEP_KEYS).row(-1))
 
         # Drop columns
-        df = df.drop("job_number", "cycle_number", "loop_number", "index", strict=False)
-
-        # Calculate criteria for each Step group
-        step_stats = df.group_by("Step").agg(
-            [
-                pl.len().alias("count"),
-                (pl.col("I (A)") > 0).sum().alias("positive_count"),
-                (pl.col("I (A)") < 0).sum().alias("negative_count"),
-                (
-                    pl.col("dQ (mAh)").clip(upper_bound=0).sum().abs() / pl.col("dQ (mAh)").clip(lower_bound=0).sum()
-                ).alias("coulombic_efficiency"),
-            ]
-        )
-
-        # Determine which steps are valid cycles
-        step_stats = step_stats.with_columns(
-            (
-                (pl.col("count") > 10)
-                & (pl.col("positive_count") > 5)
-                & (pl.col("negative_count") > 5)
-                & (pl.col("coulombic_efficiency") > 0.01)  # at least 1%, otherwise probably noise
-            ).alias("is_cycle")
-        )
+        df = df.drop(*STEP_KEYS, "index", strict=False)
 
         # Assign cycle numbers (cumsum of is_cycle, 0 for non-cycles)
-        step_stats = step_stats.sort("Step").with_columns(
-            pl.when(pl.col("is_cycle")).then(pl.col("is_cycle").cum_sum()).otherwise(0).alias("Cycle")
+        step_stats = (
+            _step_stats(df)
+            .sort("Step")
+            .with_columns(pl.when(pl.col("is_cycle")).then(pl.col("is_cycle").cum_sum()).otherwise(0).alias("Cycle"))
         )
 
         # Join back to main dataframe
-        df = df.drop("Cycle", strict=False).join(step_stats.select(["Step", "Cycle"]), on="Step", how="left")
+        df = df.drop("Cycle", strict=False).join(
+            step_stats.select(["Step", "Cycle"]), on="Step", how="left", maintain_order="left"
+        )
 
-        # EIS merge - find last non-zero cycle before the EIS
         if eis_df is not None:
-            eis_df = eis_df.join_asof(
-                df.filter(pl.col("Cycle") != 0).select(["uts", "Cycle"]), on="uts", strategy="backward"
-            ).with_columns(pl.col("Cycle").fill_null(0))
+            eis_df = _assign_eis_cycles(eis_df, df)
 
     else:
         df = df.with_columns(
@@ -261,7 +326,508 @@ def merge_dfs(dfs: list[pl.DataFrame]) -> tuple[pl.DataFrame, pl.DataFrame | Non
         )
         if eis_df is not None:
             eis_df = eis_df.with_columns(pl.lit(0).alias("Cycle"))
-    return df, eis_df
+    return df, eis_df, last_key
+
+
+def _row_group_ranges(file: Path, column: str = "uts") -> list[tuple[float, float]] | None:
+    """Min and max of a column in each row group from the parquet statistics, without reading any data."""
+    if file.suffix != ".parquet":
+        return None
+    file_metadata = pq.read_metadata(file)
+    if column not in file_metadata.schema.names:
+        return None
+    column_index = file_metadata.schema.names.index(column)
+    ranges = []
+    for i in range(file_metadata.num_row_groups):
+        stats = file_metadata.row_group(i).column(column_index).statistics
+        if stats is None or not stats.has_min_max:
+            return None
+        ranges.append((stats.min, stats.max))
+    return ranges
+
+
+def scan_and_order_job_files(job_files: list[Path]) -> tuple[list[Path], list[pl.LazyFrame], list[dict], bool]:
+    """Take list of job files, reorder by time, return lists of lazyframes and metadata.
+
+    Like `read_and_order_job_files`, but the order comes from the parquet statistics of uts, so only the uts column
+    is read. Also returns whether the data still needs sorting after concatenating, i.e. if files or row groups
+    overlap in time, or rows within a file are out of order.
+    """
+    metadatas = [read_metadata(f) for f in job_files]
+    lfs = [scan_cycling(f) for f in job_files]
+    if len(lfs) == 0:
+        msg = "No valid cycling files provided"
+        raise ValueError(msg)
+    sampleids = [m.get("sample_data", {}).get("Sample ID", "") for m in metadatas]
+    if len(set(sampleids)) > 1:
+        msg = "All files must be from the same sample"
+        raise ValueError(msg)
+
+    ranges = [_row_group_ranges(f) for f in job_files]
+    # Files without statistics, e.g. hdf5, use a min/max query instead
+    missing = [i for i, r in enumerate(ranges) if r is None]
+    for i, stats in zip(
+        missing,
+        pl.collect_all(
+            [lfs[i].select(pl.col("uts").min().alias("min"), pl.col("uts").max().alias("max")) for i in missing]
+        ),
+        strict=True,
+    ):
+        ranges[i] = [] if stats["min"][0] is None else [(stats["min"][0], stats["max"][0])]
+    start_times = [min(r[0] for r in rg) if rg else None for rg in ranges]
+    end_times = [max(r[1] for r in rg) if rg else None for rg in ranges]
+    order = _sort_times(start_times, end_times)
+    job_files = [job_files[i] for i in order]
+    lfs = [lfs[i] for i in order]
+    metadatas = [metadatas[i] for i in order]
+
+    row_groups = [r for i in order for r in ranges[i]]
+    needs_sort = any(b[0] < a[1] for a, b in pairwise(row_groups))
+    if not needs_sort:
+        unsorted = pl.collect_all([lf.select((pl.col("uts").diff() < 0).any()) for lf in lfs])
+        needs_sort = any(u.item() for u in unsorted)
+    return job_files, lfs, metadatas, needs_sort
+
+
+def _merge_lazy(
+    sample_id: str,
+    sample_folder: Path,
+    all_files: list[Path],
+) -> tuple[list[Path], pl.DataFrame, pl.DataFrame | None, dict, dict, Path]:
+    """Merge job files lazily and stream the result to a temporary full file.
+
+    The snapshots are never fully loaded into memory, only the columns needed for the rest of the analysis are read
+    back from the merged file.
+
+    Returns:
+        job files, analysis columns of the merged data, EIS data, merged metadata, analysis state, temporary file
+
+    """
+    job_files, lfs, metadatas, needs_sort = scan_and_order_job_files(all_files)
+    metadata = merge_metadata(job_files, metadatas, sample_id)
+    state = _new_analysis_state(sample_folder, all_files, job_files, lfs)
+    tmp_file = sample_folder / f".full.{sample_id}.tmp.parquet"
+
+    lf = pl.concat([_prepare_job_df(job_lf, i) for i, job_lf in enumerate(lfs)], how="diagonal")
+
+    # If EIS exists, filter into its own df
+    eis_df = None
+    if "f (Hz)" in lf.collect_schema().names():
+        eis_mask = pl.col("f (Hz)").is_not_null() & (pl.col("f (Hz)") != 0)
+        eis_df = lf.filter(eis_mask).collect()
+        lf = lf.filter(~eis_mask).drop("f (Hz)", "Re(Z) (ohm)", "Im(Z) (ohm)")
+        if eis_df.is_empty():
+            eis_df = None
+
+    if needs_sort:
+        lf = lf.sort("uts", maintain_order=True)
+
+    # Increment step if any job, cycle, or loop changes
+    lf = lf.with_columns(pl.struct(STEP_KEYS).rle_id().add(1).alias("Step"))
+    step_stats, last_key = pl.collect_all([_step_stats(lf), lf.select(pl.col(STEP_KEYS).last())])
+
+    if step_stats.is_empty():
+        # Nothing to stream, merge the (at most EIS) data in memory
+        df, eis_df, state["last_key"] = _merge_dfs([job_lf.collect() for job_lf in lfs])
+        write_full_file(
+            df, tmp_file, metadata={"AURORA:metadata": json.dumps(metadata), ANALYSIS_STATE_KEY: json.dumps(state)}
+        )
+        return job_files, df.select(ANALYSIS_COLUMNS), eis_df, metadata, state, tmp_file
+
+    state["last_key"] = list(last_key.row(0))
+
+    # Assign cycle numbers (cumsum of is_cycle, 0 for non-cycles)
+    step_stats = step_stats.sort("Step").with_columns(
+        pl.when(pl.col("is_cycle")).then(pl.col("is_cycle").cum_sum()).otherwise(0).alias("Cycle")
+    )
+    lf = (
+        lf.drop(*STEP_KEYS, "index", strict=False)
+        .drop("Cycle", strict=False)
+        .join(step_stats.lazy().select(["Step", "Cycle"]), on="Step", how="left", maintain_order="left")
+    )
+    write_full_file(
+        lf.collect_batches(),
+        tmp_file,
+        metadata={"AURORA:metadata": json.dumps(metadata), ANALYSIS_STATE_KEY: json.dumps(state)},
+    )
+
+    df = pl.read_parquet(tmp_file, columns=ANALYSIS_COLUMNS)
+    if eis_df is not None:
+        eis_df = _assign_eis_cycles(eis_df, df)
+    return job_files, df, eis_df, metadata, state, tmp_file
+
+
+def _storage_options() -> dict:
+    """Parquet compression and row group size of analysis outputs, from "Storage" in the config."""
+    storage = CONFIG.get("Storage") or {}
+    return {
+        "compression": storage.get("compression", "zstd"),
+        "compression_level": storage.get("compression_level"),
+        "row_group_rows": storage.get("row_group_rows", FULL_FILE_ROW_GROUP_ROWS),
+    }
+
+
+def compact_df(df: FrameT, artefact: str) -> FrameT:
+    """Cast columns to the compact storage dtypes of an analysis output, e.g. "full" or "shrunk"."""
+    columns = df.collect_schema().names()
+    return df.cast({k: v for k, v in storage_dtypes[artefact].items() if k in columns})
+
+
+def write_artefact(df: pl.DataFrame, file: Path, artefact: str, metadata: dict[str, str] | None = None) -> None:
+    """Write an analysis output to parquet with compact dtypes and the configured compression.
+
+    Full files are written with write_full_file instead, to align row groups to cycles.
+    """
+    options = _storage_options()
+    compact_df(df, artefact).write_parquet(
+        file,
+        compression=options["compression"],
+        compression_level=options["compression_level"],
+        row_group_size=options["row_group_rows"],
+        metadata=metadata,
+    )
+
+
+def write_full_file(
+    frames: pl.DataFrame | Iterable[pl.DataFrame],
+    file: Path,
+    metadata: dict[str, str],
+    row_group_rows: int | None = None,
+) -> None:
+    """Write merged cycling data to parquet with row groups aligned to cycles.
+
+    A row group ends at the first change of Cycle after row_group_rows rows, so each cycle is in one row group, and
+    the Cycle and uts statistics let readers skip all other row groups. Cycles longer than four times
+    row_group_rows are split to limit memory use. Columns are cast to the compact full file dtypes.
+
+    Args:
+        frames: dataframe, or iterable of consecutive dataframes, e.g. batches from a lazy query
+        file: path to write to
+        metadata: key-value metadata for the parquet footer
+        row_group_rows: minimum number of rows in each row group except the last, defaults to the config
+
+    """
+    if isinstance(frames, pl.DataFrame):
+        frames = [frames]
+    options = _storage_options()
+    row_group_rows = row_group_rows or options["row_group_rows"]
+    compression = "none" if options["compression"] == "uncompressed" else options["compression"]
+    writer = None
+    buffer: list[pl.DataFrame] = []
+    n_buffered = 0
+    try:
+        for frame in frames:
+            frame = compact_df(frame, "full")  # noqa: PLW2901
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    file,
+                    frame.to_arrow().schema.with_metadata(metadata),
+                    compression=compression,
+                    compression_level=options["compression_level"],
+                )
+            buffer.append(frame)
+            n_buffered += frame.height
+            while n_buffered >= row_group_rows:
+                df = pl.concat(buffer)
+                changes = (df["Cycle"].diff().fill_null(0) != 0).arg_true()
+                cut = changes.filter(changes >= row_group_rows).first()
+                if cut is None:
+                    if df.height < 4 * row_group_rows:
+                        buffer = [df]
+                        break
+                    cut = df.height
+                writer.write_table(df.head(cut).to_arrow(), row_group_size=cut)
+                buffer = [df.slice(cut)]
+                n_buffered = df.height - cut
+        if writer is None:
+            msg = "No data to write"
+            raise ValueError(msg)
+        if n_buffered > 0:
+            writer.write_table(pl.concat(buffer).to_arrow(), row_group_size=n_buffered)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _file_fingerprint(file: Path) -> dict:
+    """Size and modification time of a file, used to check if it has changed."""
+    stat = file.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _boundary_rows(lf: pl.LazyFrame, first_uts: float, last_uts: float) -> list:
+    """First and last merged rows of a snapshot, used to check that earlier data has not been rewritten."""
+    return (
+        lf.filter((pl.col("uts") == first_uts) | (pl.col("uts") == last_uts))
+        .select("uts", "V (V)", "I (A)")
+        .collect()
+        .rows()
+    )
+
+
+def _new_analysis_state(
+    sample_folder: Path,
+    all_files: list[Path],
+    job_files: list[Path],
+    lfs: list[pl.LazyFrame],
+) -> dict:
+    """Record which rows of which snapshot files went into a full merge."""
+    file_stats = pl.collect_all(
+        [
+            lf.select(
+                pl.len().alias("rows"), pl.col("uts").min().alias("first_uts"), pl.col("uts").max().alias("last_uts")
+            )
+            for lf in lfs
+        ]
+    )
+    job_infos = []
+    for f, lf, stats in zip(job_files, lfs, file_stats, strict=True):
+        info = stats.row(0, named=True)
+        job_infos.append(
+            {
+                "path": f.relative_to(sample_folder).as_posix(),
+                **_file_fingerprint(f),
+                **info,
+                "boundary_rows": _boundary_rows(lf, info["first_uts"], info["last_uts"]),
+            }
+        )
+    return {
+        "version": ANALYSIS_VERSION,
+        "job_files": job_infos,
+        "ignored_files": {
+            f.relative_to(sample_folder).as_posix(): _file_fingerprint(f) for f in all_files if f not in job_files
+        },
+        "last_uts": max(info["last_uts"] for info in job_infos),
+        "last_key": None,
+    }
+
+
+def _replace_full_file(sample_folder: Path, sample_id: str, tmp_file: Path) -> None:
+    """Replace the full file with a newly written one, and remove the parts appended by incremental analysis."""
+    # Parts go first, the old full file is consistent on its own if this is interrupted
+    for part in sample_folder.glob(f"full.{sample_id}.part-*.parquet"):
+        part.unlink()
+    tmp_file.replace(sample_folder / f"full.{sample_id}.parquet")
+
+
+def _write_full_part(
+    sample_folder: Path,
+    sample_id: str,
+    kept: list[tuple[Path, int | None]],
+    df: pl.DataFrame,
+    metadata: dict[str, str],
+) -> None:
+    """Write data from incremental analysis as a new part after the kept full files, see get_full_files.
+
+    Parts that are not kept are removed. If no full files are kept, the data replaces the full file instead.
+    """
+    if not kept:
+        tmp_file = sample_folder / f".full.{sample_id}.tmp.parquet"
+        write_full_file(df, tmp_file, metadata=metadata)
+        _replace_full_file(sample_folder, sample_id, tmp_file)
+        return
+    parts = list(sample_folder.glob(f"full.{sample_id}.part-*.parquet"))
+    number = max((int(f.stem.rpartition("-")[2]) for f in parts), default=0) + 1
+    part = sample_folder / f"full.{sample_id}.part-{number}.parquet"
+    files = [[f.name, end_step] for f, end_step in kept] + [[part.name, None]]
+    tmp_file = sample_folder / f".{part.stem}.tmp.parquet"
+    write_full_file(df, tmp_file, metadata={**metadata, FULL_FILES_KEY: json.dumps(files)})
+    tmp_file.replace(part)
+    # Merged into the new part, or left by an interrupted analysis
+    kept_files = {f for f, _end_step in kept}
+    for f in parts:
+        if f not in kept_files:
+            f.unlink()
+
+
+def _merge_incremental(
+    sample_id: str,
+    sample_folder: Path,
+    all_files: list[Path],
+) -> tuple[list[Path], list[tuple[Path, int | None]], pl.DataFrame, pl.DataFrame | None, dict] | None:
+    """Merge only snapshot rows newer than the last analysis onto the end of the full data.
+
+    Uses the analysis state stored with the full data to skip unchanged snapshots, and only reads rows newer than the
+    last analysed uts from changed snapshots. Steps and cycles continue from the stored state, only the open (last)
+    step is recalculated.
+
+    Earlier full data is not read. The rows of the open step are read from the full files and merged with the new
+    rows, to be written as a new part which takes over from the open step, see get_full_files. Earlier parts with no
+    more rows than the new part are merged into it, so there are only a few parts and each row is only rewritten a
+    few times as the data grows.
+
+    Returns:
+        job files in merge order, full files to keep with the Step where the new part takes over, merged data for
+        the new part, EIS data with the new rows not yet assigned to a cycle, and the new analysis state, or None
+        if the previous analysis cannot be extended and a full merge is required.
+
+    """
+    full_files = get_full_files(sample_id)
+    cycles_file = sample_folder / f"cycles.{sample_id}.parquet"
+    outputs = [cycles_file, *(sample_folder / f"{k}.{sample_id}.parquet" for k in ("curves", "shrunk"))]
+    if not full_files or not all(f.exists() for f in outputs):
+        return None
+    state = json.loads(pl.read_parquet_metadata(full_files[-1][0]).get(ANALYSIS_STATE_KEY) or "null")
+    if not state or state.get("version") != ANALYSIS_VERSION or not state.get("last_key"):
+        logger.info("No valid analysis state for %s", sample_id)
+        return None
+    last_uts = state["last_uts"]
+    files = {f.relative_to(sample_folder).as_posix(): f for f in all_files}
+
+    # Previously merged files must still exist and only have rows appended
+    job_files = []
+    job_infos = []
+    tails = []
+    for job_number, info in enumerate(state["job_files"]):
+        file = files.pop(info["path"], None)
+        if file is None:
+            logger.info("Snapshot %s of %s was removed", info["path"], sample_id)
+            return None
+        job_files.append(file)
+        fingerprint = _file_fingerprint(file)
+        if fingerprint == {"size": info["size"], "mtime_ns": info["mtime_ns"]}:
+            job_infos.append(info)
+            continue
+        lf = scan_cycling(file)
+        if (
+            lf.filter(pl.col("uts") <= last_uts).select(pl.len()).collect().item() != info["rows"]
+            or [list(row) for row in _boundary_rows(lf, info["first_uts"], info["last_uts"])] != info["boundary_rows"]
+        ):
+            logger.info("Snapshot %s of %s changed before last analysis", info["path"], sample_id)
+            return None
+        # Include the last analysed row so dQ continues correctly
+        tail = _prepare_job_df(lf.filter(pl.col("uts") >= info["last_uts"]).collect(), job_number)
+        tail = tail.filter(pl.col("uts") > last_uts)
+        tails.append(tail)
+        file_last_uts = tail["uts"].max() if not tail.is_empty() else info["last_uts"]
+        job_infos.append(
+            {
+                **info,
+                **fingerprint,
+                "rows": info["rows"] + tail.height,
+                "last_uts": file_last_uts,
+                "boundary_rows": _boundary_rows(lf, info["first_uts"], file_last_uts),
+            }
+        )
+
+    # New files must start after the last analysis and not overlap each other
+    new_files = []
+    new_dfs = []
+    ignored_files = {}
+    for path, file in files.items():
+        fingerprint = _file_fingerprint(file)
+        if state["ignored_files"].get(path) == fingerprint:
+            ignored_files[path] = fingerprint
+            continue
+        new_df = read_cycling(file)
+        if new_df.is_empty():
+            ignored_files[path] = fingerprint
+            continue
+        if new_df["uts"].min() <= last_uts:
+            logger.info("Snapshot %s of %s starts before last analysis", path, sample_id)
+            return None
+        new_files.append(file)
+        new_dfs.append(new_df)
+    order = _sort_times([df["uts"][0] for df in new_dfs], [df["uts"][-1] for df in new_dfs])
+    if len(order) != len(new_dfs):
+        return None
+    for i in order:
+        job_number = len(job_files)
+        job_files.append(new_files[i])
+        job_infos.append(
+            {
+                "path": new_files[i].relative_to(sample_folder).as_posix(),
+                **_file_fingerprint(new_files[i]),
+                "rows": new_dfs[i].height,
+                "first_uts": new_dfs[i]["uts"].min(),
+                "last_uts": new_dfs[i]["uts"].max(),
+                "boundary_rows": _boundary_rows(new_dfs[i].lazy(), new_dfs[i]["uts"].min(), new_dfs[i]["uts"].max()),
+            }
+        )
+        tails.append(_prepare_job_df(new_dfs[i], job_number))
+
+    # Growing files must not change which jobs a full merge would keep
+    if len(_sort_times([i["first_uts"] for i in job_infos], [i["last_uts"] for i in job_infos])) != len(job_infos):
+        return None
+
+    old_eis = pl.read_parquet(eis_file) if (eis_file := sample_folder / f"eis.{sample_id}.parquet").exists() else None
+    new_df, new_eis = _split_eis(pl.concat(tails, how="diagonal_relaxed")) if tails else (pl.DataFrame(), None)
+
+    # Steps and sizes of the full files from the parquet statistics, rows after end_step are not used
+    min_steps = []
+    max_steps = []
+    n_rows = []
+    for file, end_step in full_files:
+        step_ranges = _row_group_ranges(file, "Step")
+        if not step_ranges:
+            return None
+        min_steps.append(min(r[0] for r in step_ranges))
+        max_steps.append(max(r[1] for r in step_ranges) if end_step is None else end_step - 1)
+        n_rows.append(pq.read_metadata(file).num_rows)
+    last_step = max_steps[-1]
+
+    # Files after the one where the open step starts only hold the open step
+    k = open_file = next(i for i, step in enumerate(max_steps) if step >= last_step)
+    # Merge earlier parts with no more rows than the later files, so there are only a few parts, each about twice
+    # the size of the next, the full file itself is never rewritten
+    rows = sum(n_rows[k:]) + new_df.height
+    while k > 1 and n_rows[k - 1] <= rows:
+        k -= 1
+        rows += n_rows[k]
+    kept = full_files[:k]
+    old_lf = scan_full_files(full_files[k:])
+    if k == open_file and min_steps[k] < last_step:
+        # Keep the rows before the open step in place
+        kept.append((full_files[k][0], last_step))
+        old_lf = old_lf.filter(pl.col("Step") >= last_step)
+    old_df = old_lf.collect()
+
+    df = old_df
+    last_key = state["last_key"]
+    if not new_df.is_empty():
+        new_df = new_df.sort("uts")
+
+        # Continue step numbers from the last analysed row
+        steps = pl.concat(
+            [pl.DataFrame([last_key], schema=STEP_KEYS, orient="row"), new_df.select(STEP_KEYS)],
+            how="vertical_relaxed",
+        ).select(pl.struct(STEP_KEYS).rle_id().add(last_step).alias("Step"))["Step"][1:]
+        last_key = list(new_df.select(STEP_KEYS).row(-1))
+        new_df = new_df.with_columns(steps).drop(*STEP_KEYS, "index", strict=False)
+
+        # Only the open step can change, recalculate its cycle with the new rows, continuing from the cycle before
+        split = old_df["Step"].search_sorted(last_step)
+        head = old_df[:split]
+        open_cycle = old_df["Cycle"][split]
+        base_cycle = open_cycle - 1 if open_cycle else pl.read_parquet(cycles_file, columns=["Cycle"])["Cycle"].max()
+        tail_df = pl.concat([old_df[split:].drop("Cycle"), new_df], how="diagonal_relaxed")
+        step_stats = (
+            _step_stats(tail_df)
+            .sort("Step")
+            .with_columns(
+                pl.when(pl.col("is_cycle"))
+                .then(pl.col("is_cycle").cum_sum() + (base_cycle or 0))
+                .otherwise(0)
+                .alias("Cycle")
+            )
+        )
+        tail_df = tail_df.join(step_stats.select(["Step", "Cycle"]), on="Step", how="left", maintain_order="left")
+        df = pl.concat([head, tail_df], how="diagonal_relaxed").cast(dict(old_df.schema))
+
+    # New EIS is assigned to cycles with the rest of the analysis
+    if new_eis is not None:
+        new_eis = new_eis.with_columns(pl.lit(None, dtype=pl.Int32).alias("Cycle"))
+    eis_dfs = [e for e in (old_eis, new_eis) if e is not None]
+    eis_df = pl.concat(eis_dfs, how="diagonal_relaxed") if eis_dfs else None
+
+    new_state = {
+        "version": ANALYSIS_VERSION,
+        "job_files": job_infos,
+        "ignored_files": ignored_files,
+        "last_uts": max(info["last_uts"] for info in job_infos),
+        "last_key": last_key,
+    }
+    return job_files, kept, df, eis_df, new_state
 
 
 def extract_voltage_crates(job_data: list[dict]) -> dict:
@@ -491,8 +1057,13 @@ def analyse_cycles(
     df: pl.DataFrame,
     mass_mg: float | None,
     protocol_summary: dict | None,
+    previous_summary: pl.DataFrame | None = None,
 ) -> tuple[pl.DataFrame, dict]:
-    """Analyse time-series dataframe, return per-cycle summary."""
+    """Analyse time-series dataframe, return per-cycle summary.
+
+    If a previous summary of the same data is given, cycles before its last cycle are reused and only the last cycle
+    onwards is recalculated.
+    """
     # Analyse each cycle in the cycling data
     protocol_summary = protocol_summary or {}
     form_cycle_count = protocol_summary.get("form_cycle_count")
@@ -501,36 +1072,47 @@ def analyse_cycles(
     # TODO: Do we need to filter voltages? e.g. only use 0-5 V
 
     # Get summary stats
-    summary_df = (
-        df.group_by("Cycle")
-        .agg(
+    cycle_aggs = [
+        pl.col("dQ (mAh)").clip(lower_bound=0).sum().alias("Charge capacity (mAh)"),
+        -pl.col("dQ (mAh)").clip(upper_bound=0).sum().alias("Discharge capacity (mAh)"),
+        (pl.col("V (V)") * pl.col("dQ (mAh)").clip(lower_bound=0)).sum().alias("Charge energy (mWh)"),
+        -(pl.col("V (V)") * pl.col("dQ (mAh)").clip(upper_bound=0)).sum().alias("Discharge energy (mWh)"),
+        (
+            (pl.col("I (A)") * pl.col("dQ (mAh)").clip(lower_bound=0)).sum()
+            / pl.col("dQ (mAh)").clip(lower_bound=0).sum()
+        ).alias("Charge average current (A)"),
+        -(
+            (pl.col("I (A)") * pl.col("dQ (mAh)").clip(upper_bound=0)).sum()
+            / pl.col("dQ (mAh)").clip(upper_bound=0).sum()
+        ).alias("Discharge average current (A)"),
+    ]
+    if previous_summary is not None and not previous_summary.is_empty():
+        # The last previous cycle may have been incomplete, recalculate from there
+        from_cycle = previous_summary["Cycle"].max()
+        summary_df = pl.concat(
             [
-                pl.col("dQ (mAh)").clip(lower_bound=0).sum().alias("Charge capacity (mAh)"),
-                -pl.col("dQ (mAh)").clip(upper_bound=0).sum().alias("Discharge capacity (mAh)"),
-                (pl.col("V (V)") * pl.col("dQ (mAh)").clip(lower_bound=0)).sum().alias("Charge energy (mWh)"),
-                -(pl.col("V (V)") * pl.col("dQ (mAh)").clip(upper_bound=0)).sum().alias("Discharge energy (mWh)"),
-                (
-                    (pl.col("I (A)") * pl.col("dQ (mAh)").clip(lower_bound=0)).sum()
-                    / pl.col("dQ (mAh)").clip(lower_bound=0).sum()
-                ).alias("Charge average current (A)"),
-                -(
-                    (pl.col("I (A)") * pl.col("dQ (mAh)").clip(upper_bound=0)).sum()
-                    / pl.col("dQ (mAh)").clip(upper_bound=0).sum()
-                ).alias("Discharge average current (A)"),
-            ]
+                previous_summary.filter(pl.col("Cycle") < from_cycle).select(
+                    "Cycle", *[agg.meta.output_name() for agg in cycle_aggs]
+                ),
+                df.filter(pl.col("Cycle") >= from_cycle).group_by("Cycle").agg(cycle_aggs),
+            ],
+            how="vertical_relaxed",
         )
-        .sort("Cycle")
-        .filter(pl.col("Cycle") > 0)
-    )
+    else:
+        summary_df = df.group_by("Cycle").agg(cycle_aggs)
+    summary_df = summary_df.sort("Cycle").filter(pl.col("Cycle") > 0)
 
     # Try to guess the number of formation cycles if it was not found from the job data
     if not form_cycle_count:
         form_cycle_count = 3
         # Check median current up to 10 cycles, if it changes assume that is the formation cycle
-        median_currents = []
-        for cycle in range(1, 11):
-            df_filtered = df.filter(pl.col("Cycle") == cycle, pl.col("I (A)") > 0)
-            median_currents.append(weighted_median(df_filtered["I (A)"], df_filtered["dQ (mAh)"]))
+        median_current_df = (
+            df.filter(pl.col("Cycle").is_between(1, 10), pl.col("I (A)") > 0)
+            .group_by("Cycle")
+            .agg(weighted_median_expr("I (A)", "dQ (mAh)").alias("Median current (A)"))
+        )
+        median_current = dict(median_current_df.select("Cycle", "Median current (A)").iter_rows())
+        median_currents = [median_current.get(cycle) for cycle in range(1, 11)]
         rounded_current = [f"{x:.2g}" for x in median_currents if x]
         if len(rounded_current) > 2 and len(set(rounded_current)) > 1:
             idx = next((i for i, x in enumerate(rounded_current) if x != rounded_current[0]), None)
@@ -593,6 +1175,90 @@ def analyse_cycles(
     return summary_df, protocol_summary
 
 
+def calc_cycle_curves(df: pl.DataFrame, points: int = CURVE_POINTS) -> pl.DataFrame:
+    """Interpolate every half cycle onto a common capacity grid, and its capacity onto a voltage grid.
+
+    Each cycle is split into charge (dQ > 0) and discharge (dQ < 0). "V at Q (V)" is the voltage at `points` evenly
+    spaced fractions of the half cycle capacity, from 0 to 1. "Q at V (mAh)" is the capacity at `points` evenly
+    spaced voltages from "V start (V)" to "V end (V)", using the running maximum (charge) or minimum (discharge) of
+    the voltage so it is single valued. Overlays, dQ/dV and comparisons of cycles then only need these points, see
+    data_parse.cycle_curve_points.
+
+    Args:
+        df: cycling data with uts, V (V), dQ (mAh) and Cycle
+        points: number of points in each grid
+
+    Returns:
+        pl.DataFrame: one row per half cycle in time order, with Cycle, Direction ("charge" or "discharge"),
+            Capacity (mAh), V start (V), V end (V), V at Q (V) and Q at V (mAh)
+
+    """
+    # dQ is counted from the previous row, so its voltage is the start of a half cycle
+    df = df.with_columns(pl.col("V (V)").shift(1).fill_null(pl.col("V (V)")).alias("V before (V)")).filter(
+        pl.col("Cycle") > 0, pl.col("dQ (mAh)") != 0
+    )
+    cycle = df["Cycle"].to_numpy()
+    uts = df["uts"].to_numpy()
+    v = df["V (V)"].to_numpy().astype(float)
+    v_before = df["V before (V)"].to_numpy().astype(float)
+    dq = df["dQ (mAh)"].to_numpy().astype(float)
+    neg = dq < 0
+
+    # Sort so each cycle and direction is a contiguous segment, keeping time order within segments
+    order = np.lexsort((neg, cycle))
+    cycle, uts, v, v_before, dq, neg = (
+        cycle[order],
+        uts[order],
+        v[order],
+        v_before[order],
+        np.abs(dq[order]),
+        neg[order],
+    )
+    new_segment = np.ones(len(v), dtype=bool)
+    new_segment[1:] = (cycle[1:] != cycle[:-1]) | (neg[1:] != neg[:-1])
+    starts = np.flatnonzero(new_segment)
+    ends = np.append(starts[1:], len(v)) if len(starts) else starts
+
+    grid = np.linspace(0, 1, points)
+    v_at_q = np.empty((len(starts), points), dtype=np.float32)
+    q_at_v = np.empty((len(starts), points), dtype=np.float32)
+    v_start = v_before[starts]
+    v_end = np.empty(len(starts))
+    capacity = np.empty(len(starts))
+    for k, (start, end) in enumerate(zip(starts, ends, strict=True)):
+        # Capacity from zero at the start of the half cycle
+        q = np.concatenate([[0], np.cumsum(dq[start:end])])
+        seg_v = np.concatenate([[v_start[k]], v[start:end]])
+        capacity[k] = q[-1]
+        v_at_q[k] = np.interp(grid * q[-1], q, seg_v)
+        if neg[start]:
+            v_mono = np.minimum.accumulate(seg_v)
+            v_end[k] = v_mono[-1]
+            v_grid = np.linspace(v_start[k], v_end[k], points)
+            q_at_v[k] = np.interp(v_grid[::-1], v_mono[::-1], q[::-1])[::-1]
+        else:
+            v_mono = np.maximum.accumulate(seg_v)
+            v_end[k] = v_mono[-1]
+            q_at_v[k] = np.interp(np.linspace(v_start[k], v_end[k], points), v_mono, q)
+
+    return (
+        pl.DataFrame(
+            {
+                "Cycle": pl.Series(cycle[starts], dtype=pl.Int32),
+                "Direction": pl.Series(np.where(neg[starts], "discharge", "charge"), dtype=pl.String),
+                "Capacity (mAh)": pl.Series(capacity, dtype=pl.Float32),
+                "V start (V)": pl.Series(v_start, dtype=pl.Float32),
+                "V end (V)": pl.Series(v_end, dtype=pl.Float32),
+                "V at Q (V)": pl.Series(v_at_q, dtype=pl.Array(pl.Float32, points)),
+                "Q at V (mAh)": pl.Series(q_at_v, dtype=pl.Array(pl.Float32, points)),
+                "uts": uts[starts],
+            }
+        )
+        .sort("Cycle", "uts")
+        .drop("uts")
+    )
+
+
 def analyse_overall(
     df: pl.DataFrame,
     eis_df: pl.DataFrame | None,
@@ -769,71 +1435,373 @@ def update_results(overall: dict, job_data: list[dict]) -> None:
     dbf.update_results(sample_id, update_row)
 
 
-def analyse_sample(sample_id: str) -> SampleDataBundle:
-    """Analyse a single sample.
+def _file_hash(file: Path) -> str:
+    """SHA-256 hash of the contents of a file."""
+    file_hash = hashlib.sha256()
+    with file.open("rb") as f:
+        while chunk := f.read(2**20):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _read_manifest(sample_folder: Path, sample_id: str) -> dict:
+    """Read the manifest of the last analysis, empty if there is none."""
+    manifest_file = sample_folder / f"manifest.{sample_id}.json"
+    if not manifest_file.exists():
+        return {}
+    with manifest_file.open("r") as f:
+        return json.load(f)
 
-    Will search for the sample in the processed snapshots folder and analyse the cycling data.
 
+def _snapshot_fingerprints(sample_folder: Path, files: list[Path], previous: dict | None = None) -> dict:
+    """Size, modification time and content hash of snapshot files.
+
+    Hashes are reused from a previous manifest if the size and modification time are unchanged.
+    """
+    previous = previous or {}
+    fingerprints = {}
+    for file in files:
+        path = file.relative_to(sample_folder).as_posix()
+        fingerprint = _file_fingerprint(file)
+        old = previous.get(path, {})
+        if old.get("size") == fingerprint["size"] and old.get("mtime_ns") == fingerprint["mtime_ns"]:
+            fingerprint["sha256"] = old["sha256"]
+        else:
+            fingerprint["sha256"] = _file_hash(file)
+        fingerprints[path] = fingerprint
+    return fingerprints
+
+
+def needs_analysis(sample_id: str) -> bool:
+    """Check if the snapshots or analysis version have changed since the last analysis.
+
+    Samples without snapshots have nothing to analyse.
+
+    Only files with a different size or modification time are hashed. If the contents are unchanged, e.g. the file
+    was only touched, the manifest is updated with the new modification time and the sample is not re-analysed.
     """
     sample_folder = get_sample_folder(sample_id)
-    job_files = list(sample_folder.rglob("snapshot.*"))
+    files = sorted(sample_folder.rglob("snapshot.*"))
+    if not files:
+        return False
+    manifest = _read_manifest(sample_folder, sample_id)
+    if manifest.get("analysis_version") != ANALYSIS_VERSION:
+        return True
+    previous = manifest.get("snapshots", {})
+    if {f.relative_to(sample_folder).as_posix() for f in files} != set(previous):
+        return True
+    for file in files:
+        old = previous[file.relative_to(sample_folder).as_posix()]
+        if file.stat().st_size != old.get("size"):
+            return True
+    fingerprints = _snapshot_fingerprints(sample_folder, files, previous)
+    if any(fingerprints[path]["sha256"] != old["sha256"] for path, old in previous.items()):
+        return True
+    if fingerprints != previous:
+        manifest["snapshots"] = fingerprints
+        with (sample_folder / f"manifest.{sample_id}.json").open("w") as f:
+            json.dump(manifest, f, indent=4)
+    return False
+
+
+def analyse_sample(
+    sample_id: str, *, incremental: bool = False, lazy: bool = False, lake: bool = True
+) -> SampleDataBundle:
+    """Analyse a single sample.
 
-    # Read dfs into the correct order
-    job_files, dfs, metadatas = read_and_order_job_files(job_files)
+    Will search for the sample in the processed snapshots folder and analyse the cycling data. The per-cycle and
+    overall results are also written to the lake, see `update_lake`.
 
-    if len(dfs) == 0:
-        msg = f"No data for {sample_id}"
-        raise ValueError(msg)
+    If "Analysis timings path" is set in the config, the time, rows and peak memory of each stage are appended to
+    that file, see aurora_cycler_manager.timing.
 
-    # Merge into one df, plus optional eis df
-    df, eis_df = merge_dfs(dfs)
+    Args:
+        sample_id: Sample ID to analyse
+        incremental: only read snapshot rows newer than the last analysis and append them to the full data as a
+            part, and only update the outputs from the last analysed cycle, falls back to a full analysis if the
+            snapshots have changed in any other way
+        lazy: merge the snapshots lazily and stream the result to the full file, for samples too large to hold in
+            memory several times over
+        lake: update the lake with the results, only turn off if the caller updates the lake itself
+
+    """
+    timer = StageTimer(sample_id, CONFIG.get("Analysis timings path"))
+    try:
+        bundle = _analyse_sample(sample_id, timer, incremental=incremental, lazy=lazy, lake=lake)
+    except Exception as e:
+        timer.close(error=e)
+        raise
+    timer.close()
+    return bundle
 
-    # Merge metadatas together
-    metadata = merge_metadata(job_files, metadatas, sample_id)
 
-    # Get sample and job data
+def _tail_start(files: list[tuple[Path, int | None]], cycle: int) -> float | None:
+    """Find where to start reading full files to get a cycle onwards and the row before it.
+
+    Row groups are aligned to cycles, so the row group statistics are enough. Returns None if all rows must be read.
+    """
+    row_groups = []
+    for file, end_step in files:
+        ranges = [_row_group_ranges(file, column) for column in ("uts", "Cycle", "Step")]
+        if any(r is None for r in ranges):
+            return None
+        row_groups += [
+            (uts[0], cycles[1])
+            for uts, cycles, steps in zip(*ranges, strict=True)
+            if end_step is None or steps[0] < end_step
+        ]
+    first = next((i for i, (_uts, max_cycle) in enumerate(row_groups) if max_cycle >= cycle), len(row_groups))
+    return row_groups[first - 1][0] if first > 0 else None
+
+
+def _analyse_incremental(
+    sample_id: str,
+    timer: StageTimer,
+    kept_full_files: list[tuple[Path, int | None]],
+    df: pl.DataFrame,
+    eis_df: pl.DataFrame | None,
+    metadata: dict,
+) -> tuple[pl.DataFrame, pl.DataFrame, dict, pl.DataFrame, pl.DataFrame, pl.DataFrame | None]:
+    """Update the analysis outputs with the data merged by _merge_incremental.
+
+    Only the new part and the full data from the last analysed cycle are read. The cycles summary and curves of
+    earlier cycles are kept, the shrunk data and levels of detail are only replaced from the last analysed cycle.
+    All rows are read if the number of formation cycles still has to be guessed from the first ten cycles, or the
+    levels of detail change as the data grows.
+
+    Returns:
+        cycles summary, cycle curves, overall summary, shrunk data, levels of detail and EIS data
+
+    """
+    sample_folder = get_sample_folder(sample_id)
     sample_data = metadata.get("sample_data", {})
     job_data = metadata.get("job_data")
+    with timer.stage("extract_voltage_crates"):
+        protocol_summary = extract_voltage_crates(job_data) if job_data else {}
+
+    # The last previous cycle may have been incomplete, recalculate from there
+    previous_summary = pl.read_parquet(sample_folder / f"cycles.{sample_id}.parquet")
+    start_cycle = previous_summary["Cycle"].max() or 1
+    overall_file = sample_folder / f"overall.{sample_id}.json"
+    if not protocol_summary.get("form_cycle_count") and start_cycle > 10 and overall_file.exists():
+        with overall_file.open("r") as f:
+            protocol_summary["form_cycle_count"] = json.load(f).get("Formation cycles")
+    if not protocol_summary.get("form_cycle_count"):
+        start_cycle = 1
+
+    # Downsampled points continue from the last one before the rows read, new levels of detail need all rows
+    n_rows = len(df) + sum(pq.read_metadata(f).num_rows for f, _end_step in kept_full_files)
+    levels = [p for p in sorted(CONFIG.get("LOD levels") or LOD_LEVELS, reverse=True) if 4 <= p < n_rows]
+    previous_shrunk = pl.read_parquet(sample_folder / f"shrunk.{sample_id}.parquet")
+    lod_file = sample_folder / f"lod.{sample_id}.parquet"
+    previous_lod = pl.read_parquet(lod_file) if lod_file.exists() else None
+    previous_levels = (
+        previous_lod["Points"].unique().sort(descending=True).to_list() if previous_lod is not None else []
+    )
+    tail_start = _tail_start(kept_full_files, start_cycle) if n_rows >= 3 and previous_levels == levels else None
+    read_from = tail_start
+    for points in (previous_shrunk, previous_lod):
+        if read_from is not None and points is not None:
+            read_from = points.filter(pl.col("uts") < read_from)["uts"].max()
+
+    with timer.stage("read_full_tail") as record:
+        lfs = [df.lazy()]
+        if kept_full_files:
+            lfs.insert(0, compact_df(scan_full_files(kept_full_files).select(ANALYSIS_COLUMNS), "full"))
+        lf = pl.concat([lf.select(ANALYSIS_COLUMNS) for lf in lfs])
+        if read_from is not None:
+            lf = lf.filter(pl.col("uts") >= read_from)
+        df = lf.collect()
+        record["rows"] = len(df)
+    # Everything before the first row of the start cycle is unchanged
+    start = df.filter(pl.col("Cycle") >= start_cycle)["uts"].min()
+    if start is None:
+        start = tail_start
+
+    with timer.stage("analyse_cycles", rows=len(df)):
+        summary_df, protocol_summary = analyse_cycles(
+            df,
+            mass_mg=sample_data.get("Cathode active material mass (mg)"),
+            protocol_summary=protocol_summary,
+            previous_summary=previous_summary,
+        )
 
-    # Extract info from the protocol information
-    protocol_summary = extract_voltage_crates(job_data) if job_data else {}
+    with timer.stage("calc_cycle_curves", rows=len(df)):
+        curves_df = pl.concat(
+            [
+                pl.read_parquet(sample_folder / f"curves.{sample_id}.parquet").filter(pl.col("Cycle") < start_cycle),
+                calc_cycle_curves(df).filter(pl.col("Cycle") >= start_cycle),
+            ]
+        )
 
-    # Get the per-cycle dataframe
-    summary_df, protocol_summary = analyse_cycles(
-        df,
-        mass_mg=sample_data.get("Cathode active material mass (mg)"),
-        protocol_summary=protocol_summary,
-    )
+    if eis_df is not None:
+        reassign = pl.col("Cycle").is_null()
+        if start is not None:
+            reassign |= pl.col("uts") >= start
+        eis_df = pl.concat(
+            [eis_df.filter(~reassign), _assign_eis_cycles(eis_df.filter(reassign).drop("Cycle"), df)],
+            how="diagonal_relaxed",
+        )
 
-    overall = analyse_overall(
-        df,
-        eis_df,
-        metadata,
-        protocol_summary,
-        summary_df,
-    )
+    with timer.stage("analyse_overall", rows=len(df)):
+        first_row = df if read_from is None else scan_full_files(kept_full_files).select("uts").head(1).collect()
+        overall = analyse_overall(first_row, eis_df, metadata, protocol_summary, summary_df)
+
+    with timer.stage("shrink_df", rows=len(df)):
+        shrunk_df = shrink_df(df) if read_from is None else _update_shrunk(previous_shrunk, df, start, n_rows)
+
+    with timer.stage("build_lod", rows=len(df)):
+        if read_from is None or not levels:
+            lod_df = build_lod(df if read_from is None else df.clear())
+        else:
+            lod_df = _update_lod(previous_lod, df, start, n_rows, levels)
+
+    return summary_df, curves_df, overall, shrunk_df, lod_df, eis_df
+
+
+def _analyse_sample(
+    sample_id: str, timer: StageTimer, *, incremental: bool, lazy: bool, lake: bool
+) -> SampleDataBundle:
+    """Analyse a single sample, timing each stage."""
+    sample_folder = get_sample_folder(sample_id)
+    all_job_files = sorted(sample_folder.rglob("snapshot.*"))
+    with timer.stage("fingerprint_snapshots", rows=len(all_job_files)):
+        manifest = {
+            "analysis_version": ANALYSIS_VERSION,
+            "snapshots": _snapshot_fingerprints(
+                sample_folder, all_job_files, _read_manifest(sample_folder, sample_id).get("snapshots")
+            ),
+        }
+
+    merged = None
+    if incremental:
+        with timer.stage("merge_incremental") as record:
+            merged = _merge_incremental(sample_id, sample_folder, all_job_files)
+            record["rows"] = len(merged[2]) if merged is not None else None
+    tmp_full_file = None
+    if merged is not None:
+        job_files, kept_full_files, df, eis_df, state = merged
+        with timer.stage("merge_metadata"):
+            metadatas = [read_metadata(f) for f in job_files]
+            metadata = merge_metadata(job_files, metadatas, sample_id)
+
+        # Only the tail of the data is analysed, the rest of the outputs are kept
+        df = compact_df(df, "full")
+        summary_df, curves_df, overall, shrunk_df, lod_df, eis_df = _analyse_incremental(
+            sample_id, timer, kept_full_files, df, eis_df, metadata
+        )
+    else:
+        if incremental:
+            logger.info("Running full analysis for %s", sample_id)
+
+        if lazy:
+            with timer.stage("merge_lazy") as record:
+                job_files, df, eis_df, metadata, state, tmp_full_file = _merge_lazy(
+                    sample_id, sample_folder, all_job_files
+                )
+                record["rows"] = len(df)
+        else:
+            # Read dfs into the correct order
+            with timer.stage("read_snapshots") as record:
+                job_files, dfs, metadatas = read_and_order_job_files(all_job_files)
+                n_rows = record["rows"] = sum(len(df) for df in dfs)
+
+            if len(dfs) == 0:
+                msg = f"No data for {sample_id}"
+                raise ValueError(msg)
+
+            # Merge into one df, plus optional eis df
+            with timer.stage("merge_dfs", rows=n_rows):
+                state = _new_analysis_state(sample_folder, all_job_files, job_files, [df.lazy() for df in dfs])
+                df, eis_df, state["last_key"] = _merge_dfs(dfs)
 
-    # Get the shrunk dataframe
-    shrunk_df = shrink_df(df)
+            # Merge metadatas together
+            with timer.stage("merge_metadata"):
+                metadata = merge_metadata(job_files, metadatas, sample_id)
+
+        # Analyse the data as it is stored
+        df = compact_df(df, "full")
+
+        try:
+            # Get sample and job data
+            sample_data = metadata.get("sample_data", {})
+            job_data = metadata.get("job_data")
+
+            # Extract info from the protocol information
+            with timer.stage("extract_voltage_crates"):
+                protocol_summary = extract_voltage_crates(job_data) if job_data else {}
+
+            # Get the per-cycle dataframe
+            with timer.stage("analyse_cycles", rows=len(df)):
+                summary_df, protocol_summary = analyse_cycles(
+                    df,
+                    mass_mg=sample_data.get("Cathode active material mass (mg)"),
+                    protocol_summary=protocol_summary,
+                )
+
+            with timer.stage("calc_cycle_curves", rows=len(df)):
+                curves_df = calc_cycle_curves(df)
+
+            with timer.stage("analyse_overall", rows=len(df)):
+                overall = analyse_overall(
+                    df,
+                    eis_df,
+                    metadata,
+                    protocol_summary,
+                    summary_df,
+                )
+
+            # Get the shrunk dataframe
+            with timer.stage("shrink_df", rows=len(df)):
+                shrunk_df = shrink_df(df)
+
+            # Get the levels of detail for plotting
+            with timer.stage("build_lod", rows=len(df)):
+                lod_df = build_lod(df)
+        except Exception:
+            if tmp_full_file is not None:
+                tmp_full_file.unlink(missing_ok=True)
+            raise
 
     # Save the data
-    df.write_parquet(sample_folder / f"full.{sample_id}.parquet", metadata={"AURORA:metadata": json.dumps(metadata)})
-    if shrunk_df is not None:
-        shrunk_df.write_parquet(sample_folder / f"shrunk.{sample_id}.parquet")
-    if eis_df is not None:
-        eis_df.write_parquet(sample_folder / f"eis.{sample_id}.parquet")
-    if summary_df is not None:
-        summary_df.write_parquet(sample_folder / f"cycles.{sample_id}.parquet")
-    if overall is not None:
-        with (sample_folder / f"overall.{sample_id}.json").open("w") as f:
-            json.dump(overall, f, indent=4)
-    if metadata is not None:
-        with (sample_folder / f"metadata.{sample_id}.json").open("w") as f:
-            json.dump(metadata, f, indent=4)
+    with timer.stage("write_full_file", rows=len(df)):
+        footer = {"AURORA:metadata": json.dumps(metadata), ANALYSIS_STATE_KEY: json.dumps(state)}
+        if merged is not None:
+            _write_full_part(sample_folder, sample_id, kept_full_files, df, footer)
+        else:
+            if tmp_full_file is None:
+                tmp_full_file = sample_folder / f".full.{sample_id}.tmp.parquet"
+                write_full_file(df, tmp_full_file, metadata=footer)
+            _replace_full_file(sample_folder, sample_id, tmp_full_file)
+    with timer.stage("write_results"):
+        if shrunk_df is not None:
+            write_artefact(shrunk_df, sample_folder / f"shrunk.{sample_id}.parquet", "shrunk")
+        if not lod_df.is_empty():
+            write_artefact(lod_df, sample_folder / f"lod.{sample_id}.parquet", "lod")
+        else:
+            (sample_folder / f"lod.{sample_id}.parquet").unlink(missing_ok=True)
+        if eis_df is not None:
+            write_artefact(eis_df, sample_folder / f"eis.{sample_id}.parquet", "eis")
+        if summary_df is not None:
+            write_artefact(summary_df, sample_folder / f"cycles.{sample_id}.parquet", "cycles")
+        write_artefact(curves_df, sample_folder / f"curves.{sample_id}.parquet", "curves")
+        if overall is not None:
+            with (sample_folder / f"overall.{sample_id}.json").open("w") as f:
+                json.dump(overall, f, indent=4)
+        if metadata is not None:
+            with (sample_folder / f"metadata.{sample_id}.json").open("w") as f:
+                json.dump(metadata, f, indent=4)
+        # Written last, so an interrupted analysis is repeated
+        with (sample_folder / f"manifest.{sample_id}.json").open("w") as f:
+            json.dump(manifest, f, indent=4)
+    if lake:
+        with timer.stage("update_lake", rows=len(summary_df) if summary_df is not None else None):
+            _try_update_lake(sample_id, summary_df, overall)
 
     return SampleDataBundle(
         sample_id=sample_id,
-        cycling=df,
+        # Lazy only has some columns in memory, incremental only the new part
+        cycling=df if merged is None and not lazy else None,
         cycling_shrunk=shrunk_df,
         eis=eis_df,
         cycles_summary=summary_df,
@@ -845,7 +1813,8 @@ def analyse_sample(sample_id: str) -> SampleDataBundle:
 def update_sample_metadata(sample_ids: str | list[str]) -> None:
     """Update "sample_data" in metadata of all files.
 
-    Updates full.*.h5, full.*.parquet, cycles.*.json, overall.*.json, metadata.*.json.
+    Updates full.*.h5, cycles.*.json, overall.*.json, metadata.*.json. The metadata in full.*.parquet is only
+    written during analysis, the metadata.*.json sidecar takes precedence when reading it.
 
     Args:
         sample_ids: sample id or list of sample ids to update
@@ -853,10 +1822,14 @@ def update_sample_metadata(sample_ids: str | list[str]) -> None:
     """
     if isinstance(sample_ids, str):
         sample_ids = [sample_ids]
-    for sample_id in sample_ids:
-        # Get updated database data
-        sample_data = dbf.get_sample_data(sample_id)
+    # Get updated database data
+    all_sample_data = dbf.get_samples_data(sample_ids)
+    if missing := [s for s in sample_ids if s not in all_sample_data]:
+        msg = f"Sample IDs {missing} not found in the database"
+        raise ValueError(msg)
 
+    for sample_id in sample_ids:
+        sample_data = all_sample_data[sample_id]
         sample_folder = get_sample_folder(sample_id)
 
         # HDF5 full file
@@ -868,16 +1841,19 @@ def update_sample_metadata(sample_ids: str | list[str]) -> None:
                 del f["metadata"]
                 f.create_dataset("metadata", data=json.dumps(metadata))
 
-        # Parquet full file
-        # Doesn't seem like there is a way to do this without a full file rewrite
+        # JSON metadata sidecar, created from the parquet full file if missing
+        metadata_file = sample_folder / f"metadata.{sample_id}.json"
         full_file = sample_folder / f"full.{sample_id}.parquet"
-        metadata = read_metadata(full_file)
-        df = pl.read_parquet(full_file)
-        metadata["sample_data"] = sample_data
-        df = read_cycling(full_file)
-        df.write_parquet(
-            sample_folder / f"full.{sample_id}.parquet", metadata={"AURORA:metadata": json.dumps(metadata)}
-        )
+        metadata = None
+        if full_file.exists():
+            metadata = read_metadata(full_file)
+        elif metadata_file.exists():
+            with metadata_file.open("r", encoding="utf-8") as f:
+                metadata = json.load(f)
+        if metadata is not None:
+            metadata["sample_data"] = sample_data
+            with metadata_file.open("w", encoding="utf-8") as f:
+                json.dump(metadata, f, indent=4)
 
         # JSON cycles file
         json_file = sample_folder / f"cycles.{sample_id}.json"
@@ -900,14 +1876,107 @@ def update_sample_metadata(sample_ids: str | list[str]) -> None:
             with overall_file.open("w", encoding="utf-8") as f:
                 json.dump(overall, f, indent=4)
 
-        # JSON metadata file
-        metadata_file = sample_folder / f"metadata.{sample_id}.json"
-        if metadata_file.exists():
-            with metadata_file.open("r", encoding="utf-8") as f:
-                metadata = json.load(f)
-                metadata["sample_data"] = sample_data
-            with metadata_file.open("w", encoding="utf-8") as f:
-                json.dump(metadata, f, indent=4)
+        # Lake
+        if (overall := get_overall_summary(sample_id)) is not None:
+            _try_update_lake(sample_id, get_cycles_summary(sample_id), overall)
+
+
+def _lake_lock(file: Path) -> contextlib.AbstractContextManager[None]:
+    """Lock one run of a lake table, so processes updating different samples of a run do not lose updates."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    return file_lock(file.with_name(f".{file.name}.lock"))
+
+
+def _write_lake_partition(df: pl.DataFrame, file: Path, table: str, columns: dict[str, list[str]]) -> None:
+    """Write one run of a lake table, via a temporary file so readers never see a partial file.
+
+    The columns of each sample are stored in the metadata, as the partition has the columns of all samples.
+    """
+    if df.is_empty():
+        file.unlink(missing_ok=True)
+        return
+    df = df.sort(["Sample ID", "Cycle"] if table == "cycles" else "Sample ID", maintain_order=True)
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_name(f".{file.stem}.{os.getpid()}.tmp.parquet")
+    try:
+        write_artefact(df, tmp_file, table, metadata={LAKE_COLUMNS_KEY: json.dumps(columns)})
+        tmp_file.replace(file)
+    finally:
+        tmp_file.unlink(missing_ok=True)
+
+
+def update_lake(sample_id: str, cycles_summary: pl.DataFrame | None, overall: dict | None) -> None:
+    """Replace the results of one sample in the lake.
+
+    The lake holds the per-cycle and overall results of every sample in one parquet file per run, so batches of
+    samples can be read with one scan, see `data_parse.scan_lake`. Each run is locked while it is read and replaced,
+    so processes analysing samples of the same run at the same time do not lose each other's updates. If the lake is
+    out of date it can be rebuilt from the sample files with `rebuild_lake`.
+
+    Args:
+        sample_id: Sample ID to update
+        cycles_summary: per-cycle results, if None the sample is removed from the cycles table
+        overall: overall results, if None the sample is removed from the overall table
+
+    """
+    run_id = run_from_sample(sample_id)
+    new_rows = {
+        "cycles": cycles_summary.select(pl.lit(sample_id).alias("Sample ID"), pl.exclude("Sample ID"))
+        if cycles_summary is not None
+        else None,
+        "overall": pl.DataFrame([{**overall, "Sample ID": sample_id}], strict=False) if overall is not None else None,
+    }
+    for table, df in new_rows.items():
+        file = get_lake_file(table, run_id)
+        with _lake_lock(file):
+            columns, frames = {}, []
+            if file.exists():
+                columns = json.loads(pl.read_parquet_metadata(file).get(LAKE_COLUMNS_KEY, "{}"))
+                frames.append(pl.read_parquet(file).filter(pl.col("Sample ID") != sample_id))
+            columns.pop(sample_id, None)
+            if df is not None:
+                frames.append(df)
+                columns[sample_id] = df.columns
+            if frames:
+                _write_lake_partition(pl.concat(frames, how="diagonal_relaxed"), file, table, columns)
+
+
+def _try_update_lake(sample_id: str, cycles_summary: pl.DataFrame | None, overall: dict | None) -> None:
+    """Update the lake, the sample files are already saved so only log failures."""
+    try:
+        update_lake(sample_id, cycles_summary, overall)
+    except (OSError, pl.exceptions.PolarsError):
+        logger.exception("Failed to update the lake for %s, it can be fixed with rebuild_lake", sample_id)
+
+
+def rebuild_lake(runid_contains: str = "") -> None:
+    """Rebuild the lake from the per-cycle and overall files of every sample, e.g. to fill it for the first time.
+
+    Args:
+        runid_contains (str, optional): only rebuild the runs with this string in the run ID
+
+    """
+    for run_folder in sorted(Path(CONFIG["Data folder path"]).iterdir()):
+        if not run_folder.is_dir() or (runid_contains and runid_contains not in run_folder.name):
+            continue
+        cycles_dfs, overall_dicts = [], []
+        cycles_columns, overall_columns = {}, {}
+        for sample_folder in sorted(run_folder.iterdir()):
+            sample_id = sample_folder.name
+            if (df := get_cycles_summary(sample_id)) is not None:
+                cycles_dfs.append(df.select(pl.lit(sample_id).alias("Sample ID"), pl.exclude("Sample ID")))
+                cycles_columns[sample_id] = cycles_dfs[-1].columns
+            if (overall := get_overall_summary(sample_id)) is not None:
+                overall_dicts.append({**overall, "Sample ID": sample_id})
+                overall_columns[sample_id] = list(overall_dicts[-1])
+        for table, df, columns in [
+            ("cycles", pl.concat(cycles_dfs, how="diagonal_relaxed") if cycles_dfs else pl.DataFrame(), cycles_columns),
+            ("overall", pl.DataFrame(overall_dicts, strict=False, infer_schema_length=None), overall_columns),
+        ]:
+            file = get_lake_file(table, run_folder.name)
+            with _lake_lock(file):
+                _write_lake_partition(df, file, table, columns)
+        logger.info("Rebuilt lake for %s", run_folder.name)
 
 
 def shrink_df(df: pl.DataFrame) -> pl.DataFrame:
@@ -921,28 +1990,20 @@ def shrink_df(df: pl.DataFrame) -> pl.DataFrame:
     if new_length < 3:
         return df.with_columns(pl.lit(None).alias("dQ/dV (mAh/V)"))
 
-    # Calculate cumulative sum
-    df = df.with_columns(pl.col("dQ (mAh)").cum_sum().alias("Q (mAh)"))
-
-    # Define function to apply per group
-    def compute_dqdv(group_df: pl.DataFrame) -> pl.DataFrame:
-        dqdv = calc_dqdv(group_df["V (V)"].to_numpy(), group_df["Q (mAh)"].to_numpy(), group_df["dQ (mAh)"].to_numpy())
-        return group_df.with_columns(pl.Series("dQ/dV (mAh/V)", dqdv))
+    # Calculate cumulative sum, in double precision so rounding does not accumulate
+    df = df.with_columns(pl.col("dQ (mAh)").cast(pl.Float64).cum_sum().alias("Q (mAh)"))
 
-    # Apply to each cycle group
-    df = df.group_by("Cycle", maintain_order=True).map_groups(compute_dqdv).sort("uts")
+    # Calculate dQ/dV for every cycle
+    dqdv = calc_dqdv_cycles(
+        df["Cycle"].to_numpy(),
+        df["V (V)"].to_numpy(),
+        df["Q (mAh)"].to_numpy(),
+        df["dQ (mAh)"].to_numpy(),
+    )
+    df = df.with_columns(pl.Series("dQ/dV (mAh/V)", dqdv))
 
     # Reduce precision of some columns
-    df.cast(
-        {
-            "Cycle": pl.Int16,
-            "V (V)": pl.Float32,
-            "I (A)": pl.Float32,
-            "dQ (mAh)": pl.Float32,
-            "dQ/dV (mAh/V)": pl.Float32,
-            "Q (mAh)": pl.Float32,
-        }
-    )
+    df = compact_df(df, "shrunk")
     s_ds_V = MinMaxLTTBDownsampler().downsample(df["uts"], df["V (V)"], n_out=new_length)
     s_ds_I = MinMaxLTTBDownsampler().downsample(df["uts"], df["I (A)"], n_out=new_length)
     ind = np.sort(np.concatenate([s_ds_V, s_ds_I]))
@@ -951,7 +2012,141 @@ def shrink_df(df: pl.DataFrame) -> pl.DataFrame:
     df = df[ind]
 
     # Recalculate dQ so it cumulates correctly after downsampling
-    return df.with_columns(pl.col("Q (mAh)").diff().fill_null(0).alias("dQ (mAh)")).drop("Q (mAh)")
+    return compact_df(
+        df.with_columns(pl.col("Q (mAh)").diff().fill_null(0).alias("dQ (mAh)")).drop("Q (mAh)"), "shrunk"
+    )
+
+
+def _minmax_lttb(df: pl.DataFrame, n_out: int) -> np.ndarray:
+    """Mask of the rows chosen by MinMaxLTTB on voltage and on current, n_out points each."""
+    keep = np.zeros(len(df), dtype=bool)
+    keep[MinMaxLTTBDownsampler().downsample(df["uts"], df["V (V)"], n_out=n_out)] = True
+    keep[MinMaxLTTBDownsampler().downsample(df["uts"], df["I (A)"], n_out=n_out)] = True
+    return keep
+
+
+def _extend_downsampled(
+    previous: pl.DataFrame, df: pl.DataFrame, start: float, n_rows: int, n_out: int, max_points: int
+) -> pl.DataFrame:
+    """Replace downsampled points from start onwards with points downsampled from the rows in df.
+
+    The last previous point before start is kept, df must start at or before it, and the cumulative capacity
+    "Q (mAh)" continues from it. The rows are downsampled with the same density as downsampling all n_rows rows of
+    the sample to n_out points, and if there are then more than max_points points, all of them are downsampled to
+    n_out points, so the cost does not grow with the length of the experiment.
+
+    Args:
+        previous: downsampled points with uts, V (V), I (A) and dQ (mAh)
+        df: rows with the same columns as previous
+        start: uts of the first changed row
+        n_rows: number of rows in the sample
+        n_out: points to downsample voltage and current to
+        max_points: maximum number of points before downsampling everything again
+
+    Returns:
+        pl.DataFrame: downsampled points with a "Q (mAh)" column
+
+    """
+    head = previous.filter(pl.col("uts") < start).with_columns(
+        pl.col("dQ (mAh)").cast(pl.Float64).cum_sum().alias("Q (mAh)")
+    )
+    tail = (
+        df.filter(pl.col("uts") >= head["uts"][-1])
+        .select(previous.columns)
+        .with_columns(
+            (
+                pl.col("dQ (mAh)").cast(pl.Float64).cum_sum()
+                - pl.col("dQ (mAh)").cast(pl.Float64).first()
+                + head["Q (mAh)"][-1]
+            ).alias("Q (mAh)")
+        )
+    )
+    keep = _minmax_lttb(tail, max(3, -(-n_out * len(tail) // n_rows)))
+    keep[0] = False  # the last previous point
+    df = pl.concat([head, tail.filter(keep)], how="vertical_relaxed")
+    if len(df) > max_points:
+        df = df.filter(_minmax_lttb(df, n_out))
+    return df
+
+
+def _update_shrunk(previous: pl.DataFrame, df: pl.DataFrame, start: float, n_rows: int) -> pl.DataFrame:
+    """Update shrunk data with new rows, see shrink_df and _extend_downsampled.
+
+    dQ/dV is calculated from the rows in df, so can differ from shrink_df in cycles which started before them.
+    """
+    new_length = min(n_rows, n_rows // 20 + 1000, 50000)
+    df = df.select("uts", "V (V)", "I (A)", "dQ (mAh)", "Cycle")
+    dqdv = calc_dqdv_cycles(
+        df["Cycle"].to_numpy(),
+        df["V (V)"].to_numpy(),
+        df["dQ (mAh)"].cast(pl.Float64).cum_sum().to_numpy(),
+        df["dQ (mAh)"].to_numpy(),
+    )
+    df = compact_df(df.with_columns(pl.Series("dQ/dV (mAh/V)", dqdv)), "shrunk")
+    df = _extend_downsampled(previous, df, start, n_rows, new_length, 2 * new_length)
+    return compact_df(
+        df.with_columns(pl.col("Q (mAh)").diff().fill_null(0).alias("dQ (mAh)")).drop("Q (mAh)"), "shrunk"
+    )
+
+
+def build_lod(df: pl.DataFrame, levels: Iterable[int] | None = None) -> pl.DataFrame:
+    """Downsample the time series to several levels of detail, for plotting any time window at a suitable density.
+
+    Points are chosen with MinMaxLTTB on voltage and current, so peaks are kept. Each level is downsampled from the
+    next finer one, so only the finest level costs a pass over all the data. Levels with at least as many points as
+    the data are not built, the full file is used instead.
+
+    Args:
+        df: cycling data with uts, V (V), I (A), dQ (mAh) and Cycle
+        levels: maximum points in each level, default "LOD levels" in the config or LOD_LEVELS
+
+    Returns:
+        pl.DataFrame: all levels, with the level in the "Points" column, sorted by level and time
+
+    """
+    levels = sorted(levels or CONFIG.get("LOD levels") or LOD_LEVELS, reverse=True)
+    # Cumulative capacity in double precision, so dQ can be recalculated after downsampling
+    df = df.select("uts", "V (V)", "I (A)", "Cycle", pl.col("dQ (mAh)").cast(pl.Float64).cum_sum().alias("Q (mAh)"))
+    return _lod_levels(df, levels)
+
+
+def _lod_levels(df: pl.DataFrame, levels: list[int], *, finest: bool = False) -> pl.DataFrame:
+    """Downsample each level from the next finer one, df is already the finest level if finest is True."""
+    lods = [df.with_columns(pl.lit(levels[0], dtype=pl.Int32).alias("Points"))] if finest else []
+    for points in levels[len(lods) :]:
+        if points >= len(df) or points < 4:
+            continue
+        df = df.filter(_minmax_lttb(df, points // 2))
+        lods.append(df.with_columns(pl.lit(points, dtype=pl.Int32).alias("Points")))
+    # Coarsest level first, each level is already in time order
+    lods.reverse()
+    lod_df = pl.concat(lods) if lods else df.clear().with_columns(pl.lit(None, dtype=pl.Int32).alias("Points"))
+    lod_df = lod_df.select(
+        "uts",
+        "V (V)",
+        "I (A)",
+        pl.col("Q (mAh)").diff().fill_null(0).over("Points").alias("dQ (mAh)"),
+        "Cycle",
+        "Points",
+    )
+    return compact_df(lod_df, "lod")
+
+
+def _update_lod(previous: pl.DataFrame, df: pl.DataFrame, start: float, n_rows: int, levels: list[int]) -> pl.DataFrame:
+    """Update levels of detail with new rows, see build_lod and _extend_downsampled.
+
+    Only the finest level is updated from the rows, the coarser levels are downsampled from it again.
+    """
+    columns = ["uts", "V (V)", "I (A)", "dQ (mAh)", "Cycle"]
+    finest = _extend_downsampled(
+        previous.filter(pl.col("Points") == levels[0]).select(columns),
+        df.select(columns),
+        start,
+        n_rows,
+        levels[0] // 2,
+        levels[0],
+    )
+    return _lod_levels(finest.drop("dQ (mAh)"), levels, finest=True)
 
 
 def shrink_all_samples(sampleid_contains: str = "") -> None:
@@ -970,35 +2165,347 @@ def shrink_all_samples(sampleid_contains: str = "") -> None:
                 try:
                     df = get_cycling(sample_id)
                     df = shrink_df(df)
-                    df.write_parquet(sample_folder / f"shrunk.{sample_id}.parquet")
+                    write_artefact(df, sample_folder / f"shrunk.{sample_id}.parquet", "shrunk")
                     logger.info("Shrunk %s", sample_id)
                 except (KeyError, ValueError, PermissionError, RuntimeError, FileNotFoundError):
                     logger.exception("Failed to shrink %s", sample_id)
 
 
-def analyse_all_samples(
-    sampleid_contains: str = "",
-    mode: Literal["always", "new_data", "if_not_exists"] = "new_data",
+def _stored_outputs(sampleid_contains: str = "") -> Iterator[tuple[str, str, Path]]:
+    """Find parquet analysis outputs in the data folder, yield the Sample ID, kind of output and file.
+
+    Parts of the full file appended by incremental analysis are included as "full".
+    """
+    for file in sorted(Path(CONFIG["Data folder path"]).glob("*/*/*.parquet")):
+        artefact, _, rest = file.name.partition(".")
+        sample_id = rest.removesuffix(".parquet").partition(".part-")[0]
+        if artefact in storage_dtypes and sample_id == file.parent.name and sampleid_contains in sample_id:
+            yield sample_id, artefact, file
+
+
+def _footer_metadata(file: Path) -> dict[str, str]:
+    """Key-value metadata of a parquet file, without the arrow schema."""
+    return {
+        k.decode(): v.decode()
+        for k, v in (pq.read_metadata(file).metadata or {}).items()
+        if not k.startswith(b"ARROW:")
+    }
+
+
+def _write_compact(
+    df: pl.DataFrame | Iterable[pl.DataFrame], file: Path, artefact: str, metadata: dict[str, str]
 ) -> None:
-    """Analyse all samples in the processed snapshots folder.
+    """Write an analysis output with the storage profile."""
+    if artefact == "full":
+        write_full_file(df, file, metadata)
+    else:
+        write_artefact(pl.concat(df) if not isinstance(df, pl.DataFrame) else df, file, artefact, metadata)
+
+
+def _precision_loss(df: pl.DataFrame, compact: pl.DataFrame) -> dict:
+    """Find the largest relative change in any column, and in the discharge capacity of any cycle."""
+    loss: dict = {"Largest change": None, "Max relative error": 0.0, "Max capacity error (%)": None}
+    for col in df.columns:
+        if not df[col].dtype.is_float() or df[col].dtype == compact[col].dtype:
+            continue
+        original = df[col].cast(pl.Float64).fill_nan(None)
+        error = ((compact[col].cast(pl.Float64).fill_nan(None) - original).abs() / original.abs()).filter(original != 0)
+        if (max_error := error.max()) is not None and max_error > loss["Max relative error"]:
+            loss["Largest change"] = col
+            loss["Max relative error"] = max_error
+    if {"dQ (mAh)", "Cycle"} <= set(df.columns):
+        capacities = [
+            d.group_by("Cycle")
+            .agg(-pl.col("dQ (mAh)").cast(pl.Float64).clip(upper_bound=0).sum())
+            .sort("Cycle")["dQ (mAh)"]
+            for d in (df, compact)
+        ]
+        error = ((capacities[1] - capacities[0]).abs() / capacities[0]).filter(capacities[0] > 0)
+        loss["Max capacity error (%)"] = 100 * error.max() if not error.is_empty() else None
+    return loss
 
-    Args: sampleid_contains (str, optional): only analyse samples with this
-        string in the sampleid
+
+def verify_storage(sampleid_contains: str = "") -> pl.DataFrame:
+    """Report the size saving and precision loss of the storage profile for existing analysis outputs.
+
+    Every parquet output in the data folder is written to a temporary folder with the compact dtypes and configured
+    compression, then compared to the original. Nothing in the data folder is changed, use migrate_storage to
+    rewrite the files.
+
+    Args:
+        sampleid_contains (str, optional): only check samples with this string in the sampleid
+
+    Returns:
+        pl.DataFrame: one row per file, with the size before and after, the column with the largest relative change
+            and that change, and the largest relative change of the discharge capacity of any cycle
 
     """
-    samples_to_analyse = dbf.find_new_data(mode)
+    report = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for sample_id, artefact, file in _stored_outputs(sampleid_contains):
+            row = {"Sample ID": sample_id, "Output": artefact, "Size (MB)": file.stat().st_size / 2**20}
+            compact_file = Path(tmp_dir) / file.name
+            try:
+                df = pl.read_parquet(file)
+                _write_compact(df, compact_file, artefact, _footer_metadata(file))
+                compact = pl.read_parquet(compact_file)
+            except (pl.exceptions.PolarsError, ValueError, OSError) as e:
+                logger.exception("Failed to verify %s of %s", artefact, sample_id)
+                report.append({**row, "Error": str(e)})
+                continue
+            compact_size = compact_file.stat().st_size / 2**20
+            report.append(
+                {
+                    **row,
+                    "Rows": len(df),
+                    "Compact size (MB)": compact_size,
+                    "Saving (%)": 100 * (1 - compact_size / row["Size (MB)"]),
+                    **_precision_loss(df, compact),
+                }
+            )
+            compact_file.unlink()
+    report_df = pl.DataFrame(
+        report,
+        schema={
+            "Sample ID": pl.String,
+            "Output": pl.String,
+            "Rows": pl.Int64,
+            "Size (MB)": pl.Float64,
+            "Compact size (MB)": pl.Float64,
+            "Saving (%)": pl.Float64,
+            "Largest change": pl.String,
+            "Max relative error": pl.Float64,
+            "Max capacity error (%)": pl.Float64,
+            "Error": pl.String,
+        },
+    )
+    logger.info(
+        "Storage profile would reduce %d files from %.1f MB to %.1f MB",
+        report_df["Compact size (MB)"].count(),
+        report_df.filter(pl.col("Compact size (MB)").is_not_null())["Size (MB)"].sum(),
+        report_df["Compact size (MB)"].sum(),
+    )
+    return report_df
+
+
+def migrate_storage(sampleid_contains: str = "") -> None:
+    """Rewrite existing analysis outputs with the storage profile.
+
+    Check the precision loss with verify_storage first. Each file is written next to the original and then replaces
+    it, the parquet metadata, including the state for incremental analysis, is kept.
+
+    Args:
+        sampleid_contains (str, optional): only migrate samples with this string in the sampleid
+
+    """
+    for sample_id, artefact, file in _stored_outputs(sampleid_contains):
+        tmp_file = file.with_name(f".{file.stem}.tmp.parquet")
+        try:
+            # Full files can be large, stream them in batches
+            _write_compact(pl.scan_parquet(file).collect_batches(), tmp_file, artefact, _footer_metadata(file))
+            tmp_file.replace(file)
+            logger.info("Migrated %s of %s", artefact, sample_id)
+        except (pl.exceptions.PolarsError, ValueError, OSError):
+            tmp_file.unlink(missing_ok=True)
+            logger.exception("Failed to migrate %s of %s", artefact, sample_id)
+
+
+def _samples_to_analyse(
+    sampleid_contains: str,
+    mode: Literal["always", "new_data", "if_not_exists"],
+) -> list[str]:
+    """Get the sample IDs in the data folder which should be analysed."""
+    samples_to_analyse = dbf.find_new_data(mode) if mode == "if_not_exists" else []
+    sample_ids = []
     for run_folder in Path(CONFIG["Data folder path"]).iterdir():
         if run_folder.is_dir():
             for sample in run_folder.iterdir():
                 if sampleid_contains and sampleid_contains not in sample.name:
                     continue
-                if mode != "always" and sample.name not in samples_to_analyse:
+                if mode == "if_not_exists" and sample.name not in samples_to_analyse:
+                    continue
+                if mode == "new_data" and not needs_analysis(sample.name):
                     continue
+                sample_ids.append(sample.name)
+    return sample_ids
+
+
+def _process_memory_mb(pid: int) -> float | None:
+    """Resident memory of a process in MB, read from /proc so only available on Linux."""
+    try:
+        with Path(f"/proc/{pid}/statm").open() as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _analyse_sample_worker(sample_id: str, incremental: bool, lazy: bool, conn: Connection) -> None:
+    """Analyse one sample in a child process, send (success, error) back through the pipe."""
+    try:
+        # The parent updates the lake, so processes do not overwrite each other's updates
+        analyse_sample(sample_id, incremental=incremental, lazy=lazy, lake=False)
+        conn.send((True, None))
+    except Exception as e:
+        conn.send((False, f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _analyse_samples_in_processes(
+    sample_ids: list[str],
+    incremental: bool,
+    lazy: bool,
+    workers: int,
+    timeout: float | None,
+    max_memory_mb: float | None,
+) -> list[dict]:
+    """Analyse samples with up to `workers` child processes, one process per sample.
+
+    Each sample gets a fresh process, so it can be killed on timeout and any
+    memory it used is returned to the system when it finishes. The resident
+    memory of each process is checked several times a second, and the process
+    is killed if it uses more than max_memory_mb. Limiting the address space
+    instead would fail healthy samples, as polars reserves much more virtual
+    memory than it uses.
+    """
+    if max_memory_mb and _process_memory_mb(os.getpid()) is None:
+        logger.warning("Memory limit is only supported on Linux, ignoring")
+        max_memory_mb = None
+    ctx = multiprocessing.get_context("spawn")  # polars can deadlock in forked processes
+    pending = list(reversed(sample_ids))
+    running: dict[str, tuple] = {}
+    report = []
+    while pending or running:
+        while pending and len(running) < workers:
+            sample_id = pending.pop()
+            parent_conn, child_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(
+                target=_analyse_sample_worker,
+                args=(sample_id, incremental, lazy, child_conn),
+                name=f"analyse-{sample_id}",
+            )
+            process.start()
+            child_conn.close()
+            running[sample_id] = (process, parent_conn, monotonic())
+
+        wait([p.sentinel for p, _, _ in running.values()], timeout=MEMORY_CHECK_INTERVAL if max_memory_mb else 1)
+
+        for sample_id, (process, conn, t_start) in list(running.items()):
+            duration = monotonic() - t_start
+            if conn.poll() or not process.is_alive():
+                # The process may send its result and exit after the poll, so read the pipe in both cases
                 try:
-                    analyse_sample(sample.name)
-                    logger.info("Analysed %s", sample.name)
-                except (KeyError, ValueError, PermissionError, RuntimeError, FileNotFoundError, TypeError):
-                    logger.exception("Failed to analyse %s", sample.name)
+                    success, error = conn.recv()
+                    status = "success" if success else "failed"
+                except EOFError:  # process died without sending a result
+                    process.join()
+                    status = "failed"
+                    error = f"Process exited with code {process.exitcode}"
+            elif timeout and duration > timeout:
+                process.kill()
+                status = "timeout"
+                error = f"Timed out after {timeout} s"
+            elif max_memory_mb and (memory_mb := _process_memory_mb(process.pid) or 0) > max_memory_mb:
+                process.kill()
+                status = "failed"
+                error = f"Used {memory_mb:.0f} MB, more than the limit of {max_memory_mb} MB"
+            else:
+                continue
+            process.join()
+            conn.close()
+            del running[sample_id]
+            report.append({"Sample ID": sample_id, "Status": status, "Duration (s)": duration, "Error": error})
+            if status == "success":
+                _try_update_lake(sample_id, get_cycles_summary(sample_id), get_overall_summary(sample_id))
+                logger.info("Analysed %s", sample_id)
+            else:
+                logger.error("Failed to analyse %s: %s", sample_id, error)
+    return report
+
+
+def analyse_samples(
+    sample_ids: list[str],
+    *,
+    incremental: bool = True,
+    lazy: bool = False,
+    workers: int = 1,
+    timeout: float | None = None,
+    max_memory_mb: float | None = None,
+) -> list[dict]:
+    """Analyse a list of samples, optionally in parallel.
+
+    Args:
+        sample_ids (list[str]): samples to analyse
+        incremental (bool, optional): only analyse data newer than the last analysis where possible
+        lazy (bool, optional): merge snapshots lazily to limit memory use, see `analyse_sample`
+        workers (int, optional): number of samples to analyse in parallel, if more than 1, or if
+            timeout or max_memory_mb are set, each sample is analysed in a separate process
+        timeout (float, optional): kill the analysis of a sample after this many seconds
+        max_memory_mb (float, optional): resident memory limit for each analysis process in MB,
+            the process is killed if it uses more, only supported on Linux
+
+    Returns:
+        list[dict]: report with Sample ID, Status, Duration (s) and Error for each sample
+
+    """
+    if workers > 1 or timeout or max_memory_mb:
+        report = _analyse_samples_in_processes(sample_ids, incremental, lazy, max(workers, 1), timeout, max_memory_mb)
+    else:
+        report = []
+        for sample_id in sample_ids:
+            t_start = monotonic()
+            try:
+                analyse_sample(sample_id, incremental=incremental, lazy=lazy)
+                logger.info("Analysed %s", sample_id)
+                status, error = "success", None
+            except (KeyError, ValueError, RuntimeError, TypeError, OSError, pl.exceptions.PolarsError) as e:
+                logger.exception("Failed to analyse %s", sample_id)
+                status, error = "failed", f"{type(e).__name__}: {e}"
+            report.append(
+                {"Sample ID": sample_id, "Status": status, "Duration (s)": monotonic() - t_start, "Error": error}
+            )
+    n_success = sum(r["Status"] == "success" for r in report)
+    logger.info(
+        "Analysed %d samples in total: %d succeeded, %d failed",
+        len(report),
+        n_success,
+        len(report) - n_success,
+    )
+    return report
+
+
+def analyse_all_samples(
+    sampleid_contains: str = "",
+    mode: Literal["always", "new_data", "if_not_exists"] = "new_data",
+    *,
+    incremental: bool = True,
+    lazy: bool = False,
+    workers: int = 1,
+    timeout: float | None = None,
+    max_memory_mb: float | None = None,
+) -> list[dict]:
+    """Analyse all samples in the processed snapshots folder.
+
+    Args: sampleid_contains (str, optional): only analyse samples with this
+        string in the sampleid
+        mode (str, optional): which samples to analyse
+            "new_data": snapshots or analysis version changed since the last analysis, see `needs_analysis`
+            "if_not_exists": samples never analysed according to the database
+            "always": all samples
+        incremental, lazy, workers, timeout, max_memory_mb: see `analyse_samples`
+
+    Returns:
+        list[dict]: report with Sample ID, Status, Duration (s) and Error for each sample
+
+    """
+    return analyse_samples(
+        _samples_to_analyse(sampleid_contains, mode),
+        incremental=incremental,
+        lazy=lazy,
+        workers=workers,
+        timeout=timeout,
+        max_memory_mb=max_memory_mb,
+    )
 
 
 def analyse_batch(plot_name: str, batch: dict) -> None:
@@ -1010,14 +2517,15 @@ def analyse_batch(plot_name: str, batch: dict) -> None:
     summary_dfs = []
     overall_dicts = []
     metadata: dict[str, dict] = {"sample_metadata": {}}
+    all_summary_dfs, all_overall_dicts = get_batch_summaries(samples)
     for sample in samples:
         # get the anaylsed data
-        summary_df = get_cycles_summary(sample)
+        summary_df = all_summary_dfs.get(sample)
         if summary_df is not None:
             summary_df = summary_df.with_columns(pl.lit(sample).alias("Sample ID"))
             summary_df = summary_df.select([col for col in summary_df.columns if summary_df[col].dtype != pl.Null])
             summary_dfs.append(summary_df)
-            overall_dicts.append(get_overall_summary(sample))
+            overall_dicts.append(all_overall_dicts.get(sample))
             metadata["sample_metadata"][sample] = get_metadata(sample)
     if len(summary_dfs) == 0:
         msg = "No cycling data found for any sample"
@@ -1134,3 +2642,55 @@ def calc_dqdv(v: np.ndarray, q: np.ndarray, dq: np.ndarray) -> np.ndarray:
 
     # Divide by zero -> np.nan
     return np.divide(1, dvdq, out=np.full_like(dvdq, np.nan, dtype=float), where=dvdq != 0)
+
+
+def calc_dqdv_cycles(cycle: np.ndarray, v: np.ndarray, q: np.ndarray, dq: np.ndarray) -> np.ndarray:
+    """Calculate dQ/dV for all cycles in one pass, same result as `calc_dqdv` applied to each cycle.
+
+    Rows are grouped into segments by cycle and by sign of dQ. Within each segment the smoothed derivative only
+    needs four points, as the centred difference of a moving average over 2h+1 points at i is
+    (x[i+h+1] + x[i+h] - x[i-h] - x[i-h-1]) / (2h+1), and the window size cancels in dV/dQ.
+    """
+    v, q, dq = (np.asarray(x, dtype=float) for x in (v, q, dq))
+    n_rows = len(v)
+    dqdv = np.full(n_rows, np.nan)
+    if n_rows == 0:
+        return dqdv
+    neg = ~(dq >= 0)
+
+    # Sort so each cycle and sign is a contiguous segment, keeping time order within segments
+    order = np.lexsort((neg, cycle))
+    v_s, q_s, dq_s, neg_s, cycle_s = v[order], q[order], dq[order], neg[order], cycle[order]
+    new_segment = np.ones(n_rows, dtype=bool)
+    new_segment[1:] = (cycle_s[1:] != cycle_s[:-1]) | (neg_s[1:] != neg_s[:-1])
+    starts = np.flatnonzero(new_segment)
+    lengths = np.diff(np.append(starts, n_rows))
+    segment = np.cumsum(new_segment) - 1
+
+    # Remove end points which can be problematic, e.g. with CV steps
+    v_max = np.maximum.reduceat(v_s, starts)[segment]
+    v_min = np.minimum.reduceat(v_s, starts)[segment]
+    bad = (v_s > v_max * 0.999) | (v_s < v_min * 1.001) | (np.abs(dq_s) < 1e-9)
+
+    # Adaptive odd window 2h+1, at least 5 points
+    npoints = np.maximum(5, np.add.reduceat(~bad, starts) // 25)
+    h = (npoints + (npoints % 2 == 0)) // 2
+    h_row = h[segment]
+
+    # Moving average is nan for the first h and last h+1 points, derivative also needs neighbours
+    i = np.arange(n_rows) - starts[segment]
+    valid = (lengths[segment] > 5) & (i >= h_row + 1) & (i <= lengths[segment] - h_row - 3) & ~bad
+    rows = np.flatnonzero(valid)
+    a = rows + h_row[rows] + 1
+    b = rows + h_row[rows]
+    c = rows - h_row[rows]
+    d = rows - h_row[rows] - 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dvdq = (v_s[a] + v_s[b] - v_s[c] - v_s[d]) / (q_s[a] + q_s[b] - q_s[c] - q_s[d])
+        # for any 3 points where Q direction changes sign set to nan
+        dvdq[(q_s[b] - q_s[d]) * (q_s[a] - q_s[c]) < 0] = np.nan
+        dvdq[neg_s[rows]] *= -1
+        # Divide by zero -> np.nan
+        dqdv_rows = np.divide(1, dvdq, out=np.full_like(dvdq, np.nan), where=dvdq != 0)
+    dqdv[order[rows]] = dqdv_rows
+    return dqdv
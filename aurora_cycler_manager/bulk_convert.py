@@ -0,0 +1,433 @@
+"""Copyright © 2025-2026, Empa.
+
+Convert many raw files in parallel, e.g. to rebuild all snapshots after a schema change.
+
+Files are parsed by a pool of processes, which only write the snapshot parquet files. The database is updated by this
+process in batches, then the affected samples are analysed in parallel. Progress is saved to a checkpoint file after
+every batch, so an interrupted rebuild continues where it stopped.
+
+Used by neware_harvester.convert_all_neware_data and eclab_harvester.convert_all_mprs.
+
+The harvester main functions use run_pipeline instead, which converts files while others are still downloading, and
+analyses samples while other files are still converting.
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from collections import Counter
+from collections.abc import Callable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
+from pathlib import Path
+from time import monotonic
+
+import polars as pl
+from tqdm import tqdm
+
+import aurora_cycler_manager.database_funcs as dbf
+from aurora_cycler_manager.analysis import analyse_samples
+from aurora_cycler_manager.config import get_config
+
+logger = logging.getLogger(__name__)
+CONFIG = get_config()
+
+BATCH_SIZE = 100
+CONVERT_WORKERS = 1
+ANALYSE_WORKERS = 1
+PIPELINE_QUEUE_SIZE = 32
+
+
+def _file_state(file: Path) -> dict:
+    """Size and modification time, to check if a file or folder changed since it was converted."""
+    stats = [f.stat() for f in file.iterdir() if f.is_file()] if file.is_dir() else [file.stat()]
+    return {"Size": sum(s.st_size for s in stats), "Modified": max((s.st_mtime for s in stats), default=0.0)}
+
+
+def _load_checkpoint(checkpoint_path: Path) -> dict:
+    """Read the files converted and samples analysed by an interrupted run."""
+    if checkpoint_path.exists():
+        try:
+            with checkpoint_path.open() as f:
+                checkpoint = json.load(f)
+            logger.info(
+                "Resuming from %s, %d files already converted and %d samples analysed",
+                checkpoint_path,
+                len(checkpoint["Converted"]),
+                len(checkpoint["Analysed"]),
+            )
+        except (json.JSONDecodeError, KeyError):
+            logger.warning("Ignoring invalid checkpoint %s", checkpoint_path)
+        else:
+            return checkpoint
+    return {"Converted": {}, "Analysed": []}
+
+
+def _save_checkpoint(checkpoint_path: Path, checkpoint: dict) -> None:
+    """Write the checkpoint to a temporary file first, so it is never left half written."""
+    tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+    with tmp_path.open("w") as f:
+        json.dump(checkpoint, f)
+    tmp_path.replace(checkpoint_path)
+
+
+def write_snapshot(df: pl.DataFrame, parquet_filepath: Path, metadata: dict[str, str]) -> None:
+    """Write a snapshot parquet file via a temporary file, so the analysis never reads a partial file."""
+    parquet_filepath.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = parquet_filepath.with_name(f".{parquet_filepath.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        df.write_parquet(tmp_path, metadata=metadata)
+        tmp_path.replace(parquet_filepath)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _convert_file(
+    convert_file: Callable[[Path], dict | None], file: Path
+) -> tuple[Path, str, dict | None, float, str | None]:
+    """Convert one file, return (file, status, record, duration, error) instead of raising."""
+    t_start = monotonic()
+    try:
+        record = convert_file(file)
+    except Exception as e:
+        logger.exception("Error converting %s", file)
+        return file, "failed", None, monotonic() - t_start, f"{type(e).__name__}: {e}"
+    return file, ("success" if record else "skipped"), record, monotonic() - t_start, None
+
+
+def _convert_files(
+    files: list[Path],
+    convert_file: Callable[[Path], dict | None],
+    workers: int,
+) -> Iterator[tuple[Path, str, dict | None, float, str | None]]:
+    """Yield the result of each file as it is converted, in a process pool if workers > 1."""
+    if workers <= 1:
+        for file in files:
+            yield _convert_file(convert_file, file)
+        return
+    # polars can deadlock in forked processes
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        futures = [executor.submit(_convert_file, convert_file, file) for file in files]
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def convert_files(
+    files: list[Path],
+    convert_file: Callable[[Path], dict | None],
+    update_database: Callable[[list[dict]], None],
+    checkpoint_path: Path,
+    *,
+    workers: int = 1,
+    batch_size: int = BATCH_SIZE,
+    resume: bool = True,
+    analyse: bool = True,
+    progress: bool = True,
+    timeout: float | None = None,
+    max_memory_mb: float | None = None,
+) -> tuple[list[dict], list[dict]]:
+    """Convert files across a process pool, update the database in batches, then analyse the samples.
+
+    Args:
+        files (list[Path]): raw files to convert
+        convert_file (Callable): converts one file and saves the snapshot without writing to the database, must be
+            picklable (e.g. a module level function or a functools.partial of one). Returns a record with at least
+            "Sample ID" and "Last snapshot", or None if the file does not belong to a sample.
+        update_database (Callable): writes a batch of records to the database, the "Last snapshot" of the results
+            is updated afterwards
+        checkpoint_path (Path): json file recording progress, deleted when finished
+        workers (int, optional): number of processes used to convert files and analyse samples
+        batch_size (int, optional): number of files converted between database updates and checkpoints
+        resume (bool, optional): continue from the checkpoint if it exists, skipping files that are unchanged since
+            they were converted, otherwise start again
+        analyse (bool, optional): analyse the samples of the converted files
+        progress (bool, optional): show progress bars
+        timeout (float, optional): kill the analysis of a sample after this many seconds
+        max_memory_mb (float, optional): memory limit for each analysis process in MB
+
+    Returns:
+        list[dict]: report with File, Sample ID, Status, Duration (s) and Error for each file converted
+        list[dict]: report with Sample ID, Status, Duration (s) and Error for each sample analysed
+
+    """
+    checkpoint = _load_checkpoint(checkpoint_path) if resume else {"Converted": {}, "Analysed": []}
+    converted: dict[str, dict] = checkpoint["Converted"]
+    todo = [
+        file
+        for file in files
+        if str(file) not in converted or {k: converted[str(file)][k] for k in ("Size", "Modified")} != _file_state(file)
+    ]
+
+    report: list[dict] = []
+    pending: list[tuple[Path, dict | None]] = []
+
+    def flush() -> None:
+        """Write the pending records to the database, then record the files in the checkpoint."""
+        records = [record for _file, record in pending if record]
+        if records:
+            update_database(records)
+            last_snapshots: dict[str, str] = {}
+            for record in records:
+                sample_id, last_snapshot = record["Sample ID"], record["Last snapshot"]
+                last_snapshots[sample_id] = max(last_snapshots.get(sample_id, last_snapshot), last_snapshot)
+            dbf.update_results_batch({s: {"Last snapshot": t} for s, t in last_snapshots.items()})
+        for file, record in pending:
+            converted[str(file)] = {**_file_state(file), "Sample ID": record["Sample ID"] if record else None}
+        _save_checkpoint(checkpoint_path, checkpoint)
+        pending.clear()
+
+    logger.info("Converting %d files with %d workers, %d already converted", len(todo), workers, len(files) - len(todo))
+    try:
+        with (
+            tqdm(
+                total=len(files), initial=len(files) - len(todo), desc="Converting", unit="file", disable=not progress
+            ) as bar,
+            closing(_convert_files(todo, convert_file, workers)) as results,
+        ):
+            for file, status, record, duration, error in results:
+                report.append(
+                    {
+                        "File": str(file),
+                        "Sample ID": record["Sample ID"] if record else None,
+                        "Status": status,
+                        "Duration (s)": duration,
+                        "Error": error,
+                    }
+                )
+                # Failed files are not checkpointed, so they are tried again when resuming
+                if status != "failed":
+                    pending.append((file, record))
+                if len(pending) >= batch_size:
+                    flush()
+                bar.update()
+    finally:
+        # Keep the files converted so far if interrupted
+        flush()
+
+    analysed = set(checkpoint["Analysed"])
+    sample_ids = sorted({c["Sample ID"] for c in converted.values() if c["Sample ID"]} - analysed) if analyse else []
+    if analyse:
+        logger.info(
+            "Analysing %d samples with %d workers, %d already analysed", len(sample_ids), workers, len(analysed)
+        )
+    analysis_report = []
+    with tqdm(total=len(sample_ids), desc="Analysing", unit="sample", disable=not progress) as bar:
+        for i in range(0, len(sample_ids), batch_size):
+            batch = sample_ids[i : i + batch_size]
+            batch_report = analyse_samples(
+                batch, incremental=False, workers=workers, timeout=timeout, max_memory_mb=max_memory_mb
+            )
+            analysis_report += batch_report
+            checkpoint["Analysed"] += [r["Sample ID"] for r in batch_report if r["Status"] == "success"]
+            _save_checkpoint(checkpoint_path, checkpoint)
+            bar.update(len(batch))
+
+    checkpoint_path.unlink()
+    n_failed = sum(r["Status"] == "failed" for r in report)
+    n_analysis_failed = sum(r["Status"] != "success" for r in analysis_report)
+    logger.info(
+        "Converted %d files, %d failed, and analysed %d samples, %d failed",
+        len(report) - n_failed,
+        n_failed,
+        len(analysis_report) - n_analysis_failed,
+        n_analysis_failed,
+    )
+    return report, analysis_report
+
+
+def run_pipeline(
+    harvest: Callable[[Callable[[Path], None]], object],
+    convert_file: Callable[[Path], dict | None],
+    update_database: Callable[[list[dict]], None],
+    *,
+    get_sample_id: Callable[[Path], str | None] | None = None,
+    convert_workers: int | None = None,
+    analyse_workers: int | None = None,
+    queue_size: int | None = None,
+) -> list[dict]:
+    """Harvest, convert and analyse at the same time, handing on each file and sample as soon as it is ready.
+
+    The harvest runs in one thread and puts each copied file on a queue. Converter threads take files from the queue,
+    convert them, update the database and put the sample on a second queue. The analyser takes all the samples waiting
+    on that queue and analyses them incrementally. Both queues are bounded, so a slow stage holds back the stages
+    before it instead of letting files pile up. A sample is not analysed while any of its files are being converted,
+    it is analysed once they are all done.
+
+    Args:
+        harvest: copies the new files, called with a function to call with each file as soon as it is copied
+        convert_file: converts one file without writing to the database, see `convert_files`
+        update_database: writes records returned by convert_file to the database, see `convert_files`
+        get_sample_id: gets the Sample ID of a file before it is converted, to hold back the analysis of the sample
+            until the file is converted, if not given samples may be analysed while their other files are converting
+        convert_workers: files converted at the same time, in a process pool if more than 1, default "Convert
+            workers" in config or 1
+        analyse_workers: samples analysed at the same time, default "Analyse workers" in config or 1
+        queue_size: maximum files, or samples, waiting for the next stage, default "Pipeline queue size" in config
+            or 32
+
+    Returns:
+        list[dict]: report with Stage, Items, Failed, Duration (s), Busy (s), Blocked (s) and Items/s for each stage
+
+    """
+    convert_workers = convert_workers or CONFIG.get("Convert workers") or CONVERT_WORKERS
+    analyse_workers = analyse_workers or CONFIG.get("Analyse workers") or ANALYSE_WORKERS
+    queue_size = queue_size or CONFIG.get("Pipeline queue size") or PIPELINE_QUEUE_SIZE
+    files: queue.Queue[Path | None] = queue.Queue(maxsize=queue_size)
+    samples: queue.Queue[str | None] = queue.Queue(maxsize=queue_size)
+    stages = ("harvest", "convert", "analyse")
+    stats = {stage: {"Items": 0, "Failed": 0, "Busy (s)": 0.0, "Blocked (s)": 0.0} for stage in stages}
+    durations: dict[str, float] = {}
+    stats_lock = threading.Lock()
+    db_lock = threading.Lock()
+    waiting: set[str] = set()  # Samples on the queue, so they are not queued twice
+    converting: Counter[str] = Counter()  # Files of each sample being converted
+    held: set[str] = set()  # Samples not analysed yet because files were being converted
+    t_start = monotonic()
+
+    def count(stage: str, items: int = 0, failed: int = 0, busy: float = 0.0, blocked: float = 0.0) -> None:
+        """Add to the statistics of a stage, called from several threads."""
+        with stats_lock:
+            stats[stage]["Items"] += items
+            stats[stage]["Failed"] += failed
+            stats[stage]["Busy (s)"] += busy
+            stats[stage]["Blocked (s)"] += blocked
+
+    def on_file(file: Path) -> None:
+        """Queue a copied file, called by the harvester threads."""
+        t_put = monotonic()
+        files.put(file)
+        count("harvest", items=1, blocked=monotonic() - t_put)
+
+    def harvest_stage() -> None:
+        """Copy all new files, then tell every converter to stop."""
+        try:
+            harvest(on_file)
+        except Exception:
+            logger.exception("Error harvesting files")
+            count("harvest", failed=1)
+        finally:
+            durations["harvest"] = monotonic() - t_start
+            count("harvest", busy=durations["harvest"] - stats["harvest"]["Blocked (s)"])
+            for _ in range(convert_workers):
+                files.put(None)
+
+    def convert_stage(executor: ProcessPoolExecutor | None) -> None:
+        """Convert files from the queue and queue their samples for analysis."""
+        while (file := files.get()) is not None:
+            t_file = monotonic()
+            sample_id = None
+            try:
+                sample_id = get_sample_id(file) if get_sample_id else None
+            except Exception:
+                logger.debug("Could not get Sample ID of %s before converting it", file, exc_info=True)
+            if sample_id:
+                with stats_lock:
+                    converting[sample_id] += 1
+            try:
+                if executor:
+                    _file, status, record, _duration, _error = executor.submit(
+                        _convert_file, convert_file, file
+                    ).result()
+                else:
+                    _file, status, record, _duration, _error = _convert_file(convert_file, file)
+                if record:
+                    with db_lock:
+                        update_database([record])
+                        dbf.update_results(record["Sample ID"], {"Last snapshot": record["Last snapshot"]})
+            except Exception:
+                logger.exception("Error converting %s", file)
+                status, record = "failed", None
+            t_put = monotonic()
+            with stats_lock:
+                if sample_id:
+                    converting[sample_id] -= 1
+                # Queue the sample of this file, and any held samples which have no files converting any more
+                ready = {record["Sample ID"]} if record else set()
+                ready |= {s for s in held if not converting[s]}
+                held.difference_update(ready)
+                ready -= waiting
+                waiting.update(ready)
+            for ready_sample_id in sorted(ready):
+                samples.put(ready_sample_id)
+            count(
+                "convert",
+                items=1,
+                failed=status == "failed",
+                busy=t_put - t_file,
+                blocked=monotonic() - t_put,
+            )
+
+    def analyse_stage() -> None:
+        """Analyse the samples waiting on the queue together, until told to stop."""
+        finished = False
+        while not finished:
+            batch = [samples.get()]
+            while True:
+                try:
+                    batch.append(samples.get_nowait())
+                except queue.Empty:
+                    break
+            sample_ids = sorted({s for s in batch if s is not None})
+            finished = len(sample_ids) < len(batch)
+            with stats_lock:
+                waiting.difference_update(sample_ids)
+                converting_ids = {s for s in sample_ids if converting[s]}
+                held.update(converting_ids)
+            sample_ids = [s for s in sample_ids if s not in converting_ids]
+            if not sample_ids:
+                continue
+            t_batch = monotonic()
+            try:
+                report = analyse_samples(sample_ids, incremental=True, workers=analyse_workers)
+                n_failed = sum(r["Status"] != "success" for r in report)
+            except Exception:
+                logger.exception("Error analysing %s", sample_ids)
+                n_failed = len(sample_ids)
+            count("analyse", items=len(sample_ids), failed=n_failed, busy=monotonic() - t_batch)
+
+    executor = (
+        ProcessPoolExecutor(max_workers=convert_workers, mp_context=multiprocessing.get_context("spawn"))
+        if convert_workers > 1
+        else None
+    )
+    try:
+        harvester = threading.Thread(target=harvest_stage, name="pipeline-harvest", daemon=True)
+        converters = [
+            threading.Thread(target=convert_stage, args=(executor,), name=f"pipeline-convert-{i}", daemon=True)
+            for i in range(convert_workers)
+        ]
+        analyser = threading.Thread(target=analyse_stage, name="pipeline-analyse", daemon=True)
+        for thread in [harvester, *converters, analyser]:
+            thread.start()
+        for thread in [harvester, *converters]:
+            thread.join()
+        durations["convert"] = monotonic() - t_start
+        samples.put(None)
+        analyser.join()
+        durations["analyse"] = monotonic() - t_start
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    report = []
+    for stage in stages:
+        row = {"Stage": stage, **stats[stage], "Duration (s)": durations[stage]}
+        row["Items/s"] = row["Items"] / max(row["Duration (s)"], 1e-9)
+        report.append(row)
+        logger.info(
+            "Pipeline %s: %d items, %d failed, %.2f items/s over %.1f s, %.1f s busy, %.1f s blocked by the next stage",
+            stage,
+            row["Items"],
+            row["Failed"],
+            row["Items/s"],
+            row["Duration (s)"],
+            row["Busy (s)"],
+            row["Blocked (s)"],
+        )
+    return report
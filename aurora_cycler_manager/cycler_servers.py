@@ -22,9 +22,15 @@ from aurora_unicycler import Protocol
 from typing_extensions import override
 
 from aurora_cycler_manager.config import get_config
+from aurora_cycler_manager.data_parse import get_sample_folder
 from aurora_cycler_manager.eclab_harvester import convert_mpr, get_eclab_snapshot_folder
-from aurora_cycler_manager.neware_harvester import convert_neware_data, snapshot_raw_data
-from aurora_cycler_manager.ssh import SSHConnection
+from aurora_cycler_manager.neware_harvester import (
+    convert_neware_data,
+    get_neware_raw_folder,
+    get_neware_snapshot_folder,
+    snapshot_raw_data,
+)
+from aurora_cycler_manager.ssh import SSHConnection, pooled_connection
 from aurora_cycler_manager.stdlib_utils import run_from_sample
 
 logger = logging.getLogger(__name__)
@@ -70,7 +76,7 @@ class CyclerServer:
 
     def check_connection(self) -> None:
         """Connect and check if the server is reachable."""
-        with SSHConnection(self.server_config):
+        with pooled_connection(self.server_config):
             return
 
     def submit(
@@ -165,7 +171,7 @@ class NewareServer(CyclerServer):
         current_datetime = datetime.now(timezone.utc).strftime("%Y-%m-%d_%H-%M-%S")
 
         # Transfer the file to the remote PC and start the job
-        with TemporaryDirectory() as temp_dir, SSHConnection(self.server_config) as ssh:
+        with TemporaryDirectory() as temp_dir, pooled_connection(self.server_config) as ssh:
             with (Path(temp_dir) / "temp.xml").open("w", encoding="utf-8") as f:
                 f.write(xml_string)
             remote_xml_dir = PureWindowsPath(self.server_config.get("protocol_path", "C:/aurora/protocols/"))
@@ -198,7 +204,7 @@ class NewareServer(CyclerServer):
         Use the STOP command on the Neware-api.
         """
         # Check that sample ID matches
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             output = self._command(ssh, f"neware status {pipeline}")
             barcode = json.loads(output).get(pipeline, {}).get("barcode")
             if barcode != sampleid:
@@ -228,7 +234,7 @@ class NewareServer(CyclerServer):
     @override
     def get_pipelines(self) -> list[dict]:
         """Get the status of all pipelines on the server."""
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             result = json.loads(self._command(ssh, "neware status"))
         # result is a dict with keys=pipeline and value a dict of stuff
         # need to return in list format with keys 'pipeline', 'sampleid', 'ready', 'jobid'
@@ -244,15 +250,21 @@ class NewareServer(CyclerServer):
     @override
     def snapshot(self, sample_id: str, jobid: str, jobid_on_server: str) -> str | None:
         """Save a snapshot of a job on the server and download it to the local machine."""
-        ndax_path = snapshot_raw_data(jobid)
-        if ndax_path:
-            convert_neware_data(ndax_path, sample_id, save_file=True)
+        data_path = snapshot_raw_data(jobid)
+        if data_path is None:
+            # No new data on the server, only convert if it has not been converted yet
+            raw_folder = get_neware_raw_folder(jobid)
+            data_path = raw_folder if raw_folder.exists() else get_neware_snapshot_folder() / f"{jobid}.ndax"
+            converted = get_sample_folder(sample_id) / "snapshots" / f"snapshot.{jobid}.parquet"
+            if not data_path.exists() or converted.exists():
+                return None
+        convert_neware_data(data_path, sample_id, save_file=True)
 
         return None  # Neware does not have a snapshot status
 
     def _get_job_id(self, pipeline: str | None) -> str:
         """Get the testid for a pipeline."""
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             output = self._command(ssh, f"neware get-job-id {pipeline} --full-id")
         return json.loads(output).get(pipeline)
 
@@ -332,7 +344,7 @@ class BiologicServer(CyclerServer):
         jobid = jobid_on_server  # Do not need separate IDs
 
         # Transfer the file to the remote PC and start the job
-        with TemporaryDirectory() as tmp_dir, SSHConnection(self.server_config) as ssh:
+        with TemporaryDirectory() as tmp_dir, pooled_connection(self.server_config) as ssh:
             with (Path(tmp_dir) / "temp.mps").open("w", encoding="cp1252") as f:
                 f.write(mps_string)
             remote_output_path = self.biologic_data_path / run_id / sample / jobid_on_server / f"{jobid_on_server}.mps"
@@ -360,7 +372,7 @@ class BiologicServer(CyclerServer):
 
         Use the STOP command on the Neware-api.
         """
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             # Get job ID on server
             output = self._command(ssh, f"biologic get-job-id {pipeline} --ssh")
             job_id_on_biologic = json.loads(output).get(pipeline, {})
@@ -382,7 +394,7 @@ class BiologicServer(CyclerServer):
     @override
     def get_pipelines(self) -> list[dict]:
         """Get the status of all pipelines on the server."""
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             result = json.loads(self._command(ssh, "biologic status --ssh"))
         # Result is a dict with keys=pipeline and value a dict of stuff
         # Biologic does not give sample ID or job IDs from status
@@ -406,7 +418,7 @@ class BiologicServer(CyclerServer):
         remote_job_folder = self.biologic_data_path / run_id / sample_id / jobid_on_server
 
         # Connect to the remote server
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             # Find all the .mpr and .mpl files in the job folder
             ps_command = (
                 f"Get-ChildItem -Path '{remote_job_folder}' -Recurse -File "
@@ -434,7 +446,7 @@ class BiologicServer(CyclerServer):
             for local_file in local_files:
                 if local_file.suffix == ".mpr":
                     try:
-                        convert_mpr(local_file, job_id=jobid, update_database=True)
+                        convert_mpr(local_file, job_id=jobid, update_database=True, incremental=True)
                     except Exception:
                         logger.exception("Error converting %s", local_file.name)
 
@@ -442,6 +454,6 @@ class BiologicServer(CyclerServer):
 
     def _get_job_id(self, pipeline: str) -> str:
         """Get the testid for a pipeline."""
-        with SSHConnection(self.server_config) as ssh:
+        with pooled_connection(self.server_config) as ssh:
             output = self._command(ssh, f"biologic get-job-id {pipeline} --ssh")
         return json.loads(output).get(pipeline)
@@ -19,6 +19,7 @@ from aurora_cycler_manager.analysis import analyse_all_batches, analyse_all_samp
 from aurora_cycler_manager.config import get_config
 from aurora_cycler_manager.eclab_harvester import main as harvest_eclab
 from aurora_cycler_manager.neware_harvester import main as harvest_neware
+from aurora_cycler_manager.ssh import POOL
 
 # Set up config and logging
 CONFIG = get_config()
@@ -84,6 +85,7 @@ def daemon_loop(
         logger.info("Updating database...")
 
         handle_exceptions(sm.update_db)
+        POOL.evict_idle()
 
         if now >= next_run_time:
             handle_exceptions(harvest_neware)
@@ -15,10 +15,12 @@ grabbing tiny metadata about a sample.
 
 import json
 import logging
+from collections.abc import Iterable
 from functools import cached_property
 from pathlib import Path
 
 import h5py
+import numpy as np
 import pandas as pd
 import polars as pl
 from aurora_unicycler import CyclingProtocol
@@ -31,6 +33,10 @@ from aurora_cycler_manager.stdlib_utils import run_from_sample
 
 logger = logging.getLogger(__name__)
 CONFIG = get_config()
+# Key in lake partition parquet metadata storing the columns of each sample
+LAKE_COLUMNS_KEY = "AURORA:lake_columns"
+# Key in full file parquet metadata listing the files that make up the full data, see get_full_files
+FULL_FILES_KEY = "AURORA:full_files"
 
 
 def read_cycling(file: str | Path) -> pl.DataFrame:
@@ -48,10 +54,37 @@ def read_cycling(file: str | Path) -> pl.DataFrame:
     raise ValueError(msg)
 
 
+def scan_cycling(file: str | Path) -> pl.LazyFrame:
+    """Lazily scan cycling data from aurora-style parquet/hdf5 file.
+
+    Aurora parquet files are scanned so filters and column selections are pushed down to the reader. Other formats
+    are read in full then made lazy.
+    """
+    file = Path(file)
+    if file.suffix == ".parquet":
+        lf = pl.scan_parquet(file)
+        columns = lf.collect_schema().names()
+        if "voltage_volt" not in columns:
+            return lf.cast({k: v for k, v in aurora_dtypes.items() if k in columns}, strict=False)
+    return read_cycling(file).lazy()
+
+
 def read_metadata(file: str | Path) -> dict:
-    """Read metadata from aurora-style parquet/hdf5 file."""
+    """Read metadata from aurora-style parquet/hdf5 file.
+
+    For full.*.parquet files, the metadata.*.json sidecar is used if it exists, as metadata updates are only
+    written there to avoid rewriting the full file.
+    """
     file = Path(file)
     if file.suffix == ".parquet":
+        if (
+            file.name.startswith("full.")
+            and (
+                sidecar := file.with_name(f"metadata.{file.name.removeprefix('full.').removesuffix('.parquet')}.json")
+            ).exists()
+        ):
+            with sidecar.open("r") as f:
+                return json.load(f)
         return json.loads(pl.read_parquet_metadata(file).get("AURORA:metadata", "{}"))
     if file.suffix == ".h5":
         with h5py.File(file, "r") as f:
@@ -66,15 +99,102 @@ def get_sample_folder(sample_id: str) -> Path:
     return CONFIG["Data folder path"] / run_id / sample_id
 
 
-def get_cycling(sample_id: str) -> pl.DataFrame:
-    """Get cycling data from Sample ID."""
+def _filter_time_range(lf: pl.LazyFrame, time_range: tuple[float | None, float | None] | None) -> pl.LazyFrame:
+    """Only keep data with start <= uts <= end, either can be None."""
+    if time_range is not None:
+        start, end = time_range
+        if start is not None:
+            lf = lf.filter(pl.col("uts") >= start)
+        if end is not None:
+            lf = lf.filter(pl.col("uts") <= end)
+    return lf
+
+
+def _part_number(file: Path) -> int:
+    """Get the number of a full.*.part-N.parquet file."""
+    return int(file.name.removesuffix(".parquet").rpartition("-")[2])
+
+
+def get_full_files(sample_id: str) -> list[tuple[Path, int | None]]:
+    """Get the parquet files holding the full cycling data of a sample, in time order.
+
+    Incremental analysis appends new data as full.*.part-N.parquet files next to full.*.parquet instead of
+    rewriting it. The newest part lists the files in use, each with the Step where the next file takes over, as
+    the last (open) step of a file is written again with the new data. Parts that are not listed have been merged
+    into a newer part, and are removed at the next analysis.
+
+    Returns:
+        list[tuple[Path, int | None]]: files with the first Step not to use from each, None to use all rows, empty
+            if there is no full parquet file
+
+    """
     folder = get_sample_folder(sample_id)
-    if (data_path := folder / f"full.{sample_id}.parquet").exists():
-        return read_cycling(data_path)
-    if (data_path := folder / f"full.{sample_id}.h5").exists():
-        return read_cycling(data_path)
-    msg = "No data found."
-    raise FileNotFoundError(msg)
+    if not (full_file := folder / f"full.{sample_id}.parquet").exists():
+        return []
+    parts = sorted(folder.glob(f"full.{sample_id}.part-*.parquet"), key=_part_number)
+    if parts:
+        files = [
+            (folder / name, end_step)
+            for name, end_step in json.loads(pl.read_parquet_metadata(parts[-1]).get(FULL_FILES_KEY, "[]"))
+        ]
+        # Left by an interrupted analysis, the full file on its own is still consistent
+        if files and all(f.exists() for f, _end_step in files):
+            return files
+    return [(full_file, None)]
+
+
+def scan_full_files(files: list[tuple[Path, int | None]]) -> pl.LazyFrame:
+    """Lazily scan full files from get_full_files as one frame, filters are pushed down to each file."""
+    return pl.concat(
+        [
+            pl.scan_parquet(f) if end_step is None else pl.scan_parquet(f).filter(pl.col("Step") < end_step)
+            for f, end_step in files
+        ],
+        how="diagonal_relaxed",
+    )
+
+
+def get_cycling(
+    sample_id: str,
+    cycles: int | Iterable[int] | None = None,
+    time_range: tuple[float | None, float | None] | None = None,
+    columns: list[str] | None = None,
+) -> pl.DataFrame:
+    """Get cycling data from Sample ID.
+
+    Filters and column selections are pushed down to the parquet reader, full files have row groups aligned to
+    cycles, so e.g. getting one cycle only reads one row group. Parts appended by incremental analysis are read
+    with the full file, see get_full_files.
+
+    Args:
+        sample_id: Sample ID
+        cycles: only get these cycle numbers
+        time_range: only get data with start <= uts <= end, either can be None
+        columns: only get these columns
+
+    """
+    folder = get_sample_folder(sample_id)
+    if files := get_full_files(sample_id):
+        lf = scan_full_files(files)
+    elif (data_path := folder / f"full.{sample_id}.h5").exists():
+        lf = read_cycling(data_path).lazy()
+    else:
+        msg = "No data found."
+        raise FileNotFoundError(msg)
+
+    if cycles is not None:
+        if isinstance(cycles, int):
+            lf = lf.filter(pl.col("Cycle") == cycles)
+        else:
+            cycles = list(cycles)
+            # is_between as well so row groups can be skipped using statistics
+            lf = lf.filter(pl.col("Cycle").is_between(min(cycles, default=0), max(cycles, default=-1)))
+            lf = lf.filter(pl.col("Cycle").is_in(cycles))
+    lf = _filter_time_range(lf, time_range)
+    if columns is not None:
+        lf = lf.select(columns)
+    df = lf.collect()
+    return df.cast({k: v for k, v in aurora_dtypes.items() if k in df.columns}, strict=False)
 
 
 def get_cycling_shrunk(sample_id: str) -> pl.DataFrame | None:
@@ -87,6 +207,38 @@ def get_cycling_shrunk(sample_id: str) -> pl.DataFrame | None:
     return None
 
 
+def get_cycling_lod(
+    sample_id: str,
+    points: int,
+    time_range: tuple[float | None, float | None] | None = None,
+) -> pl.DataFrame:
+    """Get cycling data at the coarsest level of detail with enough points in a time window.
+
+    The levels are written by analyse_sample, see analysis.build_lod. If no level has enough points in the window,
+    or the sample has no levels, the window is read from the full file.
+
+    Args:
+        sample_id: Sample ID
+        points: minimum number of points wanted in the window, e.g. a few per pixel of the plot
+        time_range: only get data with start <= uts <= end, either can be None
+
+    Returns:
+        pl.DataFrame: uts, V (V), I (A), dQ (mAh) and Cycle in the window
+
+    """
+    columns = ["uts", "V (V)", "I (A)", "dQ (mAh)", "Cycle"]
+    if (data_path := get_sample_folder(sample_id) / f"lod.{sample_id}.parquet").exists():
+        lf = _filter_time_range(pl.scan_parquet(data_path), time_range)
+        # Count the points of each level in the window, only reads the uts and Points columns
+        levels = (
+            lf.group_by("Points").agg(pl.len()).filter(pl.col("len") >= points).select(pl.col("Points").min()).collect()
+        )
+        if (level := levels.item()) is not None:
+            df = lf.filter(pl.col("Points") == level).select(columns).collect()
+            return df.cast({k: v for k, v in aurora_dtypes.items() if k in df.columns}, strict=False)
+    return get_cycling(sample_id, time_range=time_range, columns=columns)
+
+
 def get_eis(sample_id: str) -> pl.DataFrame | None:
     """Get EIS data from Sample ID."""
     folder = get_sample_folder(sample_id)
@@ -108,6 +260,54 @@ def get_cycles_summary(sample_id: str) -> pl.DataFrame | None:
     return None
 
 
+def get_cycle_curves(sample_id: str, cycles: int | Iterable[int] | None = None) -> pl.DataFrame | None:
+    """Get the half cycle curves on a common grid from Sample ID, see analysis.calc_cycle_curves."""
+    folder = get_sample_folder(sample_id)
+    if not (data_path := folder / f"curves.{sample_id}.parquet").exists():
+        return None
+    lf = pl.scan_parquet(data_path)
+    if cycles is not None:
+        lf = lf.filter(pl.col("Cycle").is_in([cycles] if isinstance(cycles, int) else list(cycles)))
+    return lf.collect()
+
+
+def cycle_curve_points(curves: pl.DataFrame) -> pl.DataFrame:
+    """Turn half cycle curves into voltage, capacity and dQ/dV points for plotting.
+
+    Uses the capacity on the voltage grid of each half cycle. Capacity is counted from zero at the start of the first
+    half cycle, going up on charge and down on discharge, like the cumulative sum of dQ. dQ/dV is negative on
+    discharge.
+
+    Args:
+        curves: rows from get_cycle_curves, usually the half cycles of one cycle
+
+    Returns:
+        pl.DataFrame: V (V), Q (mAh) and dQ/dV (mAh/V) points of all the half cycles in order
+
+    """
+    frames = []
+    q_offset = 0.0
+    for row in curves.iter_rows(named=True):
+        q = np.asarray(row["Q at V (mAh)"], dtype=float)
+        v = np.linspace(row["V start (V)"], row["V end (V)"], len(q))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            dqdv = np.gradient(q, v) if len(q) > 1 else np.full_like(q, np.nan)
+        sign = -1 if row["Direction"] == "discharge" else 1
+        frames.append(
+            pl.DataFrame(
+                {
+                    "V (V)": v,
+                    "Q (mAh)": q_offset + sign * q,
+                    "dQ/dV (mAh/V)": np.where(np.isfinite(dqdv), dqdv, np.nan),
+                }
+            )
+        )
+        q_offset += sign * row["Capacity (mAh)"]
+    if not frames:
+        return pl.DataFrame(schema={"V (V)": pl.Float64, "Q (mAh)": pl.Float64, "dQ/dV (mAh/V)": pl.Float64})
+    return pl.concat(frames)
+
+
 def get_overall_summary(sample_id: str) -> dict | None:
     """Get overall data, single scalar quantites from cycling."""
     folder = get_sample_folder(sample_id)
@@ -121,6 +321,91 @@ def get_overall_summary(sample_id: str) -> dict | None:
     return None
 
 
+def get_lake_file(table: str, run_id: str) -> Path:
+    """Get the lake partition holding one run of a table.
+
+    The lake is a consolidated copy of the per-cycle ("cycles") and overall ("overall") results of every sample, one
+    parquet file per table per run with a "Sample ID" column, kept up to date by analyse_sample.
+    """
+    lake_folder = CONFIG.get("Lake folder path") or CONFIG["Data folder path"].parent / "lake"
+    return Path(lake_folder) / table / f"{run_id}.parquet"
+
+
+def scan_lake(table: str, sample_ids: Iterable[str] | None = None) -> pl.LazyFrame:
+    """Lazily scan the results of many samples from the lake.
+
+    Args:
+        table: "cycles" or "overall"
+        sample_ids: only open the partitions of these samples and filter to them, scan everything if None
+
+    Returns:
+        pl.LazyFrame: results with a "Sample ID" column, empty if nothing is in the lake
+
+    """
+    if sample_ids is None:
+        files = sorted(get_lake_file(table, "*").parent.glob("*.parquet"))
+    else:
+        sample_ids = list(sample_ids)
+        files = [
+            f
+            for run_id in dict.fromkeys(map(run_from_sample, sample_ids))
+            if (f := get_lake_file(table, run_id)).exists()
+        ]
+    if not files:
+        return pl.LazyFrame(schema={"Sample ID": pl.String})
+    lf = pl.concat([pl.scan_parquet(f) for f in files], how="diagonal_relaxed")
+    if sample_ids is not None:
+        lf = lf.filter(pl.col("Sample ID").is_in(sample_ids))
+    return lf
+
+
+def get_lake_columns(table: str, sample_ids: Iterable[str]) -> dict[str, list[str]]:
+    """Get the columns of each sample in the lake, stored in the metadata of the run partitions.
+
+    The partitions have the columns of all samples in the run, these are the columns each sample was written with.
+    """
+    columns: dict[str, list[str]] = {}
+    for run_id in dict.fromkeys(map(run_from_sample, sample_ids)):
+        if (file := get_lake_file(table, run_id)).exists():
+            columns.update(json.loads(pl.read_parquet_metadata(file).get(LAKE_COLUMNS_KEY, "{}")))
+    return columns
+
+
+def get_batch_summaries(sample_ids: Iterable[str]) -> tuple[dict[str, pl.DataFrame], dict[str, dict]]:
+    """Get the per-cycle and overall results of many samples.
+
+    Results are read from the lake in one scan per table, with the columns each sample was written with. Samples
+    missing from the lake, or without recorded columns, fall back to their own files.
+
+    Args:
+        sample_ids: samples to get
+
+    Returns:
+        tuple[dict, dict]: per-cycle dataframes and overall dicts by Sample ID, samples without results are left out
+
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+    cycles: dict[str, pl.DataFrame] = {}
+    overall: dict[str, dict] = {}
+    if sample_ids:
+        columns = get_lake_columns("cycles", sample_ids)
+        for (sample_id,), df in (
+            scan_lake("cycles", sample_ids).collect().partition_by("Sample ID", as_dict=True, include_key=False).items()
+        ):
+            if sample_id in columns:
+                cycles[sample_id] = df.select(c for c in columns[sample_id] if c in df.columns)
+        columns = get_lake_columns("overall", sample_ids)
+        for row in scan_lake("overall", sample_ids).collect().iter_rows(named=True):
+            if row["Sample ID"] in columns:
+                overall[row["Sample ID"]] = {k: row[k] for k in columns[row["Sample ID"]] if k in row}
+    for sample_id in sample_ids:
+        if sample_id not in cycles and (df := get_cycles_summary(sample_id)) is not None:
+            cycles[sample_id] = df
+        if sample_id not in overall and (overall_dict := get_overall_summary(sample_id)) is not None:
+            overall[sample_id] = overall_dict
+    return cycles, overall
+
+
 def get_metadata(sample_id: str) -> dict | None:
     """Get sample metadata dictionary."""
     folder = get_sample_folder(sample_id)
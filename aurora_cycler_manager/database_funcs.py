@@ -17,6 +17,7 @@ from typing import Any, Literal
 
 import pandas as pd
 from sqlalchemy import (
+    BigInteger,
     Boolean,
     Column,
     DateTime,
@@ -26,6 +27,7 @@ from sqlalchemy import (
     MetaData,
     Numeric,
     PrimaryKeyConstraint,
+    RowMapping,
     String,
     Table,
     Text,
@@ -91,6 +93,23 @@ def _patch_database(engine: Engine) -> None:
         )
         meta.create_all(engine)
 
+    # Create harvested files table if it doesn't exist
+    if "harvested_files" not in inspector.get_table_names():
+        meta = MetaData()
+        Table(
+            "harvested_files",
+            meta,
+            Column("Server label", Text, nullable=False),
+            Column("Server hostname", Text, nullable=False),
+            Column("Path", Text, nullable=False),
+            Column("Folder", Text),
+            Column("Size", BigInteger),
+            Column("Modified", Float),
+            Column("Last snapshot", DateTime),
+            PrimaryKeyConstraint("Server label", "Server hostname", "Path"),
+        )
+        meta.create_all(engine)
+
 
 def stamp_sync(
     row: dict,
@@ -114,6 +133,7 @@ pipelines_table = Table("pipelines", metadata, autoload_with=engine)
 jobs_table = Table("jobs", metadata, autoload_with=engine)
 results_table = Table("results", metadata, autoload_with=engine)
 harvester_table = Table("harvester", metadata, autoload_with=engine)
+harvested_files_table = Table("harvested_files", metadata, autoload_with=engine)
 dataframes_table = Table("dataframes", metadata, autoload_with=engine)
 batches_table = Table("batches", metadata, autoload_with=engine)
 batch_samples_table = Table("batch_samples", metadata, autoload_with=engine)
@@ -134,6 +154,7 @@ dataframes_table.c["Data start"].type = String()
 dataframes_table.c["Data end"].type = String()
 dataframes_table.c["Modified"].type = String()
 harvester_table.c["Last snapshot"].type = String()
+harvested_files_table.c["Last snapshot"].type = String()
 
 ### SAMPLES ###
 
@@ -376,6 +397,16 @@ def get_all_sampleids() -> list[str]:
         return [row[0] for row in result.fetchall()]
 
 
+def _sample_row_to_dict(row: RowMapping) -> dict:
+    """Convert a samples table row to a dict, parsing json strings."""
+    sample_data = dict(row)
+    # Convert json strings to python objects
+    history = sample_data.get("Assembly history")
+    if history and isinstance(history, str):
+        sample_data["Assembly history"] = json.loads(history)
+    return sample_data
+
+
 def get_sample_data(sample_id: str) -> dict:
     """Get all data about a sample from the database."""
     with engine.connect() as conn:
@@ -391,12 +422,27 @@ def get_sample_data(sample_id: str) -> dict:
         if not result:
             msg = f"Sample ID '{sample_id}' not found in the database"
             raise ValueError(msg)
-        sample_data = dict(result)
-        # Convert json strings to python objects
-        history = sample_data.get("Assembly history")
-        if history and isinstance(history, str):
-            sample_data["Assembly history"] = json.loads(history)
-    return sample_data
+    return _sample_row_to_dict(result)
+
+
+def get_samples_data(sample_ids: list[str]) -> dict[str, dict]:
+    """Get all data about several samples from the database in one query.
+
+    Returns:
+        dict: Sample ID to sample data, missing samples are not included
+
+    """
+    with engine.connect() as conn:
+        results = (
+            conn.execute(
+                select(*sample_cols)
+                .where(samples_table.c["Sample ID"].in_(sample_ids))
+                .where(samples_table.c["sync_op"] != "delete")
+            )
+            .mappings()
+            .fetchall()
+        )
+    return {row["Sample ID"]: _sample_row_to_dict(row) for row in results}
 
 
 def get_all_run_ids() -> set[str]:
@@ -661,15 +707,21 @@ def get_job_data(job_id: str) -> dict:
 
 def add_or_update_job(job_id: str, row: dict[str, str | float | None]) -> None:
     """Add or update job in database."""
+    add_or_update_jobs({job_id: row})
+
+
+def add_or_update_jobs(rows: dict[str, dict[str, str | float | None]]) -> None:
+    """Add or update several jobs in one transaction, rows are keyed by Job ID."""
     with engine.begin() as conn:
-        conn.execute(
-            insert(jobs_table)
-            .values(stamp_sync({"Job ID": job_id, **row}, op="insert"))
-            .on_conflict_do_update(
-                index_elements=["Job ID"],
-                set_=stamp_sync(row, op="update"),
+        for job_id, row in rows.items():
+            conn.execute(
+                insert(jobs_table)
+                .values(stamp_sync({"Job ID": job_id, **row}, op="insert"))
+                .on_conflict_do_update(
+                    index_elements=["Job ID"],
+                    set_=stamp_sync(row, op="update"),
+                )
             )
-        )
 
 
 def get_jobs_from_sample(sample_id: str) -> list[str]:
@@ -1026,6 +1078,60 @@ def get_last_harvest(server: dict, folder: str) -> float:
     return 0.0
 
 
+def get_new_files(server: dict, folder: str, files: list[dict]) -> list[dict]:
+    """Get the files which are new or have changed size since they were last harvested.
+
+    Args:
+        server: server dictionary, as defined in config
+        folder: folder on the server the files are in
+        files: files on the server, dicts with "Path", "Size" and "Modified" keys
+
+    Only the size is compared, not the modification time, which uses the server's clock. Folders harvested before
+    files were recorded individually have no recorded files, so all their files are copied once more.
+
+    Returns:
+        list of the files not harvested yet, or harvested with a different size
+
+    """
+    with engine.connect() as conn:
+        harvested = dict(
+            conn.execute(
+                select(harvested_files_table.c["Path"], harvested_files_table.c["Size"])
+                .where(harvested_files_table.c["Server label"] == server["label"])
+                .where(harvested_files_table.c["Server hostname"] == server["hostname"])
+                .where(harvested_files_table.c["Folder"] == folder)
+            ).all()
+        )
+    return [f for f in files if harvested.get(f["Path"]) != f["Size"]]
+
+
+def update_harvested_files(server: dict, folder: str, files: list[dict], copy_datetime: datetime) -> None:
+    """Record the size and modification time of files when they were harvested."""
+    if not files:
+        return
+    rows = [
+        {
+            "Server label": server["label"],
+            "Server hostname": server["hostname"],
+            "Path": f["Path"],
+            "Folder": folder,
+            "Size": f["Size"],
+            "Modified": f["Modified"],
+            "Last snapshot": copy_datetime.isoformat(timespec="seconds"),
+        }
+        for f in files
+    ]
+    stmt = insert(harvested_files_table)
+    with engine.begin() as conn:
+        conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["Server label", "Server hostname", "Path"],
+                set_={col: stmt.excluded[col] for col in ["Folder", "Size", "Modified", "Last snapshot"]},
+            ),
+            rows,
+        )
+
+
 ### RESULTS ###
 
 
@@ -1038,15 +1144,21 @@ def get_results_from_sample(sample_id: str) -> dict | None:
 
 def update_results(sample_id: str, row: dict[str, str | float | None]) -> None:
     """Add or update results for a sample."""
+    update_results_batch({sample_id: row})
+
+
+def update_results_batch(rows: dict[str, dict[str, str | float | None]]) -> None:
+    """Add or update results for several samples in one transaction, rows are keyed by Sample ID."""
     with engine.begin() as conn:
-        conn.execute(
-            insert(results_table)
-            .values(stamp_sync({"Sample ID": sample_id, **row}, op="insert"))
-            .on_conflict_do_update(
-                index_elements=["Sample ID"],
-                set_=stamp_sync(row, op="update"),
+        for sample_id, row in rows.items():
+            conn.execute(
+                insert(results_table)
+                .values(stamp_sync({"Sample ID": sample_id, **row}, op="insert"))
+                .on_conflict_do_update(
+                    index_elements=["Sample ID"],
+                    set_=stamp_sync(row, op="update"),
+                )
             )
-        )
 
 
 def find_new_data(mode: str) -> list[str]:
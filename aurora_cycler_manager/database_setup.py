@@ -376,6 +376,19 @@ def create_database(force: bool = False) -> None:
         UniqueConstraint("Server label", "Server hostname", "Folder"),
     )
 
+    harvested_files_table = Table(  # noqa: F841
+        "harvested_files",
+        meta,
+        Column("Server label", types.Text, nullable=False),
+        Column("Server hostname", types.Text, nullable=False),
+        Column("Path", types.Text, nullable=False),
+        Column("Folder", types.Text),
+        Column("Size", types.BigInteger),
+        Column("Modified", types.Float),
+        Column("Last snapshot", types.DateTime),
+        PrimaryKeyConstraint("Server label", "Server hostname", "Path"),
+    )
+
     batches_table = Table(  # noqa: F841
         "batches",
         meta,
@@ -46,3 +46,14 @@ aurora_dtypes: dict = {
     "Im(Z) (ohm)": pl.Float32,
     "dQ (mAh)": pl.Float32,
 }
+
+# Compact dtypes enforced when writing each analysis output, see analysis.write_artefact
+storage_dtypes: dict[str, dict] = {
+    "full": aurora_dtypes,
+    "shrunk": {**aurora_dtypes, "dQ/dV (mAh/V)": pl.Float32},
+    "eis": aurora_dtypes,
+    "lod": {**aurora_dtypes, "Points": pl.Int32},
+    "cycles": {"Cycle": pl.Int32},
+    "curves": {"Cycle": pl.Int32},
+    "overall": {},
+}
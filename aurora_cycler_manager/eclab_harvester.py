@@ -7,23 +7,30 @@ Define the machines to grab files from in the config.json file.
 Run the script to harvest and convert all mpr files.
 """
 
+import hashlib
 import json
 import logging
 import os
+from collections.abc import Callable
+from contextlib import nullcontext
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
+from typing import BinaryIO
 
 import numpy as np
 import polars as pl
 import yadg
 from dgbowl_schemas.yadg.dataschema import ExtractorFactory
+from xarray import DataTree
+from yadg.extractors.eclab.mpr_columns import module_header_dtypes
 
 import aurora_cycler_manager.database_funcs as dbf
-from aurora_cycler_manager.analysis import analyse_sample
+from aurora_cycler_manager.bulk_convert import convert_files, run_pipeline, write_snapshot
 from aurora_cycler_manager.config import get_config
 from aurora_cycler_manager.data_parse import get_sample_folder
 from aurora_cycler_manager.setup_logging import setup_logging
-from aurora_cycler_manager.ssh import SSHConnection
+from aurora_cycler_manager.ssh import SSHConnection, harvest_servers, pooled_connection
 from aurora_cycler_manager.stdlib_utils import run_from_sample
 from aurora_cycler_manager.version import __url__, __version__
 
@@ -35,6 +42,11 @@ logging.getLogger("yadg.extractors.eclab.mpr").addFilter(
     lambda record: "I Range could not be understood" not in record.getMessage()
 )
 
+MPR_STATE_KEY = "AURORA:mpr_state"
+MPR_MODULES_START = 0x34  # After the file magic
+# Offset of the first record in the data module, depends on the module version
+MPR_RECORDS_OFFSETS = {2: 0x195, 3: 0x196, 10: 0x3EF, 11: 0x3EF}
+
 
 def get_eclab_snapshot_folder() -> Path:
     """Get the path to the snapshot folder for eclab files."""
@@ -56,6 +68,8 @@ def get_mprs(
     local_folder: Path | str,
     *,
     force_copy: bool = False,
+    ssh: SSHConnection | None = None,
+    on_file: Callable[[Path], None] | None = None,
 ) -> list[Path]:
     """Get .mpr files from subfolders of specified folder.
 
@@ -63,84 +77,69 @@ def get_mprs(
         server (dict): Server dictionary, as defined in config
         server_copy_folder (str): Folder to search and copy .mpr and .mpl files
         local_folder (Path | str): Folder to copy files to
-        force_copy (bool, optional): Copy all files regardless of modification date
+        force_copy (bool, optional): Copy all files, not only new files or files which changed size
+        ssh (SSHConnection, optional): open connection to the server to use, otherwise the pooled connection
+        on_file (Callable, optional): called with each .mpr file copied, once the whole folder is copied so the
+            .mpl files are there too
 
     """
-    # Get last time files were grabbed
-    cutoff_uts = dbf.get_last_harvest(server, server_copy_folder) if not force_copy else 0.0
-
     # Connect to the server and copy the files
-    with SSHConnection(server) as ssh:
-        remote_files = ssh.check_new_files(server_copy_folder, [".mpr"], cutoff_uts)
-        remote_files = [f for f in remote_files for f in (f, f.replace(".mpr", ".mpl"))]
-        local_files = [Path(local_folder) / os.path.relpath(file, server_copy_folder) for file in remote_files]
+    with pooled_connection(server) if ssh is None else nullcontext(ssh) as conn:
+        remote_files = conn.list_files(server_copy_folder, [".mpr", ".mpl"])
+        if not force_copy:
+            remote_files = dbf.get_new_files(server, server_copy_folder, remote_files)
+        local_files = [Path(local_folder) / os.path.relpath(file["Path"], server_copy_folder) for file in remote_files]
         copy_datetime = datetime.now(timezone.utc)  # Keep time of copying for database
-        ssh.get_files(local_files, remote_files, missing_ok=True)  # mpl might be deleted, that's fine
+        conn.get_files(local_files, [file["Path"] for file in remote_files], missing_ok=True)  # might be deleted
+    if on_file:
+        for local_file in local_files:
+            if local_file.suffix == ".mpr" and local_file.exists():
+                on_file(local_file)
 
+    dbf.update_harvested_files(server, server_copy_folder, remote_files, copy_datetime)
     dbf.update_harvester(server, server_copy_folder, copy_datetime)
     return local_files
 
 
-def get_all_mprs(*, force_copy: bool = False) -> list[Path]:
+def get_all_mprs(
+    *,
+    force_copy: bool = False,
+    on_file: Callable[[Path], None] | None = None,
+) -> list[Path]:
     """Get all MPR files from the folders specified in the config.
 
     Searches in the active "data_path" folder as well as a list of passive
-    "harvester_folders".
+    "harvester_folders". Servers are harvested concurrently with one
+    connection each, see ssh.harvest_servers. If on_file is given, it is
+    called with the .mpr files of each folder as soon as it is copied.
     """
-    all_new_files = []
     snapshot_folder = get_eclab_snapshot_folder()
-
-    # Find all biologic servers
-    for server in CONFIG["Servers"].values():
-        if server.get("server_type") in {"biologic", "biologic_harvester"}:
-            # Check active data path folder
-            if server.get("data_path"):
-                new_files = get_mprs(
-                    server,
-                    server["data_path"],
-                    snapshot_folder,
-                    force_copy=force_copy,
-                )
-                all_new_files.extend(new_files)
-
-            # Check passive harvesters
-            for folder in server.get("harvester_folders", []):
-                new_files = get_mprs(
-                    server,
-                    folder,
-                    snapshot_folder,
-                    force_copy=force_copy,
-                )
-                all_new_files.extend(new_files)
-
+    servers = [s for s in CONFIG["Servers"].values() if s.get("server_type") in {"biologic", "biologic_harvester"}]
+    all_new_files, _report = harvest_servers(
+        servers,
+        lambda ssh, server, folder: get_mprs(
+            server,
+            folder,
+            snapshot_folder,
+            force_copy=force_copy,
+            ssh=ssh,
+            on_file=on_file,
+        ),
+    )
     return all_new_files
 
 
-def get_mpr_data(
-    mpr_file: str | Path | bytes,
-    mpl_file: str | Path | bytes | None = None,
-) -> tuple[pl.DataFrame, dict, dict]:
-    """Convert mpr file to dataframe."""
-    if isinstance(mpr_file, (str, Path)):
-        mpr_file = Path(mpr_file)
-        data = yadg.extractors.extract("eclab.mpr", mpr_file)
-    elif isinstance(mpr_file, bytes):
-        extractor = ExtractorFactory(extractor={"filetype": "eclab.mpr"}).extractor
-        data = yadg.extractors.extract_from_bytes(
-            source=mpr_file,
-            extractor=extractor,
-        )
-    else:
-        msg = "mpr_file must be str, Path, or raw bytes of mpr file."
-        raise TypeError(msg)
+def _mpr_data_to_df(data: DataTree, uts: np.ndarray, *, eis: bool | None = None) -> pl.DataFrame:
+    """Get the aurora columns from data extracted by yadg.
 
-    # Build dict of arrays
-    cols: dict[str, np.ndarray | int] = {}
+    Args:
+        data (DataTree): data extracted from an mpr file by yadg
+        uts (np.ndarray): unix time stamps of the data, corrected with the start time
+        eis (bool, optional): add impedance columns, by default if there are any non-zero frequencies
 
-    # Unix time - get start time from mpl if missing in mpr
-    uts = data.coords["uts"].to_numpy()
-    finished = bool(uts[0] != 0)  # If the start time is 0, job is ongoing, start time still only in mpl
-    cols["uts"] = check_mpr_uts(uts, mpr_file, mpl_file)
+    """
+    # Build dict of arrays
+    cols: dict[str, np.ndarray | int] = {"uts": uts}
 
     # Voltage
     voltage_col = next(col for col in ("Ewe", "<Ewe>") if col in data.data_vars)
@@ -166,22 +165,48 @@ def get_mpr_data(
     cols["technique"] = data["mode"].to_numpy() if "mode" in data else 0
 
     # impedance block
-    if all(k in data for k in ["freq", "Re(Z)", "-Im(Z)"]) and np.any(data["freq"]):
+    if eis is None:
+        eis = "freq" in data and bool(np.any(data["freq"]))
+    if eis and all(k in data for k in ["freq", "Re(Z)", "-Im(Z)"]):
         cols["f (Hz)"] = data["freq"].to_numpy().astype("float32")
         cols["Re(Z) (ohm)"] = data["Re(Z)"].to_numpy().astype("float32")
         cols["Im(Z) (ohm)"] = (-data["-Im(Z)"]).to_numpy().astype("float32")
-    elif all(k in data for k in ["freq", "|Z|", "Phase(Z)"]) and np.any(data["freq"]):
+    elif eis and all(k in data for k in ["freq", "|Z|", "Phase(Z)"]):
         cols["f (Hz)"] = data["freq"].to_numpy().astype("float32")
         cols["Re(Z) (ohm)"] = (data["|Z|"] * np.cos(data["Phase(Z)"] * 3.14159265 / 180)).to_numpy().astype("float32")
         cols["Im(Z) (ohm)"] = (data["|Z|"] * np.sin(data["Phase(Z)"] * 3.14159265 / 180)).to_numpy().astype("float32")
 
-    df = pl.DataFrame(cols).with_columns(
+    return pl.DataFrame(cols).with_columns(
         pl.col("V (V)").cast(pl.Float32),
         pl.col("I (A)").cast(pl.Float32),
         pl.col("technique").cast(pl.Int16),
         pl.col("cycle_number").cast(pl.Int32),
     )
 
+
+def get_mpr_data(
+    mpr_file: str | Path | bytes,
+    mpl_file: str | Path | bytes | None = None,
+) -> tuple[pl.DataFrame, dict, dict]:
+    """Convert mpr file to dataframe."""
+    if isinstance(mpr_file, (str, Path)):
+        mpr_file = Path(mpr_file)
+        data = yadg.extractors.extract("eclab.mpr", mpr_file)
+    elif isinstance(mpr_file, bytes):
+        extractor = ExtractorFactory(extractor={"filetype": "eclab.mpr"}).extractor
+        data = yadg.extractors.extract_from_bytes(
+            source=mpr_file,
+            extractor=extractor,
+        )
+    else:
+        msg = "mpr_file must be str, Path, or raw bytes of mpr file."
+        raise TypeError(msg)
+
+    # Unix time - get start time from mpl if missing in mpr
+    uts = data.coords["uts"].to_numpy()
+    finished = bool(uts[0] != 0)  # If the start time is 0, job is ongoing, start time still only in mpl
+    df = _mpr_data_to_df(data, check_mpr_uts(uts, mpr_file, mpl_file))
+
     # Get metadata
     mpr_metadata = json.loads(data.attrs["original_metadata"])
     mpr_metadata["Finished"] = finished
@@ -231,6 +256,163 @@ def check_mpr_uts(
     return uts
 
 
+def _find_mpr_data_module(f: BinaryIO) -> dict | None:
+    """Find the data module of an mpr file from the module headers, without reading the data.
+
+    Returns:
+        dict | None: positions and sizes of the data module, None if it cannot be read incrementally
+
+    """
+    file_size = f.seek(0, os.SEEK_END)
+    position = MPR_MODULES_START
+    data_module = None
+    while position < file_size:
+        f.seek(position)
+        if f.read(6) != b"MODULE":
+            return None
+        raw_header = f.read(max(mhd.itemsize for mhd in module_header_dtypes))
+        for mhd in module_header_dtypes:
+            if len(raw_header) < mhd.itemsize:
+                continue
+            header = np.frombuffer(raw_header, dtype=mhd, count=1).copy()
+            end = position + 6 + mhd.itemsize + int(header["length"][0])
+            f.seek(end)
+            if end == file_size or (end < file_size and f.read(6) == b"MODULE"):
+                break
+        else:
+            return None
+        if header["short_name"][0].strip() == b"VMP data":
+            version = int(header["oldver"][0]) + (int(header["newver"][0]) if "newver" in mhd.names else 0)
+            data_start = position + 6 + mhd.itemsize
+            f.seek(data_start)
+            n_records = int(np.frombuffer(f.read(4), dtype="<u4")[0])
+            records_offset = MPR_RECORDS_OFFSETS.get(version)
+            if records_offset is None or n_records == 0:
+                return None
+            data_module = {
+                "Position": position,
+                "Header": header,
+                "Data start": data_start,
+                "Records start": data_start + records_offset,
+                "Records": n_records,
+                "Record size": (int(header["length"][0]) - records_offset) // n_records,
+            }
+        elif data_module is not None:
+            # Modules after the data, e.g. the log, are only written when the job finishes
+            data_module["Finished"] = True
+        position = end
+    if data_module is not None:
+        data_module.setdefault("Finished", False)
+    return data_module
+
+
+def _mpr_state(f: BinaryIO, data_module: dict) -> dict:
+    """Where decoding stopped, and hashes to check that the decoded part of the file has not changed."""
+    f.seek(0)
+    header = hashlib.sha256(f.read(data_module["Position"]))
+    f.seek(data_module["Data start"] + 4)  # After the number of records, which changes
+    header.update(f.read(data_module["Records start"] - data_module["Data start"] - 4))
+    f.seek(data_module["Records start"] + (data_module["Records"] - 1) * data_module["Record size"])
+    return {
+        "Records": data_module["Records"],
+        "Record size": data_module["Record size"],
+        "Header hash": header.hexdigest(),
+        "Last record hash": hashlib.sha256(f.read(data_module["Record size"])).hexdigest(),
+        "Finished": data_module["Finished"],
+    }
+
+
+def _decode_mpr_records(f: BinaryIO, data_module: dict, first: int) -> DataTree:
+    """Decode the records from `first` onwards with yadg, by giving it an mpr file with only these records."""
+    n_records = data_module["Records"] - first
+    records_offset = data_module["Records start"] - data_module["Data start"]
+    f.seek(0)
+    prefix = bytearray(f.read(data_module["Records start"]))
+    header = data_module["Header"].copy()
+    header["length"] = records_offset + n_records * data_module["Record size"]
+    prefix[data_module["Position"] + 6 : data_module["Data start"]] = header.tobytes()
+    prefix[data_module["Data start"] : data_module["Data start"] + 4] = np.uint32(n_records).tobytes()
+    f.seek(data_module["Records start"] + first * data_module["Record size"])
+    records = f.read(n_records * data_module["Record size"])
+    extractor = ExtractorFactory(extractor={"filetype": "eclab.mpr"}).extractor
+    return yadg.extractors.extract_from_bytes(source=bytes(prefix) + records, extractor=extractor)
+
+
+def get_mpr_state(mpr_file: Path) -> dict | None:
+    """Get the state to store with a converted mpr file, so it can be updated incrementally later."""
+    try:
+        with mpr_file.open("rb") as f:
+            data_module = _find_mpr_data_module(f)
+            return _mpr_state(f, data_module) if data_module else None
+    except ValueError:
+        logger.warning("Could not read the data module of %s, it cannot be updated incrementally", mpr_file)
+        return None
+
+
+def get_appended_mpr_data(mpr_file: Path, previous: pl.DataFrame, state: dict) -> tuple[pl.DataFrame, dict] | None:
+    """Decode only the records appended to an mpr file since it was last converted.
+
+    The data module of an mpr file grows while a job is running, all the records in it have the same size. Only the
+    records after the ones already decoded are read, together with the last decoded record, which gives the start
+    time and the time step for currents calculated from charge.
+
+    Args:
+        mpr_file (Path): path to the mpr file
+        previous (pl.DataFrame): data converted from the file before
+        state (dict): state of the file when it was converted, from get_mpr_state
+
+    Returns:
+        tuple[pl.DataFrame, dict] | None: the new rows and the new state, or None if the decoded part of the file
+            changed and it must be converted again in full
+
+    """
+    with mpr_file.open("rb") as f:
+        data_module = _find_mpr_data_module(f)
+        if data_module is None or data_module["Records"] < state["Records"]:
+            return None
+        new_state = _mpr_state(f, data_module)
+        if new_state["Record size"] != state["Record size"] or new_state["Header hash"] != state["Header hash"]:
+            return None
+        f.seek(data_module["Records start"] + (state["Records"] - 1) * state["Record size"])
+        if hashlib.sha256(f.read(state["Record size"])).hexdigest() != state["Last record hash"]:
+            return None
+        if data_module["Records"] == state["Records"]:
+            return previous.clear(), new_state
+        data = _decode_mpr_records(f, data_module, state["Records"] - 1)
+
+    # Without the log module the times start from 0, align them with the last decoded record
+    uts = data.coords["uts"].to_numpy()
+    uts = uts - uts[0] + previous["uts"][-1]
+    eis = "f (Hz)" in previous.columns
+    if not eis and "freq" in data and np.any(data["freq"]):
+        return None  # Impedance columns would be added to the old rows too
+    df = _mpr_data_to_df(data, uts, eis=eis)
+    return df.slice(1).select(previous.columns).cast(previous.schema), new_state
+
+
+def _get_incremental_mpr_data(mpr_file: Path, parquet_filepath: Path) -> tuple[pl.DataFrame, dict, dict, dict] | None:
+    """Add the records appended to an mpr file to its previous snapshot.
+
+    Returns:
+        tuple | None: data, mpr metadata, yadg metadata and state, None if the file must be converted in full
+
+    """
+    file_metadata = pl.read_parquet_metadata(parquet_filepath)
+    state = json.loads(file_metadata.get(MPR_STATE_KEY) or "null")
+    if not state:
+        return None
+    previous = pl.read_parquet(parquet_filepath)
+    appended = get_appended_mpr_data(mpr_file, previous, state)
+    if appended is None:
+        logger.info("Start of %s changed, converting the whole file", mpr_file)
+        return None
+    new_rows, new_state = appended
+    logger.info("Decoded %d new records from %s", len(new_rows), mpr_file)
+    metadata = json.loads(file_metadata["AURORA:metadata"])
+    mpr_metadata = {**metadata["job_data"], "Finished": new_state["Finished"]}
+    return pl.concat([previous, new_rows]), mpr_metadata, metadata["provenance"]["yadg_metadata"], new_state
+
+
 def convert_mpr(
     mpr_file: str | Path | bytes,
     mpl_file: str | Path | bytes | None = None,
@@ -240,6 +422,8 @@ def convert_mpr(
     file_name: str | None = None,
     *,
     update_database: bool = True,
+    save_file: bool | None = None,
+    incremental: bool = False,
 ) -> tuple[pl.DataFrame, dict]:
     """Convert a ec-lab mpr to dataframe, optionally update database.
 
@@ -247,6 +431,9 @@ def convert_mpr(
         mpr_file (str, Path, bytes): path to the mpr file, or raw bytes
         mpl_file (str, Path, bytes, optional): path to the associated mpl file, or raw bytes
         update_database (bool, optional): whether to save data and update tables in database
+        save_file (bool, optional): whether to save data, by default the same as update_database
+        incremental (bool, optional): if the mpr file was saved before, only decode the records appended since, see
+            get_appended_mpr_data
         sample_id (str, optional): Sample ID as in database, REQUIRED if reading from bytes
         job_id (str, optional): Job ID as in the database, will check dataframe hash if not used
         modified_date (datetime, optional): Used for last snapshot time, inferred from mpr_file if str/path
@@ -282,8 +469,21 @@ def convert_mpr(
         msg = "mpr_file must be str, Path, or file-like object"
         raise TypeError(msg)
 
-    # Get data and metadata from mpr (and mpl) files
-    df, mpr_metadata, yadg_metadata = get_mpr_data(mpr_file, mpl_file)
+    # Get the file stem for the database and snapshot file
+    file_stem = Path(file_name).stem if file_name else Path(mpr_file).stem  # type: ignore[arg-type]
+    parquet_filepath = (
+        get_sample_folder(sample_id) / "snapshots" / f"snapshot.{file_stem}.parquet" if sample_id else None
+    )
+
+    # Get data and metadata from mpr (and mpl) files, only the new records if the file was converted before
+    incremental_data = None
+    if incremental and isinstance(mpr_file, Path) and parquet_filepath and parquet_filepath.exists():
+        incremental_data = _get_incremental_mpr_data(mpr_file, parquet_filepath)
+    if incremental_data:
+        df, mpr_metadata, yadg_metadata, mpr_state = incremental_data
+    else:
+        df, mpr_metadata, yadg_metadata = get_mpr_data(mpr_file, mpl_file)
+        mpr_state = get_mpr_state(mpr_file) if isinstance(mpr_file, Path) else None
 
     # get sample data from database
     try:
@@ -319,32 +519,28 @@ def convert_mpr(
     }
 
     # Save and update database
-    if update_database:
-        if not sample_id:
+    if save_file is None:
+        save_file = update_database
+    if save_file or update_database:
+        if not sample_id or not parquet_filepath:
             logger.warning("Not saving %s, no valid Sample ID found", mpr_file)
             return df, metadata
-        folder = get_sample_folder(sample_id) / "snapshots"
-        if not folder.exists():
-            folder.mkdir(parents=True)
-
-        # Get the file stem and path
-        if file_name:
-            file_stem = Path(file_name).stem
-        else:
-            assert isinstance(mpr_file, (str, Path))  # noqa: S101
-            file_stem = Path(mpr_file).stem
-
-        parquet_filepath = folder / f"snapshot.{file_stem}.parquet"
 
         # Add the file/job information to the database
-        dbf.add_data_to_db(sample_id, file_stem, df["uts"][0], df["uts"][-1], job_id)
+        if update_database:
+            dbf.add_data_to_db(sample_id, file_stem, df["uts"][0], df["uts"][-1], job_id)
 
         # Write to parquet file
-        df.write_parquet(parquet_filepath, metadata={"AURORA:metadata": json.dumps(metadata)})
+        if save_file:
+            file_metadata = {"AURORA:metadata": json.dumps(metadata)}
+            if mpr_state:
+                file_metadata[MPR_STATE_KEY] = json.dumps(mpr_state)
+            write_snapshot(df, parquet_filepath, file_metadata)
 
         # Update the database
-        modified_date_iso = modified_date.isoformat(timespec="seconds") if modified_date else None
-        dbf.update_results(sample_id, {"Last snapshot": modified_date_iso})
+        if update_database:
+            modified_date_iso = modified_date.isoformat(timespec="seconds") if modified_date else None
+            dbf.update_results(sample_id, {"Last snapshot": modified_date_iso})
     return df, metadata
 
 
@@ -407,55 +603,86 @@ def get_sampleid_from_mpr(mpr_rel_path: str | Path) -> str:
     return sample_id
 
 
-def convert_all_mprs() -> None:
-    """Convert all raw .mpr files to parquet.
+def _convert_mpr_file(mpr_file: Path, *, incremental: bool = False) -> dict:
+    """Convert an mpr file in a worker process, the database is updated by _update_mpr_data."""
+    sample_id = get_sampleid_from_mpr(mpr_file)
+    df, _metadata = convert_mpr(
+        mpr_file, sample_id=sample_id, update_database=False, save_file=True, incremental=incremental
+    )
+    return {
+        "Sample ID": sample_id,
+        "Last snapshot": datetime.fromtimestamp(mpr_file.stat().st_mtime, tz=timezone.utc).isoformat(
+            timespec="seconds"
+        ),
+        "File stem": mpr_file.stem,
+        "Start uts": df["uts"][0],
+        "End uts": df["uts"][-1],
+    }
+
+
+def _update_mpr_data(records: list[dict]) -> None:
+    """Add a batch of converted mpr files to the database."""
+    for r in records:
+        dbf.add_data_to_db(r["Sample ID"], r["File stem"], r["Start uts"], r["End uts"])
+
+
+def convert_all_mprs(
+    *,
+    workers: int = 1,
+    resume: bool = True,
+    analyse: bool = False,
+    progress: bool = True,
+) -> tuple[list[dict], list[dict]]:
+    """Convert all raw .mpr files to parquet, optionally analyse the samples.
 
     Looks in configuration for "Servers" with "server_type": "biologic" or
     "biologic_harvester".
     Gets data from "data_path" and "harvester_folders" list.
+
+    Args:
+        workers (int, optional): number of processes converting files and analysing samples
+        resume (bool, optional): continue an interrupted run from its checkpoint, otherwise start again
+        analyse (bool, optional): analyse the samples of the converted files
+        progress (bool, optional): show progress bars
+
+    Returns:
+        list[dict]: report for each file converted
+        list[dict]: report for each sample analysed
+
     """
     # walk through raw_folder and get the sample ID
     snapshot_folder = get_eclab_snapshot_folder()
-    for dirpath, _dirnames, filenames in os.walk(snapshot_folder):
-        for filename in filenames:
-            if filename.endswith(".mpr"):
-                full_path = Path(dirpath) / filename
-                try:
-                    convert_mpr(
-                        full_path,
-                        update_database=True,
-                    )
-                    logger.info("Converted %s", full_path)
-                except (ValueError, IndexError, KeyError, RuntimeError):
-                    logger.exception("Error converting %s", full_path)
-                    continue
+    mpr_files = [
+        Path(dirpath) / filename
+        for dirpath, _dirnames, filenames in os.walk(snapshot_folder)
+        for filename in filenames
+        if filename.endswith(".mpr")
+    ]
+    return convert_files(
+        mpr_files,
+        _convert_mpr_file,
+        _update_mpr_data,
+        snapshot_folder / "convert_checkpoint.json",
+        workers=workers,
+        resume=resume,
+        analyse=analyse,
+        progress=progress,
+    )
 
 
 def main() -> None:
-    """Harverst and convert all new mpr files."""
-    new_files = get_all_mprs()
-    new_samples = set()
-    for mpr_path in new_files:
-        if mpr_path.suffix == ".mpr":
-            try:
-                _data, metadata = convert_mpr(
-                    mpr_path,
-                    update_database=True,
-                )
-                if metadata is not None:
-                    sampleid = metadata.get("sample_data", {}).get("Sample ID") if metadata.get("sample_data") else None
-                    if sampleid:
-                        new_samples.add(sampleid)
-                        logger.info("Converted %s", sampleid)
-            except (ValueError, IndexError, KeyError, RuntimeError):
-                logger.exception("Error converting %s", mpr_path)
-                continue
-    for sample in new_samples:
-        try:
-            analyse_sample(sample)
-            logger.info("Analysed %s", sample)
-        except Exception:
-            logger.exception("Error analysing %s", sample)
+    """Harvest and convert all new mpr files, and analyse the samples.
+
+    Files are converted as soon as their folder is copied, and samples are analysed as soon as their files are
+    converted, see bulk_convert.run_pipeline. Only records appended to files since they were last converted are
+    decoded.
+    """
+    run_pipeline(
+        lambda on_file: get_all_mprs(on_file=on_file),
+        partial(_convert_mpr_file, incremental=True),
+        _update_mpr_data,
+        get_sample_id=get_sampleid_from_mpr,
+    )
 
 
 if __name__ == "__main__":
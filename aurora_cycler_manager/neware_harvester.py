@@ -9,10 +9,16 @@ Run the script to harvest and convert all neware files.
 
 import json
 import logging
+import os
 import re
+import shutil
 import tempfile
 import zipfile
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
 from typing import Any
 
@@ -22,16 +28,20 @@ import polars as pl
 import xmltodict
 
 import aurora_cycler_manager.database_funcs as dbf
-from aurora_cycler_manager.analysis import analyse_sample
+from aurora_cycler_manager.bulk_convert import convert_files, run_pipeline, write_snapshot
 from aurora_cycler_manager.config import get_config
 from aurora_cycler_manager.data_parse import get_sample_folder
 from aurora_cycler_manager.setup_logging import setup_logging
-from aurora_cycler_manager.ssh import SSHConnection
+from aurora_cycler_manager.ssh import SSHConnection, harvest_servers, pooled_connection
 from aurora_cycler_manager.version import __url__, __version__
 
 # Load configuration
 CONFIG = get_config()
 logger = logging.getLogger(__name__)
+
+NEWARE_RAW_ENDINGS = (".ndc", "_step.ndc", "_runInfo.ndc", "_log.ndc", "_es.ndc")
+# Server label -> folder -> files in folder, set by index_neware_raw_files
+_RAW_INDEX: ContextVar[dict[str, dict[str, list[dict]]] | None] = ContextVar("neware_raw_index", default=None)
 # This warning from yadg is handled
 logging.getLogger("fastnda.ndax").addFilter(
     lambda record: "negative jumps in the 'timestamp' column" not in record.getMessage()
@@ -59,6 +69,8 @@ def harvest_neware_files(
     local_folder: str | Path,
     *,
     force_copy: bool = False,
+    ssh: SSHConnection | None = None,
+    on_file: Callable[[Path], None] | None = None,
 ) -> list[Path]:
     """Get Neware files from subfolders of specified folder.
 
@@ -66,43 +78,95 @@ def harvest_neware_files(
         server (dict): Server dictionary, as defined in config
         server_copy_folder (str): Folder to search and copy files
         local_folder (str): Folder to copy files to
-        force_copy (bool): Copy all files regardless of modification date
+        force_copy (bool): Copy all files, not only new files or files which changed size
+        ssh (SSHConnection, optional): open connection to the server to use, otherwise the pooled connection
+        on_file (Callable, optional): called with each file as soon as it is copied
 
     Returns:
         list of new files copied
 
     """
-    # Get last time files were grabbed
-    cutoff_uts = dbf.get_last_harvest(server, server_copy_folder) if not force_copy else 0.0
-
     # Connect to the server and copy the files
-    with SSHConnection(server) as ssh:
-        remote_files = ssh.check_new_files(server_copy_folder, [".ndax"], cutoff_uts)
+    with pooled_connection(server) if ssh is None else nullcontext(ssh) as conn:
+        remote_files = conn.list_files(server_copy_folder, [".ndax"])
+        if not force_copy:
+            remote_files = dbf.get_new_files(server, server_copy_folder, remote_files)
         job_ids = [
-            dbf.get_or_create_job_id_from_server(server["label"], Path(file).stem.replace("_", "-"))
+            dbf.get_or_create_job_id_from_server(server["label"], Path(file["Path"]).stem.replace("_", "-"))
             for file in remote_files
         ]
         local_files = [Path(local_folder) / (job_id + ".ndax") for job_id in job_ids]
         copy_datetime = datetime.now(timezone.utc)
-        ssh.get_files(local_files, remote_files)
+        conn.get_files(local_files, [file["Path"] for file in remote_files], on_file=on_file)
 
+    dbf.update_harvested_files(server, server_copy_folder, remote_files, copy_datetime)
     dbf.update_harvester(server, server_copy_folder, copy_datetime)
     return local_files
 
 
-def snapshot_raw_data(job_id: str) -> Path | None:
-    """Copy latest data from server into local .ndax file.
+def get_neware_raw_folder(job_id: str) -> Path:
+    """Get the folder with the raw .ndc files of a job, kept between snapshots."""
+    return get_neware_snapshot_folder() / "raw" / job_id
+
 
-    Connects to server, searches for the raw .ndc files, copies into local .ndax file.
+def pack_ndax(raw_folder: Path, ndax_path: Path, *, compress: bool = False) -> Path:
+    """Pack a folder of raw Neware files into an .ndax file.
 
     Args:
-        job_id (str): full job ID from database with server label e.g. nw4-22-6-4-26
+        raw_folder: folder with data.ndc and any other files to include
+        ndax_path: .ndax file to create or replace
+        compress: deflate the files, otherwise they are stored as is which is much faster
 
     Returns:
-        Path to the .ndax file created or modified, or None if no files updated.
+        Path to the .ndax file
 
     """
-    # File to create or update
+    tmp_path = ndax_path.with_name(ndax_path.name + ".tmp")
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED) as zf:
+        for file in sorted(raw_folder.rglob("*")):
+            if file.is_file():
+                zf.write(file, arcname=file.relative_to(raw_folder))
+    tmp_path.replace(ndax_path)
+    return ndax_path
+
+
+def _last_modified(path: Path) -> float:
+    """Modification time of a file, or of the newest file in a raw folder."""
+    if path.is_dir():
+        return max((f.stat().st_mtime for f in path.iterdir() if f.is_file()), default=path.stat().st_mtime)
+    return path.stat().st_mtime
+
+
+@contextmanager
+def _packed_ndax(raw_folder: Path, pattern: str = "*") -> Iterator[Path]:
+    """Pack a raw folder into a temporary .ndax file named after the job, for readers which need a zip file."""
+    with tempfile.TemporaryDirectory(dir=raw_folder.parent) as tmp_folder:
+        ndax_path = Path(tmp_folder) / f"{raw_folder.name}.ndax"
+        with zipfile.ZipFile(ndax_path, "w", zipfile.ZIP_STORED) as zf:
+            for file in sorted(raw_folder.glob(pattern)):
+                if file.is_file():
+                    zf.write(file, arcname=file.relative_to(raw_folder))
+        yield ndax_path
+
+
+def export_ndax(job_id: str, output_path: Path | str) -> Path:
+    """Write a compressed .ndax file of a snapshotted job, e.g. to share or archive."""
+    raw_folder = get_neware_raw_folder(job_id)
+    if raw_folder.exists():
+        return pack_ndax(raw_folder, Path(output_path), compress=True)
+    ndax_path = get_neware_snapshot_folder() / f"{job_id}.ndax"
+    if not ndax_path.exists():
+        msg = f"No raw data for job {job_id}"
+        raise FileNotFoundError(msg)
+    output_path = Path(output_path)
+    with zipfile.ZipFile(ndax_path, "r") as zf_in, zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf_out:
+        for info in zf_in.infolist():
+            zf_out.writestr(info.filename, zf_in.read(info))
+    return output_path
+
+
+def _get_raw_search(job_id: str) -> tuple[dict, list[str], str]:
+    """Get the server, the folders to search in order and the file name pattern of a job's raw files."""
     ndax_path = get_neware_snapshot_folder() / f"{job_id}.ndax"
 
     # Get the job info from database
@@ -137,122 +201,206 @@ def snapshot_raw_data(job_id: str) -> Path | None:
 
     # Build the paths to check - assumes device type 27
     full_folder = raw_data_folder + submitted
-    full_folder_alt = full_folder + "_NoTestInfoData"
     file_middle = (
         "27" + str(dev_id).zfill(4) + "_0_" + str((int(subdev_id) - 1) * 8 + int(channel_id)) + "_" + str(test_id)
     )
+    return server, [full_folder, full_folder + "_NoTestInfoData"], file_middle
+
 
-    # Powershell command to return paths of files matching the pattern
+def _list_raw_files(ssh: SSHConnection, folders: list[str]) -> dict[str, list[dict]]:
+    """List the .ndc files in folders on a Neware server with one command."""
+    folders_str = ", ".join(f'"{folder}"' for folder in folders)
     ps_command = f"""
         $ProgressPreference = 'SilentlyContinue'
 
-        $searchFolders = @("{full_folder}", "{full_folder_alt}")
-        $file_middle = "{file_middle}"
-        $file_endings = @(".ndc", "_step.ndc", "_runInfo.ndc", "_log.ndc", "_es.ndc")
-
-        $foundFiles = [ordered]@{{}}
-        foreach ($ending in $file_endings) {{
-            $matchedFile = $null
-            foreach ($folder in $searchFolders) {{
-                if (Test-Path $folder) {{
-                    $pattern = "*$file_middle$ending"
-                    $match = Get-ChildItem -Path $folder -Recurse -File -ErrorAction SilentlyContinue |
-                        Where-Object {{ $_.Name -like $pattern }} | Select-Object -First 1
-
-                    if ($match) {{
-                        $matchedFile = $match.FullName
-                        break
+        $searchFolders = @({folders_str})
+        $files = foreach ($folder in $searchFolders) {{
+            if (Test-Path $folder) {{
+                Get-ChildItem -Path $folder -Recurse -File -Filter *.ndc -ErrorAction SilentlyContinue |
+                    ForEach-Object {{
+                        [ordered]@{{
+                            Folder = $folder
+                            Name = $_.Name
+                            FullName = $_.FullName
+                            Length = $_.Length
+                            LastWriteTime = ([DateTimeOffset]$_.LastWriteTimeUtc).ToUnixTimeSeconds()
+                        }}
                     }}
-                }}
             }}
-            $foundFiles[$ending] = $matchedFile
         }}
-        $foundFiles | ConvertTo-Json -Compress
+        ConvertTo-Json -InputObject @($files) -Compress
     """
+    _stdin, stdout, stderr = ssh.exec_command(ps_command)
+    output = stdout.read().decode("utf-8").strip()
+    error = stderr.read().decode("utf-8").strip()
+    if error:
+        msg = f"Error finding raw files: {error}"
+        raise RuntimeError(msg)
+    listing: dict[str, list[dict]] = {folder: [] for folder in folders}
+    for file in json.loads(output or "[]"):
+        listing.setdefault(file["Folder"], []).append(file)
+    logger.info(
+        "Listed %d raw files in %d folders on %s", sum(map(len, listing.values())), len(folders), ssh.server["label"]
+    )
+    return listing
 
-    # Connect to the server
-    with SSHConnection(server) as ssh:
-        # Run pattern matching command
-        _stdin, stdout, stderr = ssh.exec_command(ps_command)
 
-        # Parse the output
-        output = stdout.read().decode("utf-8").strip()
-        error = stderr.read().decode("utf-8").strip()
-        if error:
-            msg = f"Error finding raw files: {error}"
-            raise RuntimeError(msg)
-        found_files = json.loads(output)
+@contextmanager
+def index_neware_raw_files(job_ids: list[str]) -> Iterator[None]:
+    """List the raw files of many jobs with one command per server, for the snapshots made inside this context.
 
-        # If nothing found, give up
-        if all(file is None for file in found_files.values()):
-            return None
+    Calls to snapshot_raw_data for these jobs inside the context find their files from the listing instead of
+    searching the server again. The listing is discarded when the context exits, so later snapshots always see the
+    current files on the server.
+
+    Args:
+        job_ids: full job IDs from database with server label e.g. nw4-22-6-4-26
 
-        # Otherwise create or update the ndax file with new raw data
-        logger.info("Updating ndax file at '%s'", ndax_path)
+    """
+    servers: dict[str, tuple[dict, list[str]]] = {}
+    for job_id in job_ids:
+        try:
+            server, folders, _file_middle = _get_raw_search(job_id)
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Cannot find raw data location of %s", job_id)
+            continue
+        server_folders = servers.setdefault(server["label"], (server, []))[1]
+        server_folders.extend(f for f in folders if f not in server_folders)
+    index = {}
+    for label, (server, folders) in servers.items():
+        with pooled_connection(server) as ssh:
+            index[label] = _list_raw_files(ssh, folders)
+    token = _RAW_INDEX.set(index)
+    try:
+        yield
+    finally:
+        _RAW_INDEX.reset(token)
+
+
+def _find_raw_files(listing: dict[str, list[dict]], folders: list[str], file_middle: str) -> dict[str, dict | None]:
+    """Find the raw files of a job in a listing of folders, searching the folders in order."""
+    found_files: dict[str, dict | None] = {}
+    for ending in NEWARE_RAW_ENDINGS:
+        pattern = file_middle + ending
+        found_files[ending] = next(
+            (file for folder in folders for file in listing.get(folder, []) if file["Name"].endswith(pattern)),
+            None,
+        )
+    return found_files
+
+
+def snapshot_raw_data(job_id: str) -> Path | None:
+    """Copy latest data from server into local .ndax file.
+
+    Lists the raw .ndc files of the job on the server, or finds them in the listing made by
+    index_neware_raw_files if called inside that context. Files which changed are updated
+    in the job's raw folder. While the job is running the raw folder is the only local copy, it is packed into a
+    temporary .ndax file when it is converted. Once the job has finished, the raw folder is packed into a compressed
+    .ndax file in the snapshots folder and removed.
+
+    Args:
+        job_id (str): full job ID from database with server label e.g. nw4-22-6-4-26
 
-        # Create a temporary directory to store the files
-        with tempfile.TemporaryDirectory() as tmp:
-            tmp_path = Path(tmp)
+    Returns:
+        Path to the raw folder or .ndax file to convert, or None if no files updated.
 
-            # If ndax already exists, extract it to the temporary directory
-            if ndax_path.exists():
-                with zipfile.ZipFile(ndax_path, "r") as zf:
-                    zf.extractall(tmp_path)
+    """
+    # File to create or update
+    ndax_path = get_neware_snapshot_folder() / f"{job_id}.ndax"
+    server, folders, file_middle = _get_raw_search(job_id)
 
-            # Copy the new files over, replacing any existing ones
-            local_files = [tmp_path / ("data" + ending) for ending in found_files]
-            remote_files = list(found_files.values())
+    with pooled_connection(server) as ssh:
+        # Find files from the index if there is one, otherwise list the folders on the server
+        listing = (_RAW_INDEX.get() or {}).get(server["label"])
+        found_files = _find_raw_files(listing, folders, file_middle) if listing else {}
+        if not found_files.get(".ndc"):
+            found_files = _find_raw_files(_list_raw_files(ssh, folders), folders, file_middle)
 
-            ssh.get_files(local_files, remote_files)
+        # If nothing found, give up
+        if all(file is None for file in found_files.values()):
+            return None
 
-            # Write a new zip
-            with zipfile.ZipFile(ndax_path, "w", zipfile.ZIP_DEFLATED) as zf:
-                for file in tmp_path.rglob("*"):
-                    if file.is_file():
-                        zf.write(file, arcname=file.relative_to(tmp_path))
+        # Otherwise update the raw files kept for this job
+        raw_folder = get_neware_raw_folder(job_id)
+        if not raw_folder.exists() and ndax_path.exists():
+            # The .ndc files are only appended to, so if the sizes match the packed file is up to date
+            with zipfile.ZipFile(ndax_path, "r") as zf:
+                packed_sizes = {info.filename: info.file_size for info in zf.infolist()}
+                if all(
+                    packed_sizes.get("data" + ending) == remote_file["Length"]
+                    for ending, remote_file in found_files.items()
+                    if remote_file
+                ):
+                    logger.info("No new raw data for %s", job_id)
+                    return None
+                zf.extractall(raw_folder)
+        raw_folder.mkdir(parents=True, exist_ok=True)
+
+        # Skip files which have not changed, usually only the end of the .ndc files is downloaded
+        updated = False
+        for ending, remote_file in found_files.items():
+            if not remote_file:
+                continue
+            local_file = raw_folder / ("data" + ending)
+            if (
+                local_file.exists()
+                and local_file.stat().st_size == remote_file["Length"]
+                and int(local_file.stat().st_mtime) == remote_file["LastWriteTime"]
+            ):
+                continue
+            ssh.get_file_delta(local_file, remote_file["FullName"])
+            os.utime(local_file, (remote_file["LastWriteTime"], remote_file["LastWriteTime"]))
+            updated = True
+
+    if not updated:
+        logger.info("No new raw data for %s", job_id)
+        return None
+    if dbf.check_job_running(job_id):
+        # The raw folder is newer than any packed file
+        ndax_path.unlink(missing_ok=True)
+        return raw_folder
+    logger.info("Job %s finished, packing raw data into '%s'", job_id, ndax_path)
+    pack_ndax(raw_folder, ndax_path, compress=True)
+    shutil.rmtree(raw_folder)
     return ndax_path
 
 
-def harvest_all_neware_files(*, force_copy: bool = False) -> list[Path]:
+def harvest_all_neware_files(
+    *,
+    force_copy: bool = False,
+    on_file: Callable[[Path], None] | None = None,
+) -> list[Path]:
     """Get neware files from all servers specified in the config.
 
     Looks in configuration for "Servers" with "server_type": "neware" or
     "neware_harvester".
     Gets data from "data_path" and "harvester_folders" list.
-    "harvester_folders".
+    Servers are harvested concurrently with one connection each, see
+    ssh.harvest_servers. If on_file is given, it is called with each file as
+    soon as it is copied.
     """
-    all_new_files = []
     snapshots_folder = get_neware_snapshot_folder()
-
-    # Find all neware servers
-    for server in CONFIG["Servers"].values():
-        if server.get("server_type") in {"neware", "neware_harvester"}:
-            # Check activate data path folder
-            if server.get("data_path"):
-                new_files = harvest_neware_files(
-                    server,
-                    server["data_path"],
-                    snapshots_folder,
-                    force_copy=force_copy,
-                )
-                all_new_files.extend(new_files)
-
-            # Check passive harvesters
-            for folder in server.get("harvester_folders", []):
-                new_files = harvest_neware_files(
-                    server,
-                    folder,
-                    snapshots_folder,
-                    force_copy=force_copy,
-                )
-                all_new_files.extend(new_files)
-
+    servers = [s for s in CONFIG["Servers"].values() if s.get("server_type") in {"neware", "neware_harvester"}]
+    all_new_files, _report = harvest_servers(
+        servers,
+        lambda ssh, server, folder: harvest_neware_files(
+            server,
+            folder,
+            snapshots_folder,
+            force_copy=force_copy,
+            ssh=ssh,
+            on_file=on_file,
+        ),
+    )
     return all_new_files
 
 
 def get_neware_data(filepath: Path) -> pl.DataFrame:
-    """Get dataframe from a Neware ndax or xlsx file."""
-    if filepath.suffix == ".xlsx":
+    """Get dataframe from a Neware ndax or xlsx file, or a folder of raw files."""
+    if filepath.is_dir():
+        with _packed_ndax(filepath) as ndax_path:
+            df = get_neware_ndax_data(ndax_path)
+    elif filepath.suffix == ".xlsx":
         df = get_neware_xlsx_data(filepath)
     elif filepath.suffix == ".ndax":
         df = get_neware_ndax_data(filepath)
@@ -263,8 +411,12 @@ def get_neware_data(filepath: Path) -> pl.DataFrame:
 
 
 def get_neware_metadata(filepath: Path) -> dict:
-    """Get metadata dict from a Neware ndax or xlsx file."""
-    if filepath.suffix == ".xlsx":
+    """Get metadata dict from a Neware ndax or xlsx file, or a folder of raw files."""
+    if filepath.is_dir():
+        with _packed_ndax(filepath, "*.xml") as ndax_path:
+            metadata = get_neware_ndax_metadata(ndax_path)
+        metadata["job_type"] = "neware_ndax"
+    elif filepath.suffix == ".xlsx":
         metadata = get_neware_xlsx_metadata(filepath)
         metadata["job_type"] = "neware_xlsx"
     elif filepath.suffix == ".ndax":
@@ -641,6 +793,26 @@ def update_database_job(
         sampleid (str, optional): Sample ID to use, otherwise find from metadata
         known_samples (list[str], optional): List of known Sample IDs to check against
 
+    """
+    dbf.add_or_update_job(*get_database_job(filepath, sampleid, known_samples))
+
+
+def get_database_job(
+    filepath: Path,
+    sampleid: str | None = None,
+    known_samples: list[str] | None = None,
+) -> tuple[str, dict]:
+    """Get the job information to update in the database.
+
+    Args:
+        filepath (Path): Path to the file
+        sampleid (str, optional): Sample ID to use, otherwise find from metadata
+        known_samples (list[str], optional): List of known Sample IDs to check against
+
+    Returns:
+        str: Job ID
+        dict: columns to update in the jobs table
+
     """
     metadata = get_neware_metadata(filepath)
     if sampleid is None:
@@ -655,7 +827,7 @@ def update_database_job(
     pipeline = job_data["Pipeline"]
     submitted = metadata.get("Start time")
     payload = json.dumps(metadata.get("Payload"))
-    last_snapshot_uts = filepath.stat().st_mtime
+    last_snapshot_uts = _last_modified(filepath)
     last_snapshot = datetime.fromtimestamp(last_snapshot_uts, tz=timezone.utc).isoformat(timespec="seconds")
 
     server_config = CONFIG["Servers"].get(job_data["Server label"], {})
@@ -664,19 +836,16 @@ def update_database_job(
         msg = f"Server hostname not found for server label {server_label}"
         raise ValueError(msg)
 
-    dbf.add_or_update_job(
-        job_id,
-        {
-            "Job ID on server": job_id_on_server,
-            "Pipeline": pipeline,
-            "Sample ID": sampleid,
-            "Server label": server_label,
-            "Server hostname": server_hostname,
-            "Submitted": submitted,
-            "Payload": payload,
-            "Last snapshot": last_snapshot,
-        },
-    )
+    return job_id, {
+        "Job ID on server": job_id_on_server,
+        "Pipeline": pipeline,
+        "Sample ID": sampleid,
+        "Server label": server_label,
+        "Server hostname": server_hostname,
+        "Submitted": submitted,
+        "Payload": payload,
+        "Last snapshot": last_snapshot,
+    }
 
 
 def convert_neware_data(
@@ -685,14 +854,16 @@ def convert_neware_data(
     known_samples: list[str] | None = None,
     *,
     save_file: bool = True,
+    update_database: bool = True,
 ) -> tuple[pl.DataFrame, dict]:
     """Convert a neware file to a dataframe and save as parquet.
 
     Args:
-        file_path (Path): Path to the neware file
+        file_path (Path): Path to the neware file, or the raw folder of a running job
         sampleid (str, optional): Sample ID to use, otherwise find from metadata
         known_samples (list[str], optional): List of known Sample IDs to check against
         save_file (bool): Whether to save the file to the data lake
+        update_database (bool): Whether to update the last snapshot time in the database when saving
 
     Returns:
         tuple[pd.DataFrame, dict]: DataFrame containing the cycling data and metadata
@@ -741,77 +912,97 @@ def convert_neware_data(
         if not sampleid:
             logger.warning("Not saving %s, no valid Sample ID found", file_path)
             return df, metadata
-        folder = get_sample_folder(sampleid) / "snapshots"
-        if not folder.exists():
-            folder.mkdir(parents=True)
-        parquet_filepath = folder / f"snapshot.{file_path.stem}.parquet"
+        parquet_filepath = get_sample_folder(sampleid) / "snapshots" / f"snapshot.{file_path.stem}.parquet"
 
         # Ensure smallest data types are used
         df = df.cast({"V (V)": pl.Float32, "I (A)": pl.Float32, "technique": pl.Int16, "cycle_number": pl.Int32})
 
         # Write to parquet file
-        df.write_parquet(parquet_filepath, metadata={"AURORA:metadata": json.dumps(metadata)})
+        write_snapshot(df, parquet_filepath, {"AURORA:metadata": json.dumps(metadata)})
 
         # Update the database
-        creation_date = datetime.fromtimestamp(file_path.stat().st_mtime, tz=timezone.utc).isoformat(timespec="seconds")
-        dbf.update_results(sampleid, {"Last snapshot": creation_date})
+        if update_database:
+            creation_date = datetime.fromtimestamp(_last_modified(file_path), tz=timezone.utc).isoformat(
+                timespec="seconds"
+            )
+            dbf.update_results(sampleid, {"Last snapshot": creation_date})
 
     return df, metadata
 
 
-def convert_all_neware_data() -> None:
-    """Convert all neware files to parquet files."""
-    # Get all xlsx and ndax files in the raw folder recursively
+def _convert_neware_file(file: Path, known_samples: list[str]) -> dict | None:
+    """Convert a neware file in a worker process, the database is updated by _update_neware_jobs."""
+    _data, metadata = convert_neware_data(file, known_samples=known_samples, update_database=False)
+    if not metadata.get("sample_data"):
+        return None
+    job_id, job = get_database_job(file, sampleid=metadata["sample_data"]["Sample ID"], known_samples=known_samples)
+    return {"Sample ID": job["Sample ID"], "Last snapshot": job["Last snapshot"], "Job ID": job_id, "Job": job}
+
+
+def _get_neware_file_sample_id(file: Path, known_samples: list[str]) -> str | None:
+    """Get the Sample ID of a neware file from its metadata, without reading the data."""
+    return get_sampleid_from_metadata(get_neware_metadata(file), known_samples)
+
+
+def _update_neware_jobs(records: list[dict]) -> None:
+    """Update the jobs of a batch of converted neware files."""
+    dbf.add_or_update_jobs({r["Job ID"]: r["Job"] for r in records})
+
+
+def convert_all_neware_data(
+    *,
+    workers: int = 1,
+    resume: bool = True,
+    analyse: bool = True,
+    progress: bool = True,
+) -> tuple[list[dict], list[dict]]:
+    """Convert all neware files to parquet files, and analyse the samples.
+
+    Args:
+        workers (int, optional): number of processes converting files and analysing samples
+        resume (bool, optional): continue an interrupted run from its checkpoint, otherwise start again
+        analyse (bool, optional): analyse the samples of the converted files
+        progress (bool, optional): show progress bars
+
+    Returns:
+        list[dict]: report for each file converted
+        list[dict]: report for each sample analysed
+
+    """
+    # Get all xlsx and ndax files in the snapshots folder recursively, and the raw folders of running jobs
     snapshots_folder = get_neware_snapshot_folder()
-    neware_files = [file for file in snapshots_folder.rglob("*") if file.suffix in [".xlsx", ".ndax"]]
-    new_samples = set()
-    known_samples = dbf.get_all_sampleids()
-    for file in neware_files:
-        logger.info("Converting %s", file)
-        try:
-            _data, metadata = convert_neware_data(file, save_file=True, known_samples=known_samples)
-            if metadata is not None:
-                sampleid = metadata.get("sample_data", {}).get("Sample ID") if metadata.get("sample_data") else None
-                if sampleid:
-                    update_database_job(file, sampleid=sampleid, known_samples=known_samples)
-                    new_samples.add(sampleid)
-                    logger.info("Converted %s", sampleid)
-        except (ValueError, AttributeError):
-            logger.exception("Error converting %s", file)
-    logger.info("Analysing %d samples", len(new_samples))
-    for sample in new_samples:
-        try:
-            analyse_sample(sample)
-            logger.info("Analysed %s", sample)
-        except (ValueError, PermissionError, RuntimeError, FileNotFoundError, KeyError):
-            logger.exception("Error analysing %s", sample)
+    neware_files = [
+        file
+        for file in snapshots_folder.rglob("*")
+        if file.suffix in [".xlsx", ".ndax"] and not file.is_relative_to(snapshots_folder / "raw")
+    ]
+    if (snapshots_folder / "raw").exists():
+        neware_files += [folder for folder in (snapshots_folder / "raw").iterdir() if folder.is_dir()]
+    return convert_files(
+        neware_files,
+        partial(_convert_neware_file, known_samples=dbf.get_all_sampleids()),
+        _update_neware_jobs,
+        snapshots_folder / "convert_checkpoint.json",
+        workers=workers,
+        resume=resume,
+        analyse=analyse,
+        progress=progress,
+    )
 
 
 def main() -> None:
-    """Harvest and convert files that have changed."""
-    new_files = harvest_all_neware_files()
-    new_samples = set()
+    """Harvest and convert files that have changed, and analyse the samples.
+
+    Files are converted as soon as they are copied, and samples are analysed as soon as their files are converted,
+    see bulk_convert.run_pipeline.
+    """
     known_samples = dbf.get_all_sampleids()
-    logger.info("Processing %d files", len(new_files))
-    for file in new_files:
-        logger.info("Processing %s", file)
-        try:
-            _data, metadata = convert_neware_data(file, save_file=True, known_samples=known_samples)
-            update_database_job(file, known_samples=known_samples)
-            if metadata is not None:
-                sampleid = metadata.get("sample_data", {}).get("Sample ID")
-                if sampleid:
-                    new_samples.add(sampleid)
-                    logger.info("Converted %s", sampleid)
-        except Exception:
-            logger.exception("Error converting %s", file)
-    logger.info("Analysing %d samples", len(new_samples))
-    for sample in new_samples:
-        try:
-            analyse_sample(sample)
-            logger.info("Analysed %s", sample)
-        except Exception:
-            logger.exception("Error analysing %s", sample)
+    run_pipeline(
+        lambda on_file: harvest_all_neware_files(on_file=on_file),
+        partial(_convert_neware_file, known_samples=known_samples),
+        _update_neware_jobs,
+        get_sample_id=partial(_get_neware_file_sample_id, known_samples=known_samples),
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+"""Copyright © 2025-2026, Empa.
+
+Query the results of all samples together with SQL.
+
+The samples and results tables of the database, and the per-cycle, overall and EIS results of every analysed sample,
+are registered as tables in a polars SQLContext. The analysed results are scanned lazily, so filters and column
+selections are pushed down to the parquet files and a query over hundreds of samples only reads what it needs, e.g.
+the first cycle with less than 80 % capacity of every NMC811 cell:
+
+    from aurora_cycler_manager.query import query
+
+    query('''
+        SELECT c."Sample ID", MIN(c."Cycle") AS "Cycle"
+        FROM cycles c JOIN samples s ON c."Sample ID" = s."Sample ID"
+        WHERE s."Cathode type" = 'NMC811' AND c."Normalised discharge capacity (%)" < 80
+        GROUP BY c."Sample ID"
+    ''')
+
+The cycles and overall tables are read from the lake, samples analysed before the lake existed are added with
+analysis.rebuild_lake. From the command line:
+
+    python -m aurora_cycler_manager.query 'SELECT * FROM overall WHERE "Capacity loss (%)" > 20'
+"""
+
+import argparse
+import datetime
+import decimal
+import logging
+from pathlib import Path
+
+import polars as pl
+from sqlalchemy import Column, select
+
+import aurora_cycler_manager.database_funcs as dbf
+from aurora_cycler_manager.config import get_config
+from aurora_cycler_manager.data_parse import scan_lake
+
+logger = logging.getLogger(__name__)
+CONFIG = get_config()
+
+TABLES = ("samples", "results", "cycles", "overall", "eis")
+PYTHON_TO_POLARS = {
+    int: pl.Int64,
+    float: pl.Float64,
+    decimal.Decimal: pl.Float64,
+    str: pl.String,
+    bool: pl.Boolean,
+    datetime.datetime: pl.Datetime,
+}
+
+
+def _polars_dtype(column: Column) -> pl.DataType:
+    """Polars dtype of a database column, so empty or all-null columns are still typed."""
+    try:
+        return PYTHON_TO_POLARS.get(column.type.python_type, pl.String)
+    except NotImplementedError:
+        return pl.String
+
+
+def _read_table(columns: list[Column]) -> pl.LazyFrame:
+    """Read the rows of a database table which are not deleted."""
+    table = columns[0].table
+    df = pl.read_database(
+        select(*columns).where(table.c["sync_op"] != "delete"),
+        connection=dbf.engine,
+        schema_overrides={c.key: _polars_dtype(c) for c in columns},
+    )
+    return df.lazy()
+
+
+def scan_eis() -> pl.LazyFrame:
+    """Lazily scan the EIS data of every sample, with a "Sample ID" column."""
+    lfs = [
+        pl.scan_parquet(file).with_columns(
+            pl.lit(file.name.removeprefix("eis.").removesuffix(".parquet")).alias("Sample ID")
+        )
+        for file in sorted(Path(CONFIG["Data folder path"]).glob("*/*/eis.*.parquet"))
+    ]
+    if not lfs:
+        return pl.LazyFrame(schema={"Sample ID": pl.String})
+    return pl.concat(lfs, how="diagonal_relaxed")
+
+
+def get_sql_context(tables: list[str] | None = None) -> pl.SQLContext:
+    """Get a SQLContext with the database tables and analysed results registered.
+
+    Args:
+        tables: tables to register, all of "samples", "results", "cycles", "overall" and "eis" if None
+
+    Returns:
+        pl.SQLContext: context to execute queries in
+
+    """
+    tables = list(TABLES) if tables is None else tables
+    if unknown := [t for t in tables if t not in TABLES]:
+        msg = f"Unknown tables {unknown}, must be in {TABLES}"
+        raise ValueError(msg)
+    readers = {
+        "samples": lambda: _read_table(dbf.sample_cols),
+        "results": lambda: _read_table(dbf.result_cols),
+        "cycles": lambda: scan_lake("cycles"),
+        "overall": lambda: scan_lake("overall"),
+        "eis": scan_eis,
+    }
+    return pl.SQLContext({table: readers[table]() for table in tables})
+
+
+def query(sql: str, tables: list[str] | None = None, *, lazy: bool = False) -> pl.DataFrame | pl.LazyFrame:
+    """Run a SQL query over the database tables and the analysed results of all samples.
+
+    Args:
+        sql: query, column names with spaces or brackets must be double quoted
+        tables: only register these tables, default is all, see get_sql_context
+        lazy: return a LazyFrame to collect later instead of the result
+
+    Returns:
+        pl.DataFrame | pl.LazyFrame: result of the query
+
+    """
+    return get_sql_context(tables).execute(sql, eager=not lazy)
+
+
+def main() -> None:
+    """Print the result of a SQL query."""
+    parser = argparse.ArgumentParser(description="Query the database and analysed results of all samples with SQL.")
+    parser.add_argument("sql", help=f"SQL query, tables are {', '.join(TABLES)}")
+    parser.add_argument("-o", "--output", type=Path, help="write the result to a .csv or .parquet file instead")
+    args = parser.parse_args()
+
+    df = query(args.sql)
+    if args.output is None:
+        with pl.Config(tbl_rows=50, tbl_cols=-1, tbl_width_chars=250):
+            print(df)  # noqa: T201
+    elif args.output.suffix == ".parquet":
+        df.write_parquet(args.output)
+    else:
+        df.write_csv(args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,7 @@ commands to the appropriate server, and handles the database updates.
 import json
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime, timezone
 from functools import cached_property
 from pathlib import Path
@@ -22,7 +23,7 @@ from typing import Any, Literal
 import paramiko
 from aurora_unicycler import Protocol
 
-from aurora_cycler_manager import analysis, config, cycler_servers
+from aurora_cycler_manager import analysis, config, cycler_servers, neware_harvester
 from aurora_cycler_manager import database_funcs as dbf
 from aurora_cycler_manager.cycler_servers import CyclerServer
 from aurora_cycler_manager.data_parse import get_sample_folder
@@ -589,14 +590,15 @@ class ServerManager:
 
     def snapshot(
         self,
-        samp_or_jobid: str,
+        samp_or_jobid: str | list[str],
         mode: Literal["always", "new_data", "if_not_exists"] = "new_data",
     ) -> None:
         """Snapshot sample or job, download data, process, and save.
 
         Args:
-            samp_or_jobid: str
-                The sample ID or (aurora) job ID to snapshot.
+            samp_or_jobid: str or list of str
+                The sample ID or (aurora) job ID to snapshot, or a list of them. The raw files of all
+                Neware jobs in the list are found with one command per server.
             mode: str, optional
                 When to make a new snapshot. Can be one of the following:
                     - 'always': Force a snapshot even if job is already done and data is downloaded.
@@ -605,81 +607,97 @@ class ServerManager:
                 Default is 'new_data'.
 
         """
-        # check if the input is a sample ID
-        is_sample = dbf.is_sample(samp_or_jobid)
-        if is_sample:
-            jobs = [dbf.get_job_data(j) for j in dbf.get_jobs_from_sample(samp_or_jobid)]
-        else:  # it's a job ID
-            jobs = [dbf.get_job_data(samp_or_jobid)]
-        jobs = [j for j in jobs if j is not None]
-        if not jobs:
-            msg = f"Sample or job ID '{samp_or_jobid}' not found in the database."
-            raise ValueError(msg)
-
-        for job in jobs:
-            sample_id = job.get("Sample ID")
-            job_id = job.get("Job ID")
-            job_id_on_server = job.get("Job ID on server")
-            if not job_id:
-                continue
-            if not sample_id:
-                logger.warning("Job %s has no sample, skipping.", job["Job ID"])
-                continue
-            if not job_id_on_server:
-                logger.warning("Job %s has no job ID on server, skipping.", job["Job ID"])
-                continue
-            # Check that sample is known
-            if sample_id == "Unknown":
-                logger.warning("Job %s has no sample name or payload, skipping.", job["Job ID"])
-                continue
-
-            local_save_location_processed = get_sample_folder(job["Sample ID"])
-
-            files_exist = (local_save_location_processed / f"snapshot.{job_id}.h5").exists() or (
-                local_save_location_processed / "snapshots" / f"snapshot.{job_id}.parquet"
-            ).exists()
-            if files_exist and mode != "always":
-                if mode == "if_not_exists":
-                    logger.info("Snapshot for %s already exists, skipping.", job_id)
+        jobs = []
+        for samp_or_job in [samp_or_jobid] if isinstance(samp_or_jobid, str) else samp_or_jobid:
+            # check if the input is a sample ID
+            is_sample = dbf.is_sample(samp_or_job)
+            if is_sample:
+                new_jobs = [dbf.get_job_data(j) for j in dbf.get_jobs_from_sample(samp_or_job)]
+            else:  # it's a job ID
+                new_jobs = [dbf.get_job_data(samp_or_job)]
+            new_jobs = [j for j in new_jobs if j is not None]
+            if not new_jobs:
+                msg = f"Sample or job ID '{samp_or_job}' not found in the database."
+                raise ValueError(msg)
+            jobs.extend(new_jobs)
+
+        # List the raw files of all Neware jobs at once, instead of searching for each job
+        neware_jobs = [
+            j["Job ID"]
+            for j in jobs
+            if j.get("Job ID")
+            and j.get("Job ID on server")
+            and self.config["Servers"].get(j.get("Server label"), {}).get("server_type") == "neware"
+        ]
+        with neware_harvester.index_neware_raw_files(neware_jobs) if len(neware_jobs) > 1 else nullcontext():
+            for job in jobs:
+                sample_id = job.get("Sample ID")
+                job_id = job.get("Job ID")
+                job_id_on_server = job.get("Job ID on server")
+                if not job_id:
                     continue
-                if mode == "new_data" and job["Snapshot status"] is not None and job["Snapshot status"].startswith("c"):
-                    logger.info("Snapshot for %s already complete, skipping.", job_id)
+                if not sample_id:
+                    logger.warning("Job %s has no sample, skipping.", job["Job ID"])
+                    continue
+                if not job_id_on_server:
+                    logger.warning("Job %s has no job ID on server, skipping.", job["Job ID"])
+                    continue
+                # Check that sample is known
+                if sample_id == "Unknown":
+                    logger.warning("Job %s has no sample name or payload, skipping.", job["Job ID"])
                     continue
 
-            # Check that the job has started
-            if job["Snapshot status"] in ["q", "qw"]:
-                logger.warning("Job %s is still queued, skipping snapshot.", job_id)
-                continue
+                local_save_location_processed = get_sample_folder(job["Sample ID"])
+
+                files_exist = (local_save_location_processed / f"snapshot.{job_id}.h5").exists() or (
+                    local_save_location_processed / "snapshots" / f"snapshot.{job_id}.parquet"
+                ).exists()
+                if files_exist and mode != "always":
+                    if mode == "if_not_exists":
+                        logger.info("Snapshot for %s already exists, skipping.", job_id)
+                        continue
+                    if (
+                        mode == "new_data"
+                        and job["Snapshot status"] is not None
+                        and job["Snapshot status"].startswith("c")
+                    ):
+                        logger.info("Snapshot for %s already complete, skipping.", job_id)
+                        continue
+
+                # Check that the job has started
+                if job["Snapshot status"] in ["q", "qw"]:
+                    logger.warning("Job %s is still queued, skipping snapshot.", job_id)
+                    continue
 
-            # Check that the server is accessible
-            try:
-                server = find_server(job["Server label"])
-            except KeyError as e:
-                logger.warning("Could not access server %s for job %s: %s", job["Server label"], job_id, e)
-                continue
+                # Check that the server is accessible
+                try:
+                    server = find_server(job["Server label"])
+                except KeyError as e:
+                    logger.warning("Could not access server %s for job %s: %s", job["Server label"], job_id, e)
+                    continue
 
-            # Snapshot the job
-            try:
-                new_snapshot_status = server.snapshot(sample_id, job_id, job_id_on_server)
-            except FileNotFoundError as e:
-                msg = (
-                    f"Error snapshotting {job_id}: {e}\n"
-                    "Likely the job was cancelled before starting. "
-                    "Setting `Snapshot Status` to 'ce' in the database."
-                )
-                dbf.add_or_update_job(job_id, {"Snapshot status": "ce"})
-                raise FileNotFoundError(msg) from e
-
-            # Update the snapshot status in the database
-            dt = datetime.now(timezone.utc).isoformat(timespec="seconds")
-            dbf.update_results(sample_id, {"Last snapshot": dt})
-            dbf.add_or_update_job(job_id, {"Last snapshot": dt, "Snapshot status": new_snapshot_status})
+                # Snapshot the job
+                try:
+                    new_snapshot_status = server.snapshot(sample_id, job_id, job_id_on_server)
+                except FileNotFoundError as e:
+                    msg = (
+                        f"Error snapshotting {job_id}: {e}\n"
+                        "Likely the job was cancelled before starting. "
+                        "Setting `Snapshot Status` to 'ce' in the database."
+                    )
+                    dbf.add_or_update_job(job_id, {"Snapshot status": "ce"})
+                    raise FileNotFoundError(msg) from e
+
+                # Update the snapshot status in the database
+                dt = datetime.now(timezone.utc).isoformat(timespec="seconds")
+                dbf.update_results(sample_id, {"Last snapshot": dt})
+                dbf.add_or_update_job(job_id, {"Last snapshot": dt, "Snapshot status": new_snapshot_status})
 
         # Analyse the new data (only once per sample)
         samples = [j.get("Sample ID") for j in jobs]
         unique_samples = {s for s in samples if s is not None}
         for unique_sample_id in unique_samples:
-            analysis.analyse_sample(unique_sample_id)
+            analysis.analyse_sample(unique_sample_id, incremental=True)
 
     def _update_neware_jobids(self) -> None:
         """Update all Job IDs on Neware servers.
@@ -3,11 +3,18 @@
 Functions for connecting to instrument servers with SSH.
 """
 
+import atexit
 import base64
+import json
 import logging
 import posixpath
-from datetime import datetime
+import threading
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, contextmanager
+from datetime import datetime, timezone
 from pathlib import Path, PureWindowsPath
+from time import monotonic
 
 import paramiko
 from typing_extensions import Self
@@ -18,6 +25,16 @@ CONFIG = get_config()
 
 logger = logging.getLogger(__name__)
 
+HARVEST_WORKERS = 8
+HARVEST_WORKERS_PER_SERVER = 2
+SFTP_CHANNELS = 4
+SFTP_PREFETCH_REQUESTS = 64
+DELTA_MIN_BYTES = 1_000_000
+DELTA_BLOCK_BYTES = 65536
+DELTA_CHUNK_BYTES = 1_048_576
+SSH_KEEPALIVE_INTERVAL = 30
+SSH_IDLE_TIMEOUT = 300
+
 
 def _ps_to_cmd(ps_command: str) -> str:
     """Convert powershell command to command prompt."""
@@ -83,11 +100,25 @@ class SSHConnection:
             key_filename=CONFIG.get("SSH private key path"),
             sock=self.get_sock(),
         )
+        keepalive = CONFIG.get("SSH keepalive interval", SSH_KEEPALIVE_INTERVAL)
+        if keepalive and (transport := self.client.get_transport()):
+            transport.set_keepalive(keepalive)
         return self
 
+    def is_active(self) -> bool:
+        """Check if the connection, and the proxy connection if used, are still open."""
+        client = getattr(self, "client", None)
+        transport = client.get_transport() if client else None
+        if transport is None or not transport.is_active():
+            return False
+        if self._jump_client:
+            jump_transport = self._jump_client.get_transport()
+            return jump_transport is not None and jump_transport.is_active()
+        return True
+
     def close(self) -> None:
         """Close SSH connection."""
-        if self.client:
+        if getattr(self, "client", None):
             self.client.close()
         if self._jump_client:
             self._jump_client.close()
@@ -101,19 +132,138 @@ class SSHConnection:
         """Context manager exit."""
         self.close()
 
-    def get_files(self, local_files: list[Path], remote_files: list[str], *, missing_ok: bool = False) -> None:
-        """Copy the files across with SFTP."""
-        with self.client.open_sftp() as sftp:
-            for remote_file, local_file in zip(remote_files, local_files, strict=True):
-                local_file.parent.mkdir(parents=True, exist_ok=True)
-                logger.info("Downloading file %s to %s", remote_file, local_file)
-                try:
-                    sftp.get(remote_file, str(local_file))
-                except FileNotFoundError:
-                    if missing_ok:
-                        logger.warning("Remote file not found: %s", remote_file)
-                    else:
+    def get_files(
+        self,
+        local_files: list[Path],
+        remote_files: list[str],
+        *,
+        missing_ok: bool = False,
+        channels: int | None = None,
+        on_file: Callable[[Path], None] | None = None,
+    ) -> int:
+        """Copy the files across with SFTP.
+
+        Files are downloaded in parallel over several SFTP channels on the same connection, each download pipelines
+        its read requests with prefetch. The number of channels is "sftp_channels" in the server config, or "SFTP
+        channels" in the config, default 4.
+
+        Args:
+            local_files: paths to copy the files to
+            remote_files: paths of the files on the server
+            missing_ok: log a warning instead of raising an error if a remote file does not exist
+            channels: number of files to download at the same time, overrides the config
+            on_file: called with each local file as soon as it is downloaded, from the download threads
+
+        Returns:
+            int: number of bytes downloaded
+
+        """
+        pairs = list(zip(remote_files, local_files, strict=True))
+        if not pairs:
+            return 0
+        channels = channels or self.server.get("sftp_channels") or CONFIG.get("SFTP channels") or SFTP_CHANNELS
+        channels = max(min(channels, len(pairs)), 1)
+        queue = iter(pairs)
+        queue_lock = threading.Lock()
+        n_bytes = 0
+
+        def download() -> int:
+            """Download files from the shared queue on one SFTP channel."""
+            channel_bytes = 0
+            with self.client.open_sftp() as sftp:
+                while True:
+                    with queue_lock:
+                        remote_file, local_file = next(queue, (None, None))
+                    if remote_file is None or local_file is None:
+                        return channel_bytes
+                    local_file.parent.mkdir(parents=True, exist_ok=True)
+                    logger.info("Downloading file %s to %s", remote_file, local_file)
+                    try:
+                        sftp.get(
+                            remote_file,
+                            str(local_file),
+                            prefetch=True,
+                            max_concurrent_prefetch_requests=SFTP_PREFETCH_REQUESTS,
+                        )
+                    except FileNotFoundError:
+                        if missing_ok:
+                            logger.warning("Remote file not found: %s", remote_file)
+                            continue
                         raise
+                    channel_bytes += local_file.stat().st_size
+                    if on_file:
+                        on_file(local_file)
+
+        t_start = monotonic()
+        if channels == 1:
+            n_bytes = download()
+        else:
+            with ThreadPoolExecutor(max_workers=channels) as pool:
+                futures = [pool.submit(download) for _ in range(channels)]
+                n_bytes = sum(future.result() for future in futures)
+        duration = monotonic() - t_start
+        logger.info(
+            "Downloaded %.1f MB from %s in %.1f s (%.1f MB/s) over %d channels",
+            n_bytes / 1e6,
+            self.server.get("label"),
+            duration,
+            n_bytes / 1e6 / max(duration, 1e-9),
+            channels,
+        )
+        return n_bytes
+
+    def get_file_delta(self, local_file: Path, remote_file: str, *, min_size: int = DELTA_MIN_BYTES) -> int:
+        """Update the local copy of a remote file which only grows by appending.
+
+        Only the end of the file is downloaded, starting one block before the end of the local copy in case the last
+        block was rewritten in place. The first block and the block before the re-downloaded one are compared with the
+        remote file, if they differ, the remote file is smaller than the local copy, or the local copy is smaller than
+        `min_size`, the whole file is copied instead.
+
+        Args:
+            local_file: local copy to update, it is created if it does not exist
+            remote_file: path of the file on the server
+            min_size: copy the whole file if the local copy is smaller than this many bytes
+
+        Returns:
+            int: number of bytes downloaded
+
+        """
+        block = DELTA_BLOCK_BYTES
+        with self.client.open_sftp() as sftp:
+            remote_size = sftp.stat(remote_file).st_size
+            local_size = local_file.stat().st_size if local_file.exists() else 0
+            start = local_size - block
+            if local_size >= max(min_size, 3 * block) and remote_size >= local_size:
+                with sftp.open(remote_file, "rb") as rf:
+                    checks = [(0, block), (start - block, block)]
+                    local_blocks = []
+                    with local_file.open("rb") as lf:
+                        for offset, length in checks:
+                            lf.seek(offset)
+                            local_blocks.append(lf.read(length))
+                    if local_blocks == list(rf.readv(checks)):
+                        chunks = [
+                            (offset, min(DELTA_CHUNK_BYTES, remote_size - offset))
+                            for offset in range(start, remote_size, DELTA_CHUNK_BYTES)
+                        ]
+                        with local_file.open("r+b") as lf:
+                            lf.truncate(start)
+                            lf.seek(start)
+                            for data in rf.readv(chunks, SFTP_PREFETCH_REQUESTS):
+                                lf.write(data)
+                        logger.info(
+                            "Downloaded last %d of %d bytes of %s", remote_size - start, remote_size, remote_file
+                        )
+                        return remote_size - start
+                    logger.info("Remote file %s has changed, downloading all of it", remote_file)
+
+            local_file.parent.mkdir(parents=True, exist_ok=True)
+            logger.info("Downloading file %s to %s", remote_file, local_file)
+            sftp.get(
+                remote_file, str(local_file), prefetch=True, max_concurrent_prefetch_requests=SFTP_PREFETCH_REQUESTS
+            )
+            return local_file.stat().st_size
 
     def put_file(self, local_path: str | Path, remote_path: str | Path | PureWindowsPath) -> None:
         """Send file to Windows PC."""
@@ -122,20 +272,20 @@ class SSHConnection:
             _sftp_mkdir_p(sftp, remote_path.parent.as_posix())
             sftp.put(str(local_path), str(remote_path.as_posix()))
 
-    def check_new_files(
-        self,
-        remote_folder: str,
-        extensions: list,
-        since_uts: float,
-    ) -> list[str]:
-        """Get list of modified files from Windows PC."""
-        # Cannot use timezone or ISO8061 - not supported in PowerShell 5.1
-        cutoff_date_str = datetime.fromtimestamp(since_uts).strftime("%Y-%m-%d %H:%M:%S")  # noqa: DTZ006
+    def list_files(self, remote_folder: str, extensions: list) -> list[dict]:
+        """List files with the given extensions in a folder and its subfolders on a Windows PC.
+
+        Returns:
+            list of dicts with the "Path", "Size" in bytes and "Modified" unix time of each file
+
+        """
         extensions_str = ",".join([f"'{e}'" for e in extensions])
         command = (
-            f"Get-ChildItem -Path '{remote_folder}' -Recurse "
-            f"| Where-Object {{ $_.LastWriteTime -gt '{cutoff_date_str}' -and ($_.Extension -in {extensions_str})}} "
-            "| Select-Object -ExpandProperty FullName"
+            f"$files = Get-ChildItem -Path '{remote_folder}' -Recurse -File "
+            f"| Where-Object {{ $_.Extension -in {extensions_str} }} "
+            "| ForEach-Object { [ordered]@{ Path = $_.FullName; Size = $_.Length; "
+            "Modified = ([DateTimeOffset]$_.LastWriteTimeUtc).ToUnixTimeMilliseconds() / 1000 } }; "
+            "ConvertTo-Json -InputObject @($files) -Compress"
         )
         _stdin, stdout, stderr = self.exec_command(command)
         exit_status = stdout.channel.recv_exit_status()
@@ -143,8 +293,21 @@ class SSHConnection:
             msg = f"Command failed with exit status {exit_status}: {stderr.read().decode('utf-8', errors='replace')}"
             raise RuntimeError(msg)
         output = stdout.read().decode("utf-8", errors="replace").strip()
-        modified_files = output.splitlines()
-        logger.info("Found %d modified files since %s", len(modified_files), cutoff_date_str)
+        files = json.loads(output) if output else []
+        logger.info("Found %d files in %s", len(files), remote_folder)
+        return files
+
+    def check_new_files(
+        self,
+        remote_folder: str,
+        extensions: list,
+        since_uts: float,
+    ) -> list[str]:
+        """Get list of files from Windows PC modified after a unix time."""
+        modified_files = [f["Path"] for f in self.list_files(remote_folder, extensions) if f["Modified"] > since_uts]
+        logger.info(
+            "Found %d modified files since %s", len(modified_files), datetime.fromtimestamp(since_uts, tz=timezone.utc)
+        )
         return modified_files
 
     def exec_command(
@@ -163,3 +326,206 @@ class SSHConnection:
             return _ps_to_cmd(ps_command)
         msg = f"Unsupported shell type '{self.server['shell_type']}' for server {self.server['label']}."
         raise ValueError(msg)
+
+
+class SSHConnectionPool:
+    """Open SSH connections kept for reuse, one per server label.
+
+    Connecting, especially through a proxy jump host, is much slower than running a command, so connections are
+    kept open with keepalive packets and shared between operations and threads. A connection is checked before it is
+    handed out and reconnected if it has dropped, a connection which fails during an operation is closed so the next
+    operation reconnects. A replaced connection is only closed once no other thread is using it. Connections which
+    have not been used for "SSH idle timeout" seconds are closed.
+    """
+
+    def __init__(self, idle_timeout: float | None = None) -> None:
+        """Initialise an empty pool."""
+        self.idle_timeout = idle_timeout
+        self._connections: dict[str, SSHConnection] = {}
+        self._last_used: dict[str, float] = {}
+        self._in_use: dict[SSHConnection, int] = {}
+        self._lock = threading.Lock()
+        self._server_locks: dict[str, threading.Lock] = {}
+
+    def _acquire(self, server: dict) -> SSHConnection:
+        """Get an open connection to the server, connecting if needed, and mark it as in use."""
+        label = server["label"]
+        with self._lock:
+            server_lock = self._server_locks.setdefault(label, threading.Lock())
+        with server_lock:
+            with self._lock:
+                ssh = self._connections.get(label)
+                if ssh is not None:
+                    self._in_use[ssh] = self._in_use.get(ssh, 0) + 1
+            if ssh is not None and (ssh.server != server or not ssh.is_active()):
+                logger.info("Reconnecting to %s", label)
+                self.discard(label, ssh)
+                self._release(label, ssh)
+                ssh = None
+            if ssh is None:
+                ssh = SSHConnection(server).connect()
+                with self._lock:
+                    self._connections[label] = ssh
+                    self._in_use[ssh] = self._in_use.get(ssh, 0) + 1
+            return ssh
+
+    def _release(self, label: str, ssh: SSHConnection) -> None:
+        """Mark a connection as no longer in use, closing it if it was replaced and this was its last user."""
+        with self._lock:
+            count = self._in_use.pop(ssh, 1) - 1
+            if count:
+                self._in_use[ssh] = count
+            if self._connections.get(label) is ssh:
+                self._last_used[label] = monotonic()
+                return
+            if count:
+                return
+        logger.debug("Closing replaced connection to %s", label)
+        ssh.close()
+
+    @contextmanager
+    def connection(self, server: dict) -> Iterator[SSHConnection]:
+        """Use a pooled connection to the server, closing it if the connection fails."""
+        self.evict_idle()
+        ssh = self._acquire(server)
+        try:
+            yield ssh
+        except (paramiko.SSHException, EOFError, OSError):
+            if not ssh.is_active():
+                self.discard(server["label"], ssh)
+            raise
+        finally:
+            self._release(server["label"], ssh)
+
+    def discard(self, label: str, ssh: SSHConnection | None = None) -> None:
+        """Forget the connection to a server, only if it is still `ssh` if given.
+
+        The connection is closed now if it is not in use, otherwise when its last user releases it.
+        """
+        with self._lock:
+            if ssh is not None and self._connections.get(label) is not ssh:
+                return
+            ssh = self._connections.pop(label, None)
+            self._last_used.pop(label, None)
+            if ssh is None or self._in_use.get(ssh):
+                return
+        ssh.close()
+
+    def evict_idle(self) -> None:
+        """Close connections which are not in use and have not been used recently."""
+        idle_timeout = self.idle_timeout or CONFIG.get("SSH idle timeout") or SSH_IDLE_TIMEOUT
+        now = monotonic()
+        idle = []
+        with self._lock:
+            for label, last_used in list(self._last_used.items()):
+                if now - last_used > idle_timeout and not self._in_use.get(self._connections[label]):
+                    idle.append(self._connections.pop(label))
+                    del self._last_used[label]
+        for ssh in idle:
+            logger.debug("Closing idle connection to %s", ssh.server["label"])
+            ssh.close()
+
+    def close_all(self) -> None:
+        """Close all pooled connections, including ones in use."""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self._last_used.clear()
+        for ssh in connections:
+            ssh.close()
+
+
+POOL = SSHConnectionPool()
+atexit.register(POOL.close_all)
+
+
+def pooled_connection(server: dict) -> AbstractContextManager[SSHConnection]:
+    """Use the shared pooled connection to a server, see SSHConnectionPool.
+
+    Use instead of SSHConnection in a with statement, the connection stays open afterwards.
+    """
+    return POOL.connection(server)
+
+
+def _harvest_server(
+    server: dict,
+    harvest: Callable[[SSHConnection, dict, str], list[Path]],
+    workers: int,
+) -> tuple[list[Path], dict]:
+    """Harvest all folders of one server over a single connection."""
+    folders = ([server["data_path"]] if server.get("data_path") else []) + list(server.get("harvester_folders", []))
+    t_start = monotonic()
+    files: list[Path] = []
+    errors = []
+    try:
+        with (
+            pooled_connection(server) as ssh,
+            ThreadPoolExecutor(max_workers=max(min(workers, len(folders)), 1)) as pool,
+        ):
+            futures = {folder: pool.submit(harvest, ssh, server, folder) for folder in folders}
+            for folder, future in futures.items():
+                try:
+                    files.extend(future.result())
+                except Exception as e:
+                    logger.exception("Error harvesting %s on %s", folder, server.get("label"))
+                    errors.append(f"{folder}: {e}")
+    except Exception as e:
+        logger.exception("Error connecting to %s", server.get("label"))
+        errors.append(str(e))
+    report = {
+        "Server": server.get("label"),
+        "Status": "failed" if errors else "success",
+        "Duration (s)": monotonic() - t_start,
+        "Folders": len(folders),
+        "Files": len(files),
+        "Error": "; ".join(errors) or None,
+    }
+    logger.info(
+        "Harvested %d files from %d folders on %s in %.1f s",
+        report["Files"],
+        report["Folders"],
+        report["Server"],
+        report["Duration (s)"],
+    )
+    return files, report
+
+
+def harvest_servers(
+    servers: list[dict],
+    harvest: Callable[[SSHConnection, dict, str], list[Path]],
+    *,
+    workers: int | None = None,
+    workers_per_server: int | None = None,
+) -> tuple[list[Path], list[dict]]:
+    """Harvest the "data_path" and "harvester_folders" of several servers concurrently.
+
+    Each server gets one pooled connection which is shared by all its folders. Errors are logged and reported, they
+    do not stop the other servers or folders being harvested.
+
+    Args:
+        servers: server dictionaries, as defined in config
+        harvest: function called with (ssh, server, folder) which returns the local files copied
+        workers: servers to harvest at the same time, default "Harvest workers" in config or 8
+        workers_per_server: folders to harvest at the same time on one connection, default "Harvest workers per
+            server" in config or 2
+
+    Returns:
+        list[Path]: all local files copied
+        list[dict]: report with Server, Status, Duration (s), Folders, Files and Error for each server
+
+    """
+    workers = workers or CONFIG.get("Harvest workers") or HARVEST_WORKERS
+    workers_per_server = workers_per_server or CONFIG.get("Harvest workers per server") or HARVEST_WORKERS_PER_SERVER
+    all_files: list[Path] = []
+    report = []
+    if not servers:
+        return all_files, report
+    with ThreadPoolExecutor(max_workers=min(workers, len(servers))) as pool:
+        results = pool.map(lambda server: _harvest_server(server, harvest, workers_per_server), servers)
+        for files, server_report in results:
+            all_files.extend(files)
+            report.append(server_report)
+    n_failed = sum(r["Status"] != "success" for r in report)
+    if n_failed:
+        logger.warning("Harvesting failed on %d of %d servers", n_failed, len(report))
+    return all_files, report
@@ -4,10 +4,16 @@ Utility functions which only depend on standard library.
 """
 
 import json
+import os
 import re
+import socket
+import time
 import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
 from fractions import Fraction
 from io import TextIOWrapper
+from pathlib import Path
 
 _ILLEGAL_RE = re.compile(r'[\/\\:*?"\'<>|]|\.\.|\x00')
 
@@ -117,3 +123,43 @@ def round_c_rate(x: float, round_to: int, max_denominator: int = 100, tolerance:
     if abs(float(frac) - x) <= tolerance:
         return round(float(frac), round_to)
     return round(x, round_to)
+
+
+@contextmanager
+def file_lock(path: Path, timeout: float = 60, stale_after: float = 600) -> Iterator[None]:
+    """Hold an exclusive lock file, works between processes and between machines sharing a folder.
+
+    The lock file is created exclusively and removed on exit. A lock file older than stale_after seconds is assumed
+    to be left behind by a process which crashed, and is removed.
+
+    Args:
+        path: lock file to create
+        timeout: seconds to wait for the lock
+        stale_after: seconds after which an existing lock file is ignored
+
+    Raises:
+        TimeoutError: if the lock is not free within timeout seconds
+
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > stale_after:
+                    path.unlink(missing_ok=True)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                msg = f"Could not get lock {path} within {timeout} s"
+                raise TimeoutError(msg) from None
+            time.sleep(0.05)
+    try:
+        os.write(fd, f"{socket.gethostname()} {os.getpid()}".encode())
+        os.close(fd)
+        yield
+    finally:
+        path.unlink(missing_ok=True)
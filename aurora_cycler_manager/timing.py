@@ -0,0 +1,184 @@
+"""Copyright © 2025-2026, Empa.
+
+Record and summarise the time and memory used by each stage of an analysis.
+
+Timing is opt-in, set "Analysis timings path" in the config to a .jsonl file and every analyse_sample call appends
+one JSON record per stage to it. Summarise the file with:
+
+    python -m aurora_cycler_manager.timing path/to/timings.jsonl
+"""
+
+import argparse
+import json
+import logging
+import sys
+import uuid
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+import polars as pl
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb() -> float | None:
+    """Get the peak resident set size of this process in MB, None if it cannot be measured."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10  # bytes on macOS, kB on Linux
+
+
+class StageTimer:
+    """Record the wall time, rows and peak memory of each stage of one analysis.
+
+    Does nothing if no file is given. Otherwise records are collected in memory and appended to the file as JSON lines
+    when the timer is closed, so stages from processes analysing different samples do not interleave.
+
+    Peak memory is the high-water mark of the process at the end of the stage, so it never decreases within one
+    analysis. When samples are analysed in the same process it includes the samples before.
+    """
+
+    def __init__(self, sample_id: str, file: Path | None) -> None:
+        """Start timing an analysis of one sample."""
+        self.sample_id = sample_id
+        self.file = file
+        self.analysis_id = uuid.uuid4().hex
+        self.records: list[dict] = []
+        self._start = perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, rows: int | None = None) -> Iterator[dict]:
+        """Time a stage, rows can also be set on the yielded record if they are only known afterwards."""
+        record: dict = {"stage": name, "rows": rows}
+        if self.file is None:
+            yield record
+            return
+        start = perf_counter()
+        try:
+            yield record
+        finally:
+            self.records.append(
+                {
+                    "analysis_id": self.analysis_id,
+                    "sample_id": self.sample_id,
+                    **record,
+                    "seconds": perf_counter() - start,
+                    "peak_rss_mb": peak_rss_mb(),
+                }
+            )
+
+    def close(self, error: BaseException | None = None) -> None:
+        """Add a total for the whole analysis and write the records."""
+        if self.file is None:
+            return
+        total = {
+            "analysis_id": self.analysis_id,
+            "sample_id": self.sample_id,
+            "stage": "total",
+            "rows": max((r["rows"] for r in self.records if r["rows"] is not None), default=None),
+            "seconds": perf_counter() - self._start,
+            "peak_rss_mb": peak_rss_mb(),
+            "datetime": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "error": repr(error) if error else None,
+        }
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            with self.file.open("a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r) + "\n" for r in [*self.records, total]))
+        except OSError:
+            logger.exception("Could not write analysis timings to %s", self.file)
+
+
+def read_timings(file: Path) -> pl.DataFrame:
+    """Read the timing records from a JSON lines file."""
+    return pl.read_ndjson(
+        file,
+        schema={
+            "analysis_id": pl.String,
+            "sample_id": pl.String,
+            "stage": pl.String,
+            "rows": pl.Int64,
+            "seconds": pl.Float64,
+            "peak_rss_mb": pl.Float64,
+            "datetime": pl.String,
+            "error": pl.String,
+        },
+    )
+
+
+def summarise_timings(timings: pl.DataFrame, n: int = 10) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """Find the slowest samples and stages.
+
+    Args:
+        timings: records from read_timings
+        n: number of samples to list
+
+    Returns:
+        tuple[pl.DataFrame, pl.DataFrame]: the n slowest analyses with their slowest stage, and the time spent in each
+            stage over all analyses, slowest first
+
+    """
+    stages = timings.filter(pl.col("stage") != "total")
+    slowest_stage = (
+        stages.sort("seconds", descending=True)
+        .group_by("analysis_id", maintain_order=True)
+        .first()
+        .select("analysis_id", pl.col("stage").alias("slowest stage"), pl.col("seconds").alias("slowest stage (s)"))
+    )
+    samples = (
+        timings.filter(pl.col("stage") == "total")
+        .sort("seconds", descending=True)
+        .head(n)
+        .join(slowest_stage, on="analysis_id", how="left", maintain_order="left")
+        .select(
+            "sample_id",
+            "datetime",
+            "rows",
+            pl.col("seconds").alias("total (s)"),
+            "slowest stage",
+            "slowest stage (s)",
+            "peak_rss_mb",
+            "error",
+        )
+    )
+    stage_summary = (
+        stages.group_by("stage")
+        .agg(
+            pl.len().alias("count"),
+            pl.col("seconds").sum().alias("total (s)"),
+            pl.col("seconds").mean().alias("mean (s)"),
+            pl.col("seconds").max().alias("max (s)"),
+            (pl.col("rows").sum() / pl.col("seconds").sum() / 1e6).alias("M rows/s"),
+            pl.col("peak_rss_mb").max().alias("max peak_rss_mb"),
+        )
+        .sort("total (s)", descending=True)
+    )
+    return samples, stage_summary
+
+
+def main() -> None:
+    """Print the slowest samples and stages from a timings file."""
+    parser = argparse.ArgumentParser(description="Summarise analysis timings.")
+    parser.add_argument("file", type=Path, help="JSON lines file of analysis timings")
+    parser.add_argument("-n", type=int, default=10, help="number of samples to show")
+    args = parser.parse_args()
+
+    samples, stages = summarise_timings(read_timings(args.file), args.n)
+    with pl.Config(tbl_rows=-1, tbl_cols=-1, tbl_hide_dataframe_shape=True, float_precision=3, tbl_width_chars=250):
+        print(f"Slowest {args.n} analyses:")  # noqa: T201
+        print(samples)  # noqa: T201
+        print("Time per stage:")  # noqa: T201
+        print(stages)  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
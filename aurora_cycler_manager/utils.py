@@ -46,6 +46,25 @@ def weighted_median(
     return sorted_values[np.where(cumulative_weights >= cutoff)[0][0]]
 
 
+def weighted_median_expr(values: str | pl.Expr, weights: str | pl.Expr) -> pl.Expr:
+    """Weighted median as a polars expression, e.g. to use per group in group_by().agg().
+
+    Gives the same result as `weighted_median`, null if there are no values.
+
+    Args:
+        values: Column name or expression of values.
+        weights: Column name or expression of weights.
+
+    Returns:
+        pl.Expr: Expression for the weighted median of the values.
+
+    """
+    values = pl.col(values) if isinstance(values, str) else values
+    weights = pl.col(weights) if isinstance(weights, str) else weights
+    cumulative_weights = weights.sort_by(values).cum_sum()
+    return values.sort().filter(cumulative_weights >= cumulative_weights.last() / 2).first()
+
+
 def parse_datetime(datetime_str: datetime | str | float) -> datetime:
     """Parse a datetime string.
 
@@ -17,7 +17,7 @@ from dash_resizable_panels import Panel, PanelGroup, PanelResizeHandle
 from plotly.colors import hex_to_rgb, label_rgb, sample_colorscale
 
 from aurora_cycler_manager.config import get_config
-from aurora_cycler_manager.data_parse import get_cycles_summary, get_overall_summary
+from aurora_cycler_manager.data_parse import get_batch_summaries
 from aurora_cycler_manager.visualiser.funcs import correlation_matrix
 
 CONFIG = get_config()
@@ -498,11 +498,12 @@ def register_batches_callbacks(app: Dash) -> None:
         for key in del_keys:
             del data[key]
 
-        # Go through samples and add to data
+        # Go through samples and add to data, reading new samples from the lake together
+        cycles_dfs, overall_dicts = get_batch_summaries(s for s in sample_set if s not in data)
         for s in sample_set:
             if s in data:
                 continue
-            if (df := get_cycles_summary(s)) is not None and (overall_dict := get_overall_summary(s)) is not None:
+            if (df := cycles_dfs.get(s)) is not None and (overall_dict := overall_dicts.get(s)) is not None:
                 data[s] = {
                     **df.to_dict(as_series=False),
                     **overall_dict,
@@ -1619,14 +1619,10 @@ def register_db_view_callbacks(app: Dash) -> None:
     )
     def snapshot_sample(yes_clicks: int, selected_rows: list) -> NoUpdate:
         if yes_clicks:
-            for row in selected_rows:
-                if row:
-                    if row.get("Job ID"):
-                        logger.info("Snapshotting %s", row["Job ID"])
-                        sm.snapshot(row["Job ID"])
-                    else:
-                        logger.info("Snapshotting %s", row["Sample ID"])
-                        sm.snapshot(row["Sample ID"])
+            samp_or_jobids = [row.get("Job ID") or row["Sample ID"] for row in selected_rows if row]
+            if samp_or_jobids:
+                logger.info("Snapshotting %s", ", ".join(samp_or_jobids))
+                sm.snapshot(samp_or_jobids)
         return no_update  # Needs any output to trigger loading spinner
 
     # Delete button pop up
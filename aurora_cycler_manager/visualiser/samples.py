@@ -13,12 +13,21 @@ from dash_resizable_panels import Panel, PanelGroup, PanelResizeHandle
 
 from aurora_cycler_manager.analysis import calc_dqdv
 from aurora_cycler_manager.config import get_config
-from aurora_cycler_manager.data_parse import get_cycles_summary, get_cycling, get_cycling_shrunk, get_metadata
+from aurora_cycler_manager.data_parse import (
+    cycle_curve_points,
+    get_cycle_curves,
+    get_cycles_summary,
+    get_cycling,
+    get_cycling_shrunk,
+    get_metadata,
+)
 
 CONFIG = get_config()
 logger = logging.getLogger(__name__)
 graph_template = "seaborn"
 graph_margin = {"l": 75, "r": 20, "t": 50, "b": 75}
+# One cycle graph variables which can be plotted from the precomputed half cycle curves
+CURVE_VARS = {"V (V)", "Q (mAh)", "dQ/dV (mAh/V)", "Q (mAh/g)", "dQ/dV (mAh/gV)"}
 
 # Side menu for the samples tab
 samples_menu = html.Div(
@@ -470,18 +479,34 @@ def register_samples_callbacks(app: Dash) -> None:
         if not xvar or not yvar:
             return fig
         for sample, data_dict in data["data_sample_time"].items():
-            # find where the cycle = cycle
-            mask = np.array(data_dict["Cycle"]) == cycle
-            if not any(mask):
+            mask_dict = {}
+            if (
+                data_dict.get("Shrunk")
+                and {xvar, yvar} <= CURVE_VARS
+                and (curves := get_cycle_curves(sample, cycle)) is not None
+            ):
+                # precomputed on a fixed grid, so the cost does not depend on the length of the cycle
+                mask_dict = {k: v.to_numpy() for k, v in cycle_curve_points(curves).to_dict().items()}
+            elif data_dict.get("Shrunk"):
+                # find where the cycle = cycle
+                mask = np.array(data_dict["Cycle"]) == cycle
+                mask_dict["V (V)"] = np.array(data_dict["V (V)"])[mask]
+                mask_dict["dQ (mAh)"] = np.array(data_dict["dQ (mAh)"])[mask]
+            else:
+                # only read the row group with this cycle from the full file
+                df = get_cycling(sample, cycles=cycle, columns=["V (V)", "dQ (mAh)"])
+                mask_dict["V (V)"] = df["V (V)"].to_numpy()
+                mask_dict["dQ (mAh)"] = df["dQ (mAh)"].to_numpy()
+            if len(mask_dict["V (V)"]) == 0:
                 # increment colour anyway by adding an empty trace
                 fig["data"].append(go.Scattergl())
                 continue
-            mask_dict = {}
-            mask_dict["V (V)"] = np.array(data_dict["V (V)"])[mask]
-            mask_dict["Q (mAh)"] = np.array(data_dict["dQ (mAh)"])[mask].cumsum()
-            mask_dict["dQ (mAh)"] = np.array(data_dict["dQ (mAh)"])[mask]
-            if "dQ/dV (mAh/V)" in [xvar, yvar] or "dQ/dV (mAh/gV)" in [xvar, yvar]:
-                if "dQ/dV (mAh/V)" in data_dict:
+            if "Q (mAh)" not in mask_dict:
+                mask_dict["Q (mAh)"] = mask_dict["dQ (mAh)"].cumsum()
+            if "dQ/dV (mAh/V)" not in mask_dict and (
+                "dQ/dV (mAh/V)" in [xvar, yvar] or "dQ/dV (mAh/gV)" in [xvar, yvar]
+            ):
+                if data_dict.get("Shrunk") and "dQ/dV (mAh/V)" in data_dict:
                     mask_dict["dQ/dV (mAh/V)"] = np.array(data_dict["dQ/dV (mAh/V)"], dtype=float)[mask]
                 else:
                     mask_dict["dQ/dV (mAh/V)"] = calc_dqdv(
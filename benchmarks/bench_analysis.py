@@ -0,0 +1,254 @@
+"""Copyright © 2025-2026, Empa.
+
+Benchmark the analysis pipeline on synthetic snapshots.
+
+For each scale, a temporary project with its own sqlite database is created and synthetic snapshots are written for
+one sample. The stages of the analysis (reading, calc_dq, merge_dfs, analyse_cycles, calc_cycle_curves,
+analyse_overall, calc_dqdv, shrink_df, build_lod, writing the full file) are then timed one after the other, followed
+by the whole of analyse_sample, eager and lazy. Every measurement runs in a fresh process pointed at the project with
+AURORA_USER_CONFIG, so the peak RSS of one does not hide another. Nothing needs to be connected, so this can run
+offline in CI.
+
+Peak RSS of the stages is the high-water mark of the process after each stage, so it only grows.
+
+Run with: python benchmarks/bench_analysis.py --rows 10000 1000000 50000000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from time import perf_counter
+from typing import TypeVar
+
+import polars as pl
+
+from aurora_cycler_manager.timing import peak_rss_mb
+
+SAMPLE_ID = "260101_bench_01"
+SAMPLE_DATA = {"Sample ID": SAMPLE_ID, "Cathode active material mass (mg)": 10.0}
+T = TypeVar("T")
+
+
+def _measure(results: list[dict], stage: str, rows: int, func: Callable[..., T], *args: object) -> T:
+    """Call a function and record its wall time and the peak RSS afterwards."""
+    start = perf_counter()
+    out = func(*args)
+    results.append({"stage": stage, "rows": rows, "seconds": perf_counter() - start, "peak_rss_mb": peak_rss_mb()})
+    return out
+
+
+def _write_project(project: Path) -> Path:
+    """Write the config files for a project with a sqlite database, return the user config file."""
+    shared_config_file = project / "shared_config.json"
+    shared_config = {
+        "Database type": "sqlite",
+        "Database path": str(project / "aurora.db"),
+        "Data folder path": str(project / "data"),
+        "Protocols folder path": str(project / "protocols"),
+        "Servers": {},
+        "Sample database": [{"Name": "Cathode active material mass (mg)", "Type": "FLOAT"}],
+    }
+    shared_config_file.write_text(json.dumps(shared_config, indent=4))
+    user_config_file = project / "config.json"
+    user_config = {"Shared config path": str(shared_config_file), "Snapshots folder path": str(project / "snapshots")}
+    user_config_file.write_text(json.dumps(user_config, indent=4))
+    return user_config_file
+
+
+def _setup(args: argparse.Namespace) -> list[dict]:
+    """Create the database and write the synthetic snapshots."""
+    from aurora_cycler_manager.database_setup import create_database  # noqa: PLC0415
+
+    # The database must exist before database_funcs is imported
+    create_database()
+
+    from aurora_cycler_manager import database_funcs as dbf  # noqa: PLC0415
+    from aurora_cycler_manager.data_parse import get_sample_folder  # noqa: PLC0415
+    from benchmarks.synthetic import write_snapshots  # noqa: PLC0415
+
+    dbf.add_samples_from_object([SAMPLE_DATA])
+    results: list[dict] = []
+    _measure(
+        results,
+        "generate",
+        args.rows,
+        lambda: write_snapshots(
+            get_sample_folder(SAMPLE_ID),
+            dbf.get_sample_data(SAMPLE_ID),
+            args.rows,
+            _n_cycles(args),
+            jobs=args.jobs,
+            eis_blocks=args.eis_blocks,
+            gap_s=args.gap,
+            stale_snapshots=args.stale,
+        ),
+    )
+    return results
+
+
+def _stages(args: argparse.Namespace) -> list[dict]:
+    """Time each stage of the analysis in turn."""
+    from aurora_cycler_manager import analysis  # noqa: PLC0415
+    from aurora_cycler_manager.data_parse import get_sample_folder  # noqa: PLC0415
+
+    sample_folder = get_sample_folder(SAMPLE_ID)
+    files = sorted(sample_folder.rglob("snapshot.*"))
+    results: list[dict] = []
+
+    job_files, dfs, metadatas = _measure(
+        results, "read_and_order_job_files", args.rows, analysis.read_and_order_job_files, files
+    )
+    n_rows = sum(len(df) for df in dfs)
+    dfs = _measure(results, "calc_dq", n_rows, lambda frames: [analysis.calc_dq(f) for f in frames], dfs)
+    df, eis_df = _measure(results, "merge_dfs", n_rows, analysis.merge_dfs, dfs)
+    del dfs
+    metadata = _measure(results, "merge_metadata", len(df), analysis.merge_metadata, job_files, metadatas, SAMPLE_ID)
+    protocol_summary = analysis.extract_voltage_crates(metadata["job_data"])
+    summary_df, protocol_summary = _measure(
+        results,
+        "analyse_cycles",
+        len(df),
+        analysis.analyse_cycles,
+        df,
+        metadata["sample_data"].get("Cathode active material mass (mg)"),
+        protocol_summary,
+    )
+    _measure(results, "calc_cycle_curves", len(df), analysis.calc_cycle_curves, df)
+    _measure(
+        results,
+        "analyse_overall",
+        len(df),
+        analysis.analyse_overall,
+        df,
+        eis_df,
+        metadata,
+        protocol_summary,
+        summary_df,
+    )
+    q = df["dQ (mAh)"].cum_sum()
+    _measure(
+        results,
+        "calc_dqdv",
+        len(df),
+        analysis.calc_dqdv_cycles,
+        df["Cycle"].to_numpy(),
+        df["V (V)"].to_numpy(),
+        q.to_numpy(),
+        df["dQ (mAh)"].to_numpy(),
+    )
+    _measure(results, "shrink_df", len(df), analysis.shrink_df, df)
+    _measure(results, "build_lod", len(df), analysis.build_lod, df)
+    _measure(
+        results,
+        "write_full_file",
+        len(df),
+        analysis.write_full_file,
+        df,
+        sample_folder / f"bench.{SAMPLE_ID}.parquet",
+        {"AURORA:metadata": json.dumps(metadata)},
+    )
+
+    # Check the generator and the analysis agree, otherwise the timings are meaningless
+    n_cycles = len(summary_df)
+    if n_cycles != _n_cycles(args):
+        msg = f"Analysis found {n_cycles} cycles, expected {_n_cycles(args)}"
+        raise ValueError(msg)
+    return results
+
+
+def _analyse_sample(args: argparse.Namespace, *, lazy: bool) -> list[dict]:
+    """Time analyse_sample from snapshots to saved results."""
+    from aurora_cycler_manager import analysis  # noqa: PLC0415
+
+    results: list[dict] = []
+    stage = "analyse_sample (lazy)" if lazy else "analyse_sample"
+    _measure(results, stage, args.rows, lambda: analysis.analyse_sample(SAMPLE_ID, lazy=lazy))
+    return results
+
+
+WORKERS = {
+    "setup": _setup,
+    "stages": _stages,
+    "analyse_sample": lambda args: _analyse_sample(args, lazy=False),
+    "analyse_sample_lazy": lambda args: _analyse_sample(args, lazy=True),
+}
+
+
+def _n_cycles(args: argparse.Namespace) -> int:
+    """Total number of cycles at this scale."""
+    return max(args.rows // args.rows_per_cycle, args.jobs)
+
+
+def _run_worker(worker: str, rows: int, args: argparse.Namespace, user_config_file: Path) -> list[dict]:
+    """Run one measurement in a new process, which prints its results as JSON on the last line."""
+    command = [
+        sys.executable,
+        __file__,
+        "--worker",
+        worker,
+        "--rows",
+        str(rows),
+        "--rows-per-cycle",
+        str(args.rows_per_cycle),
+        "--jobs",
+        str(args.jobs),
+        "--eis-blocks",
+        str(args.eis_blocks),
+        "--gap",
+        str(args.gap),
+        "--stale",
+        str(args.stale),
+    ]
+    env = {**os.environ, "AURORA_USER_CONFIG": str(user_config_file)}
+    env.pop("PYTEST_RUNNING", None)
+    env["PYTHONPATH"] = os.pathsep.join([str(Path(__file__).resolve().parent.parent), env.get("PYTHONPATH", "")])
+    process = subprocess.run(command, env=env, capture_output=True, text=True, check=False)  # noqa: S603
+    if process.returncode != 0:
+        msg = f"{worker} failed for {rows} rows:\n{process.stderr}"
+        raise RuntimeError(msg)
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Run the benchmark at each scale and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000], help="cycling rows")
+    parser.add_argument("--rows-per-cycle", type=int, default=2000, help="rows in each cycle")
+    parser.add_argument("--jobs", type=int, default=3, help="jobs the data is split over")
+    parser.add_argument("--eis-blocks", type=int, default=2, help="EIS spectra in each job")
+    parser.add_argument("--gap", type=float, default=3600, help="seconds between jobs")
+    parser.add_argument("--stale", type=int, default=1, help="stale, fully overlapped snapshots to add")
+    parser.add_argument("--output", type=Path, help="also write the results to this JSON file")
+    parser.add_argument("--worker", choices=WORKERS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.rows = args.rows[0]
+        print(json.dumps(WORKERS[args.worker](args)))  # noqa: T201
+        return
+
+    all_results = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory(prefix="aurora-bench-") as tmp_dir:
+            user_config_file = _write_project(Path(tmp_dir))
+            for worker in WORKERS:
+                all_results += [
+                    {"scale": rows, **result} for result in _run_worker(worker, rows, args, user_config_file)
+                ]
+
+    table = pl.DataFrame(all_results).with_columns(
+        (pl.col("rows") / pl.col("seconds") / 1e6).alias("M rows/s"),
+    )
+    with pl.Config(tbl_rows=-1, tbl_hide_dataframe_shape=True, float_precision=3):
+        print(table)  # noqa: T201
+    if args.output:
+        args.output.write_text(json.dumps(all_results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
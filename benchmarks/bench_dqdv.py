@@ -0,0 +1,81 @@
+"""Copyright © 2025-2026, Empa.
+
+Benchmark the dQ/dV calculation used by shrink_df.
+
+Compares the vectorised `calc_dqdv_cycles` with applying `calc_dqdv` to each
+cycle through polars map_groups, on synthetic cycling data.
+
+Run with: python benchmarks/bench_dqdv.py --cycles 1000 --points 200
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+import polars as pl
+
+from aurora_cycler_manager.analysis import calc_dqdv, calc_dqdv_cycles
+
+
+def synthetic_cycles(n_cycles: int, n_points: int, seed: int = 0) -> pl.DataFrame:
+    """Make a dataframe of charge/discharge cycles with noise and rest points."""
+    rng = np.random.default_rng(seed)
+    t = np.tile(np.linspace(0, 1, n_points), 2 * n_cycles)
+    charging = np.tile(np.repeat([True, False], n_points), n_cycles)
+    v = np.where(charging, 3 + t, 4 - t) + 0.1 * np.sin(20 * t) + rng.normal(0, 1e-3, len(t))
+    dq = np.where(charging, 0.01, -0.01) + rng.normal(0, 1e-4, len(t))
+    dq[rng.random(len(t)) < 0.02] = 0
+    return pl.DataFrame(
+        {
+            "uts": np.arange(len(t), dtype=float),
+            "V (V)": v,
+            "dQ (mAh)": dq,
+            "Q (mAh)": np.cumsum(dq),
+            "Cycle": np.repeat(np.arange(1, n_cycles + 1), 2 * n_points),
+        }
+    )
+
+
+def dqdv_map_groups(df: pl.DataFrame) -> np.ndarray:
+    """Calculate dQ/dV with calc_dqdv applied to each cycle, the previous implementation."""
+
+    def compute_dqdv(group_df: pl.DataFrame) -> pl.DataFrame:
+        dqdv = calc_dqdv(group_df["V (V)"].to_numpy(), group_df["Q (mAh)"].to_numpy(), group_df["dQ (mAh)"].to_numpy())
+        return group_df.with_columns(pl.Series("dQ/dV (mAh/V)", dqdv))
+
+    return df.group_by("Cycle", maintain_order=True).map_groups(compute_dqdv).sort("uts")["dQ/dV (mAh/V)"].to_numpy()
+
+
+def dqdv_vectorised(df: pl.DataFrame) -> np.ndarray:
+    """Calculate dQ/dV for all cycles at once."""
+    return calc_dqdv_cycles(
+        df["Cycle"].to_numpy(),
+        df["V (V)"].to_numpy(),
+        df["Q (mAh)"].to_numpy(),
+        df["dQ (mAh)"].to_numpy(),
+    )
+
+
+def main() -> None:
+    """Time both implementations and check they give the same result."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=1000, help="number of cycles")
+    parser.add_argument("--points", type=int, default=200, help="points per charge or discharge")
+    parser.add_argument("--repeats", type=int, default=3, help="best of this many runs")
+    args = parser.parse_args()
+
+    df = synthetic_cycles(args.cycles, args.points)
+    results = {}
+    for name, func in [("map_groups", dqdv_map_groups), ("vectorised", dqdv_vectorised)]:
+        times = []
+        for _ in range(args.repeats):
+            start = perf_counter()
+            results[name] = func(df)
+            times.append(perf_counter() - start)
+        print(f"{name:>10}: {min(times):.3f} s for {len(df)} rows, {args.cycles} cycles")  # noqa: T201
+    np.testing.assert_allclose(results["vectorised"], results["map_groups"], rtol=1e-6, equal_nan=True)
+    print("Results match")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Copyright © 2025-2026, Empa.
+
+Generate synthetic aurora-format snapshot files for benchmarks.
+
+Each job is a series of constant current cycles (charge, rest, discharge, rest) written like a converted Neware
+snapshot, with optional EIS spectra between cycles. Jobs can be separated by gaps, and stale snapshots (truncated
+copies of a job, as left behind by an earlier harvest) can be added to exercise the overlap handling of the merge.
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+MIN_ROWS_PER_CYCLE = 40  # below this the merge no longer recognises a step as a cycle
+SAMPLE_INTERVAL_S = 10.0
+PHASE_FRACTIONS = (0.45, 0.05, 0.45, 0.05)  # charge, rest, discharge, rest
+TECHNIQUE_CODES = {1: "CC Chg", 2: "CC DChg", 4: "Rest"}
+PHASE_TECHNIQUES = np.array([1, 4, 2, 4], dtype=np.int16)
+
+
+def synthetic_job(
+    n_rows: int,
+    n_cycles: int,
+    start_uts: float,
+    *,
+    first_cycle: int = 1,
+    eis_blocks: int = 0,
+    eis_points: int = 50,
+    current_A: float = 1e-3,
+    seed: int = 0,
+) -> pl.DataFrame:
+    """Make the cycling data of one job.
+
+    Args:
+        n_rows: number of cycling rows, rounded down to a whole number of rows per cycle
+        n_cycles: number of charge-discharge cycles
+        start_uts: unix time stamp of the first row
+        first_cycle: cycle number of the first cycle, used for the capacity fade
+        eis_blocks: number of EIS spectra, spread evenly between cycles
+        eis_points: number of frequencies in each EIS spectrum
+        current_A: charge current in A, the discharge current is slightly lower to give capacity fade
+        seed: random seed for the noise
+
+    Returns:
+        pl.DataFrame: cycling data, with impedance columns if there are EIS spectra
+
+    """
+    rows_per_cycle = n_rows // n_cycles if n_cycles else 0
+    if rows_per_cycle < MIN_ROWS_PER_CYCLE:
+        msg = f"Need at least {MIN_ROWS_PER_CYCLE} rows per cycle, got {n_rows} rows for {n_cycles} cycles"
+        raise ValueError(msg)
+    rng = np.random.default_rng(seed)
+
+    # Phase of every row within its cycle, and the progress (0 to 1) through that phase
+    phase_ends = np.cumsum(np.round(np.array(PHASE_FRACTIONS) * rows_per_cycle)).astype(int)
+    phase_ends[-1] = rows_per_cycle
+    phase_starts = np.concatenate([[0], phase_ends[:-1]])
+    k = np.arange(rows_per_cycle)
+    phase = np.searchsorted(phase_ends, k, side="right")
+    x = (k - phase_starts[phase]) / np.maximum(phase_ends[phase] - phase_starts[phase] - 1, 1)
+
+    n = rows_per_cycle * n_cycles
+    cycle = np.repeat(np.arange(first_cycle, first_cycle + n_cycles, dtype=np.int32), rows_per_cycle)
+    phase = np.tile(phase, n_cycles)
+    x = np.tile(x, n_cycles)
+    fade = 1 - 2e-4 * cycle
+
+    voltage = np.select(
+        [phase == 0, phase == 1, phase == 2],
+        [3.0 + 1.2 * np.sqrt(x), 4.2 - 0.05 * x, 4.15 - 1.1 * np.sqrt(x) * fade],
+        3.05 + 0.1 * x,
+    ) + rng.normal(0, 1e-3, n)
+    current = np.select([phase == 0, phase == 2], [current_A, -current_A * fade], 0.0)
+    current += np.where(current != 0, rng.normal(0, current_A * 1e-3, n), 0.0)
+    df = pl.DataFrame(
+        {
+            "uts": start_uts + SAMPLE_INTERVAL_S * np.arange(n),
+            "V (V)": voltage,
+            "I (A)": current,
+            "technique": PHASE_TECHNIQUES[phase],
+            "cycle_number": cycle - first_cycle + 1,
+        }
+    )
+
+    if eis_blocks:
+        # Spectra are measured in the rest at the end of a cycle, squeezed in before the next data point
+        after_cycles = np.linspace(0, n_cycles - 1, eis_blocks).astype(int)
+        uts = df["uts"].to_numpy()[(after_cycles + 1) * rows_per_cycle - 1]
+        f = np.logspace(6, -1, eis_points)
+        re_z = 10 + 20 / (1 + (f / 100) ** 2)
+        im_z = 20 * (f / 100) / (1 + (f / 100) ** 2)
+        eis_df = pl.DataFrame(
+            {
+                "uts": (uts[:, None] + np.linspace(0, 0.9 * SAMPLE_INTERVAL_S, eis_points)).ravel(),
+                "V (V)": np.repeat(voltage[(after_cycles + 1) * rows_per_cycle - 1], eis_points),
+                "I (A)": np.zeros(eis_blocks * eis_points),
+                "technique": np.full(eis_blocks * eis_points, 4, dtype=np.int16),
+                "cycle_number": np.repeat(after_cycles + 1, eis_points).astype(np.int32),
+                "f (Hz)": np.tile(f, eis_blocks),
+                "Re(Z) (ohm)": np.tile(re_z, eis_blocks),
+                "Im(Z) (ohm)": np.tile(im_z, eis_blocks),
+            }
+        )
+        df = pl.concat([df, eis_df], how="diagonal").sort("uts", maintain_order=True)
+
+    return df.cast(
+        {
+            "V (V)": pl.Float32,
+            "I (A)": pl.Float32,
+            "technique": pl.Int16,
+            "cycle_number": pl.Int32,
+            **({"f (Hz)": pl.Float32, "Re(Z) (ohm)": pl.Float32, "Im(Z) (ohm)": pl.Float32} if eis_blocks else {}),
+        }
+    )
+
+
+def _job_metadata(sample_data: dict, job_id: str, file: Path) -> dict:
+    """Metadata in the same layout as a converted snapshot."""
+    return {
+        "provenance": {
+            "snapshot_file": str(file),
+            "aurora_metadata": {"synthetic": {"method": "benchmarks.synthetic.write_snapshots"}},
+        },
+        "job_data": {"job_type": "synthetic", "Job ID": job_id, "Sample ID": sample_data.get("Sample ID")},
+        "sample_data": sample_data,
+        "glossary": {
+            "uts": "Unix time stamp in seconds",
+            "V (V)": "Cell voltage in volts",
+            "I (A)": "Current across cell in amps",
+            "technique": "Code of technique using Neware convention, see technique codes",
+            "technique codes": TECHNIQUE_CODES,
+        },
+    }
+
+
+def write_snapshots(
+    sample_folder: Path,
+    sample_data: dict,
+    rows: int,
+    cycles: int,
+    *,
+    jobs: int = 1,
+    eis_blocks: int = 0,
+    gap_s: float = 3600,
+    stale_snapshots: int = 0,
+    start_uts: float = 1.7e9,
+    seed: int = 0,
+) -> list[Path]:
+    """Write synthetic snapshots for one sample.
+
+    The rows and cycles are split evenly over the jobs, one job is held in memory at a time.
+
+    Args:
+        sample_folder: sample data folder, snapshots are written to its snapshots subfolder
+        sample_data: sample data to put in the metadata, must contain the Sample ID
+        rows: total number of cycling rows
+        cycles: total number of cycles
+        jobs: number of jobs to split the data over
+        eis_blocks: number of EIS spectra in each job
+        gap_s: time between the end of one job and the start of the next in seconds
+        stale_snapshots: number of extra snapshots that are the first half of an earlier job, these are fully
+            overlapped by the complete job and should be discarded by the merge
+        start_uts: unix time stamp of the first row
+        seed: random seed
+
+    Returns:
+        list[Path]: the snapshot files written
+
+    """
+    if cycles < jobs:
+        msg = f"Need at least one cycle per job, got {cycles} cycles for {jobs} jobs"
+        raise ValueError(msg)
+    snapshot_folder = sample_folder / "snapshots"
+    snapshot_folder.mkdir(parents=True, exist_ok=True)
+    job_cycles = np.diff(np.linspace(0, cycles, jobs + 1).astype(int))
+
+    files = []
+    first_cycle = 1
+    for i, n_cycles in enumerate(job_cycles):
+        df = synthetic_job(
+            rows * int(n_cycles) // cycles,
+            int(n_cycles),
+            start_uts,
+            first_cycle=first_cycle,
+            eis_blocks=eis_blocks,
+            seed=seed + i,
+        )
+        job_id = f"synthetic-{i:03d}"
+        file = snapshot_folder / f"snapshot.{job_id}.parquet"
+        df.write_parquet(file, metadata={"AURORA:metadata": json.dumps(_job_metadata(sample_data, job_id, file))})
+        files.append(file)
+        if i < stale_snapshots:
+            stale_file = snapshot_folder / f"snapshot.{job_id}-stale.parquet"
+            df.head(len(df) // 2).write_parquet(
+                stale_file,
+                metadata={"AURORA:metadata": json.dumps(_job_metadata(sample_data, job_id, stale_file))},
+            )
+            files.append(stale_file)
+        start_uts = df["uts"][-1] + gap_s
+        first_cycle += int(n_cycles)
+    return files
@@ -42,6 +42,8 @@ def reset_all(test_dir: Path) -> Generator[None, None, None]:
     db_path = test_dir / "database" / "test_database.db"
     snapshots_path = test_dir / "data"
     batches_path = test_dir / "batches"
+    lake_path = test_dir / "lake"
+    neware_raw_path = test_dir / "local_snapshots" / "neware_snapshots" / "raw"
 
     # Make backup of database
     shutil.copyfile(db_path, db_path.with_suffix(".bak"))
@@ -52,6 +54,7 @@ def reset_all(test_dir: Path) -> Generator[None, None, None]:
         "aux.*.jsonld",
         "battinfo.*.jsonld",
         "metadata.*.json",
+        "manifest.*.json",
         "overall.*.json",
         "batch.*.json",
         "batch.*.xlsx",
@@ -59,6 +62,8 @@ def reset_all(test_dir: Path) -> Generator[None, None, None]:
     for test_file in test_files:
         assert not any(snapshots_path.rglob(test_file)), f"Already {test_file} in snapshots folder!"
         assert not any(batches_path.rglob(test_file)), f"Already {test_file} in batches folder!"
+    assert not lake_path.exists(), "Already a lake folder!"
+    assert not neware_raw_path.exists(), "Already a neware raw folder!"
 
     yield
 
@@ -71,6 +76,8 @@ def reset_all(test_dir: Path) -> Generator[None, None, None]:
             file.unlink()
         for file in batches_path.rglob(test_file):
             file.unlink()
+    shutil.rmtree(lake_path, ignore_errors=True)
+    shutil.rmtree(neware_raw_path, ignore_errors=True)
     # Reset config
     with (test_dir / "test_config.json").open("w") as f:
         f.write(
@@ -89,6 +96,10 @@ def reset_all(test_dir: Path) -> Generator[None, None, None]:
 @pytest.fixture
 def mock_ssh() -> Generator[MockSSHClient, None, None]:
     """Mock SSH client."""
+    from aurora_cycler_manager.ssh import POOL  # noqa: PLC0415
+
     mock_client = MockSSHClient()
+    POOL.close_all()
     with patch("aurora_cycler_manager.ssh.paramiko.SSHClient", return_value=mock_client):
         yield mock_client
+    POOL.close_all()
@@ -1,9 +1,21 @@
 """Testing ssh module."""
 
+from collections.abc import Generator
+from io import BytesIO
 from pathlib import Path
 from unittest.mock import Mock
 
 
+class MockSFTPFile(BytesIO):
+    """Mock paramiko.SFTPFile for reading."""
+
+    def readv(self, chunks, max_concurrent_prefetch_requests=None) -> Generator[bytes, None, None]:
+        """Read several chunks of the file."""
+        for offset, length in chunks:
+            self.seek(offset)
+            yield self.read(length)
+
+
 class MockSSHClient:
     """Mock ssh.SSHClient with configurable command responses."""
 
@@ -38,6 +50,14 @@ class MockSSHClient:
         """Mock close."""
         self.connected = False
 
+    def get_transport(self) -> Mock | None:
+        """Mock get_transport, active while connected."""
+        if not self.connected:
+            return None
+        transport = Mock()
+        transport.is_active.side_effect = lambda: self.connected
+        return transport
+
     def exec_command(self, command: str, **kwargs) -> tuple[Mock, Mock, Mock]:  # noqa: ANN003
         """Mock exec_command with configured responses."""
         # Find matching response (exact match or contains)
@@ -67,7 +87,7 @@ class MockSSHClient:
         """Mock SFTP context manager."""
         sftp = Mock()
 
-        def mock_get(remote_path, local_path) -> None:
+        def mock_get(remote_path, local_path, **kwargs) -> None:  # noqa: ANN003
             """Get a file from fake server."""
             if remote_path in self.sftp_files:
                 Path(local_path).write_bytes(self.sftp_files[remote_path])
@@ -79,7 +99,21 @@ class MockSSHClient:
             """Put a file on fake server."""
             self.sftp_files[remote_path] = Path(local_path).read_bytes()
 
+        def mock_stat(remote_path) -> Mock:
+            """Stat a file on fake server."""
+            if remote_path not in self.sftp_files:
+                msg = f"Mock file not found: {remote_path}"
+                raise FileNotFoundError(msg)
+            return Mock(st_size=len(self.sftp_files[remote_path]))
+
+        def mock_open(remote_path, mode="r") -> MockSFTPFile:
+            """Open a file on fake server for reading."""
+            mock_stat(remote_path)
+            return MockSFTPFile(self.sftp_files[remote_path])
+
         sftp.get = mock_get
+        sftp.stat = mock_stat
+        sftp.open = mock_open
         sftp.put = mock_put
         sftp.mkdir = Mock()
         sftp.__enter__ = Mock(return_value=sftp)
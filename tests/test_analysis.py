@@ -1,31 +1,68 @@
 """Test analysis.py."""
 
 import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from unittest.mock import patch
 
 import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
+import pytest
 from polars.testing import assert_frame_equal
 
 import aurora_cycler_manager.database_funcs as dbf
 from aurora_cycler_manager.analysis import (
+    CONFIG,
     _sort_times,
+    analyse_all_samples,
+    analyse_batch,
     analyse_cycles,
     analyse_overall,
     analyse_sample,
+    analyse_samples,
+    build_lod,
+    calc_cycle_curves,
     calc_dqdv,
+    calc_dqdv_cycles,
+    compact_df,
     extract_voltage_crates,
     merge_dfs,
     merge_metadata,
+    migrate_storage,
+    needs_analysis,
     read_and_order_job_files,
+    rebuild_lake,
+    scan_and_order_job_files,
     shrink_df,
+    update_lake,
     update_results,
     update_sample_metadata,
+    verify_storage,
+    write_full_file,
+)
+from aurora_cycler_manager.data_parse import (
+    cycle_curve_points,
+    get_batch_summaries,
+    get_cycle_curves,
+    get_cycles_summary,
+    get_cycling,
+    get_cycling_lod,
+    get_cycling_shrunk,
+    get_full_files,
+    get_overall_summary,
+    get_sample_folder,
+    read_cycling,
+    read_metadata,
+    scan_lake,
 )
-from aurora_cycler_manager.data_parse import get_sample_folder, read_cycling, read_metadata
 from aurora_cycler_manager.database_funcs import update_sample_label
 from aurora_cycler_manager.eclab_harvester import convert_all_mprs
 from aurora_cycler_manager.neware_harvester import convert_all_neware_data
+from aurora_cycler_manager.timing import read_timings
 
 
 class TestAnalysis:
@@ -59,6 +96,10 @@ class TestAnalysis:
         assert len(df) == sum(lens)
         assert df["Cycle"][-1] == 3
 
+        # Analysis uses the data as stored
+        df = compact_df(df, "full")
+        assert df["dQ (mAh)"].dtype == pl.Float32
+
         metadata = merge_metadata(job_files, metadatas, sample_id)
         assert isinstance(metadata, dict)
         assert metadata.get("Sample ID") == metadatas[0].get("Sample ID")
@@ -182,6 +223,448 @@ class TestAnalysis:
         assert all(k in metadata for k in ["sample_data", "job_data", "provenance"])
         assert metadata["sample_data"]["Sample ID"] == "commercial_cell_009"
 
+    def test_analyse_sample_incremental(self, reset_all) -> None:
+        """Incremental analysis of growing snapshots should match a full analysis."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        folder = get_sample_folder(sample_id)
+        full_file = folder / f"full.{sample_id}.parquet"
+        outputs = ["cycles", "curves"]
+        first_file, last_file = sorted((folder / "snapshots").glob("snapshot.*.parquet"))
+        last_df = pl.read_parquet(last_file)
+        last_metadata = pl.read_parquet_metadata(last_file)
+
+        analyse_sample(sample_id)
+        expected_full = get_cycling(sample_id)
+        expected = {k: pl.read_parquet(folder / f"{k}.{sample_id}.parquet") for k in outputs}
+
+        # Second job has not started yet
+        last_file.unlink()
+        analyse_sample(sample_id)
+        last_df.head(100).write_parquet(last_file, metadata=last_metadata)
+        with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+            analyse_sample(sample_id, incremental=True)
+
+        # Second job is still running
+        last_df.write_parquet(last_file, metadata=last_metadata)
+        with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+            results = analyse_sample(sample_id, incremental=True)
+        assert_frame_equal(get_cycling(sample_id), expected_full)
+        for k, expected_df in expected.items():
+            assert_frame_equal(pl.read_parquet(folder / f"{k}.{sample_id}.parquet"), expected_df)
+        assert_frame_equal(results.cycles_summary, expected["cycles"])
+
+        # Nothing changed
+        with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+            analyse_sample(sample_id, incremental=True)
+        assert_frame_equal(get_cycling(sample_id), expected_full)
+
+        # New analysis version, must fall back to full analysis
+        with (
+            patch("aurora_cycler_manager.analysis.ANALYSIS_VERSION", "new"),
+            patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError),
+            pytest.raises(AssertionError),
+        ):
+            analyse_sample(sample_id, incremental=True)
+
+        # Old data changed, must fall back to full analysis, which replaces the parts
+        first_df = pl.read_parquet(first_file)
+        first_df.with_columns(pl.col("V (V)") + 0.1).write_parquet(
+            first_file, metadata=pl.read_parquet_metadata(first_file)
+        )
+        analyse_sample(sample_id, incremental=True)
+        assert not get_cycling(sample_id)["V (V)"].equals(expected_full["V (V)"])
+        assert get_full_files(sample_id) == [(full_file, None)]
+        assert not list(folder.glob("full.*.part-*"))
+
+    def test_analyse_sample_incremental_append(self, reset_all, tmp_path: Path) -> None:
+        """Incremental analysis of a long experiment only reads and writes the end of the data."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        folder = get_sample_folder(sample_id)
+        full_file = folder / f"full.{sample_id}.parquet"
+        job_file = sorted((folder / "snapshots").glob("snapshot.*.parquet"))[-1]
+        job_df = pl.read_parquet(job_file)
+        job_metadata = pl.read_parquet_metadata(job_file)
+        # Repeat the cycling job to get many cycles
+        duration = job_df["uts"].max() - job_df["uts"].min() + 60
+        job_files = [job_file.with_name(f"snapshot.{sample_id}_{i:02d}_GCPL_CD8.parquet") for i in range(3, 9)]
+        job_dfs = [job_df.with_columns(pl.col("uts") + (i + 1) * duration) for i in range(len(job_files))]
+        for file, df in zip(job_files, job_dfs, strict=True):
+            df.write_parquet(file, metadata=job_metadata)
+
+        timings = tmp_path / "timings.jsonl"
+        with (
+            patch("aurora_cycler_manager.analysis.FULL_FILE_ROW_GROUP_ROWS", 500),
+            patch.dict(CONFIG, {"LOD levels": [200, 2000], "Analysis timings path": timings}),
+        ):
+            analyse_sample(sample_id)
+            expected_full = get_cycling(sample_id)
+            assert expected_full["Cycle"].max() > 20
+            expected = {k: pl.read_parquet(folder / f"{k}.{sample_id}.parquet") for k in ["cycles", "curves"]}
+            expected_overall = get_overall_summary(sample_id)
+
+            # Last job is still running
+            job_files[-1].unlink()
+            analyse_sample(sample_id)
+            full_file_stat = full_file.stat()
+            timings.unlink()
+            for n_rows in range(100, len(job_dfs[-1]) + 300, 300):
+                job_dfs[-1].head(n_rows).write_parquet(job_files[-1], metadata=job_metadata)
+                with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+                    analyse_sample(sample_id, incremental=True)
+                assert len(get_full_files(sample_id)) <= 5
+
+        # Only the end of the data is read, the full file is not rewritten
+        assert full_file.stat().st_mtime_ns == full_file_stat.st_mtime_ns
+        stages = read_timings(timings)
+        assert stages.filter(pl.col("stage") == "read_full_tail")["rows"].max() < len(expected_full) / 4
+        assert stages.filter(pl.col("stage") == "merge_incremental")["rows"].max() < len(expected_full) / 4
+
+        # Data and results are the same as a full analysis
+        assert_frame_equal(get_cycling(sample_id), expected_full)
+        assert_frame_equal(get_cycling(sample_id, cycles=[5, 6]), expected_full.filter(pl.col("Cycle").is_in([5, 6])))
+        for k, expected_df in expected.items():
+            assert_frame_equal(pl.read_parquet(folder / f"{k}.{sample_id}.parquet"), expected_df)
+        assert get_overall_summary(sample_id) == expected_overall
+
+        # Downsampled data covers all of the data and keeps the total capacity, with no more points than allowed
+        shrunk = get_cycling_shrunk(sample_id)
+        lod = pl.read_parquet(folder / f"lod.{sample_id}.parquet")
+        for df in [shrunk, *lod.partition_by("Points")]:
+            assert df["uts"].is_sorted()
+            assert df["uts"][0] == expected_full["uts"][0]
+            assert df["uts"][-1] == expected_full["uts"][-1]
+            assert df["dQ (mAh)"].sum() == pytest.approx(expected_full["dQ (mAh)"].sum(), rel=1e-4)
+        assert len(shrunk) <= 2 * (len(expected_full) // 20 + 1000)
+        assert (lod.group_by("Points").len()["len"] <= lod.group_by("Points").len()["Points"]).all()
+
+        # Parts are checked and migrated with the full file
+        assert len(verify_storage(sample_id).filter(pl.col("Output") == "full")) == len(get_full_files(sample_id))
+        migrate_storage(sample_id)
+        assert_frame_equal(get_cycling(sample_id), expected_full)
+
+    def test_analyse_sample_lazy(self, reset_all) -> None:
+        """Lazy merge should give the same results as the in-memory merge."""
+        convert_all_mprs()
+        convert_all_neware_data()
+        for sample_id in ["250116_kigr_gen6_01", "commercial_cell_009"]:
+            folder = get_sample_folder(sample_id)
+            analyse_sample(sample_id)
+            expected = {k: pl.read_parquet(folder / f"{k}.{sample_id}.parquet") for k in ["full", "cycles", "shrunk"]}
+
+            results = analyse_sample(sample_id, lazy=True)
+            for k, expected_df in expected.items():
+                assert_frame_equal(pl.read_parquet(folder / f"{k}.{sample_id}.parquet"), expected_df)
+            assert_frame_equal(results.cycles_summary, expected["cycles"])
+            assert not list(folder.glob(".full.*"))
+
+            # Incremental analysis can continue from a lazily merged file
+            with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+                analyse_sample(sample_id, incremental=True)
+            assert_frame_equal(pl.read_parquet(folder / f"full.{sample_id}.parquet"), expected["full"])
+
+    def test_needs_analysis(self, reset_all) -> None:
+        """Only samples with changed snapshot contents or analysis version are analysed again."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        folder = get_sample_folder(sample_id)
+        first_file = sorted((folder / "snapshots").glob("snapshot.*.parquet"))[0]
+        assert needs_analysis(sample_id)
+        analyse_sample(sample_id)
+        assert not needs_analysis(sample_id)
+        assert sample_id not in [r["Sample ID"] for r in analyse_all_samples(sample_id)]
+
+        # Touching a file does not change the contents
+        stat = first_file.stat()
+        os.utime(first_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert not needs_analysis(sample_id)
+        manifest = json.loads((folder / f"manifest.{sample_id}.json").read_text())
+        assert manifest["snapshots"][first_file.relative_to(folder).as_posix()]["mtime_ns"] == stat.st_mtime_ns + 10**9
+
+        # New analysis version
+        with patch("aurora_cycler_manager.analysis.ANALYSIS_VERSION", "new"):
+            assert needs_analysis(sample_id)
+
+        # Sample folders without snapshots have nothing to analyse
+        empty_folder = get_sample_folder("250116_kigr_gen6_99")
+        (empty_folder / "snapshots").mkdir(parents=True)
+        try:
+            assert not needs_analysis("250116_kigr_gen6_99")
+        finally:
+            shutil.rmtree(empty_folder)
+
+        # Same size, different contents
+        contents = bytearray(first_file.read_bytes())
+        contents[-20] ^= 1
+        first_file.write_bytes(contents)
+        os.utime(first_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert needs_analysis(sample_id)
+
+        # Snapshot removed
+        first_file.unlink()
+        assert needs_analysis(sample_id)
+        assert [r["Sample ID"] for r in analyse_all_samples(sample_id)] == [sample_id]
+
+    def test_scan_and_order_job_files(self, reset_all) -> None:
+        """Order from parquet statistics should match reading the files."""
+        convert_all_mprs()
+        job_files = sorted((get_sample_folder("250116_kigr_gen6_01") / "snapshots").glob("snapshot.*.parquet"))
+        expected_files, dfs, _metadatas = read_and_order_job_files(job_files[::-1])
+        files, lfs, metadatas, needs_sort = scan_and_order_job_files(job_files[::-1])
+        assert files == expected_files
+        assert len(lfs) == len(metadatas) == len(dfs)
+        assert not needs_sort
+
+        # Overlapping files need sorting after concatenating
+        dfs[1].with_columns(pl.col("uts") - 60).write_parquet(
+            files[1], metadata=pl.read_parquet_metadata(files[1]), row_group_size=1000
+        )
+        _files, _lfs, _metadatas, needs_sort = scan_and_order_job_files(job_files)
+        assert needs_sort
+
+    @pytest.mark.skipif(sys.platform != "linux", reason="Memory limit only supported on Linux")
+    def test_analyse_all_samples_workers(self, reset_all) -> None:
+        """Analyse samples in separate processes, with timeout and memory limit."""
+        convert_all_mprs()
+        convert_all_neware_data()
+        serial_report = analyse_all_samples(mode="always")
+        report = analyse_all_samples(mode="always", workers=2)
+        assert len(report) == len(serial_report) > 1
+        statuses = {r["Sample ID"]: r["Status"] for r in report}
+        assert statuses == {r["Sample ID"]: r["Status"] for r in serial_report}
+        assert statuses["250116_kigr_gen6_01"] == "success"
+        assert statuses["commercial_cell_009"] == "success"
+        for r in report:
+            assert r["Duration (s)"] > 0
+            assert (r["Error"] is None) == (r["Status"] == "success")
+
+        report = analyse_all_samples("250116_kigr_gen6_01", mode="always", timeout=0.1)
+        assert [r["Status"] for r in report] == ["timeout"]
+
+        report = analyse_all_samples("250116_kigr_gen6_01", mode="always", max_memory_mb=1)
+        assert [r["Status"] for r in report] == ["failed"]
+        assert "more than the limit" in report[0]["Error"]
+
+        # A generous limit on resident memory does not fail healthy samples
+        report = analyse_all_samples("250116_kigr_gen6_01", mode="always", max_memory_mb=4000)
+        assert [r["Status"] for r in report] == ["success"]
+
+        # Polars errors fail only their sample when analysing serially too
+        def fail_first(sample_id: str, **_kwargs: bool) -> None:
+            if sample_id == "250116_kigr_gen6_01":
+                msg = "bad data"
+                raise pl.exceptions.ComputeError(msg)
+
+        with patch("aurora_cycler_manager.analysis.analyse_sample", side_effect=fail_first):
+            report = analyse_samples(["250116_kigr_gen6_01", "commercial_cell_009"])
+        assert [r["Status"] for r in report] == ["failed", "success"]
+        assert report[0]["Error"] == "ComputeError: bad data"
+
+    def test_lake(self, reset_all) -> None:
+        """Results of every sample are kept in the lake, and batches are read from it."""
+        convert_all_mprs()
+        convert_all_neware_data()
+        analyse_all_samples(mode="always", workers=2)
+        sample_ids = ["250116_kigr_gen6_01", "commercial_cell_009"]
+
+        # Lake matches the sample files, also when samples are analysed in separate processes
+        lake_cycles = scan_lake("cycles").collect()
+        for sample_id in sample_ids:
+            cycles = get_cycles_summary(sample_id)
+            assert_frame_equal(
+                lake_cycles.filter(pl.col("Sample ID") == sample_id).select(cycles.columns),
+                cycles,
+            )
+        overall = scan_lake("overall", sample_ids).collect()
+        assert overall["Sample ID"].to_list() == sorted(sample_ids)
+        assert overall.row(0, named=True)["Number of cycles"] == get_overall_summary(sample_ids[0])["Number of cycles"]
+
+        # Analysing again replaces the rows of the sample
+        analyse_sample(sample_ids[0])
+        lake_cycles = scan_lake("cycles", sample_ids[:1]).collect()
+        assert len(lake_cycles) == len(get_cycles_summary(sample_ids[0]))
+        assert lake_cycles.select("Sample ID", "Cycle").is_unique().all()
+        assert scan_lake("cycles", ["unknown_run_01"]).collect().is_empty()
+
+        # Samples missing from the lake fall back to their own files, the lake can be rebuilt
+        cycles_dfs, _ = get_batch_summaries(sample_ids)
+        update_lake(sample_ids[0], None, None)
+        assert scan_lake("overall", sample_ids[:1]).collect().is_empty()
+        fallback_cycles_dfs, fallback_overall_dicts = get_batch_summaries(sample_ids)
+        assert fallback_overall_dicts[sample_ids[0]] == get_overall_summary(sample_ids[0])
+        assert_frame_equal(fallback_cycles_dfs[sample_ids[0]], cycles_dfs[sample_ids[0]])
+        rebuild_lake()
+        cycles_dfs, overall_dicts = get_batch_summaries(sample_ids)
+        assert_frame_equal(cycles_dfs[sample_ids[0]], fallback_cycles_dfs[sample_ids[0]])
+        assert overall_dicts[sample_ids[0]]["Sample ID"] == sample_ids[0]
+
+        # Samples keep their own columns, also ones which are all null
+        for sample_id in sample_ids:
+            assert_frame_equal(cycles_dfs[sample_id], get_cycles_summary(sample_id))
+        null_cycles = get_cycles_summary(sample_ids[0]).with_columns(pl.lit(None, pl.Float32).alias("Unknown"))
+        update_lake(sample_ids[0], null_cycles, overall_dicts[sample_ids[0]])
+        cycles_dfs, _ = get_batch_summaries(sample_ids)
+        assert_frame_equal(cycles_dfs[sample_ids[0]], null_cycles)
+        assert "Unknown" not in cycles_dfs[sample_ids[1]].columns
+
+        # Concurrent updates of samples in the same run do not lose each other's rows
+        cycles = get_cycles_summary(sample_ids[0])
+        new_ids = [f"250116_kigr_gen6_{i}" for i in range(90, 98)]
+        with ThreadPoolExecutor(max_workers=len(new_ids)) as pool:
+            list(pool.map(lambda sample_id: update_lake(sample_id, cycles, {"Number of cycles": 1}), new_ids))
+        assert set(new_ids) <= set(scan_lake("overall").collect()["Sample ID"])
+        assert set(new_ids) <= set(scan_lake("cycles").collect()["Sample ID"])
+        for sample_id in new_ids:
+            update_lake(sample_id, None, None)
+
+        analyse_batch("test", {"samples": sample_ids})
+        with (CONFIG["Batches folder path"] / "test" / "batch.test.json").open() as f:
+            batch_data = json.load(f)["data"]
+        assert set(batch_data["Sample ID"]) == set(sample_ids)
+
+    def test_storage_profile(self, reset_all) -> None:
+        """Outputs are written compactly, and existing outputs can be checked and migrated."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        folder = get_sample_folder(sample_id)
+        full_file = folder / f"full.{sample_id}.parquet"
+        shrunk_file = folder / f"shrunk.{sample_id}.parquet"
+        results = analyse_sample(sample_id)
+        assert pl.read_parquet_schema(full_file)["dQ (mAh)"] == pl.Float32
+        assert pl.read_parquet_schema(full_file)["Step"] == pl.Int32
+        assert pl.read_parquet_schema(shrunk_file)["dQ/dV (mAh/V)"] == pl.Float32
+        assert pl.read_parquet_schema(shrunk_file)["Cycle"] == pl.Int32
+
+        # Outputs written before the storage profile
+        footer = {k: v for k, v in pl.read_parquet_metadata(full_file).items() if not k.startswith("ARROW:")}
+        old_full = results.cycling.cast({"dQ (mAh)": pl.Float64, "Step": pl.UInt32, "Cycle": pl.UInt32})
+        old_full = old_full.with_columns(pl.col("dQ (mAh)") * (1 + 1e-12))
+        old_full.write_parquet(full_file, compression="uncompressed", metadata=footer)
+        results.cycling_shrunk.cast({"dQ/dV (mAh/V)": pl.Float64}).write_parquet(shrunk_file)
+
+        report = verify_storage(sample_id)
+        assert report["Error"].is_null().all()
+        full_report = report.filter(pl.col("Output") == "full").row(0, named=True)
+        assert full_report["Rows"] == len(old_full)
+        assert full_report["Saving (%)"] > 0
+        assert full_report["Largest change"] == "dQ (mAh)"
+        assert 0 < full_report["Max relative error"] < 1e-6
+        assert full_report["Max capacity error (%)"] < 1e-4
+        assert pl.read_parquet_schema(full_file)["dQ (mAh)"] == pl.Float64  # unchanged
+
+        migrate_storage(sample_id)
+        assert pl.read_parquet_schema(full_file)["dQ (mAh)"] == pl.Float32
+        assert pl.read_parquet_schema(shrunk_file)["dQ/dV (mAh/V)"] == pl.Float32
+        assert pl.read_parquet_metadata(full_file).items() >= footer.items()
+        assert_frame_equal(pl.read_parquet(full_file), results.cycling)
+        assert not list(folder.glob(".*.tmp.parquet"))
+        with patch("aurora_cycler_manager.analysis.read_and_order_job_files", side_effect=AssertionError):
+            analyse_sample(sample_id, incremental=True)
+
+        # Compression and row groups are configurable
+        with patch.dict(CONFIG, {"Storage": {"compression": "lz4", "row_group_rows": 1000}}):
+            analyse_sample(sample_id)
+        for file in (full_file, shrunk_file):
+            file_metadata = pq.read_metadata(file)
+            assert file_metadata.row_group(0).column(0).compression == "LZ4"
+            assert file_metadata.num_row_groups > 1
+
+    def test_full_file_row_groups(self, reset_all) -> None:
+        """Full file row groups should align with cycles, so cycles can be read selectively."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        full_file = get_sample_folder(sample_id) / f"full.{sample_id}.parquet"
+        df = analyse_sample(sample_id).cycling
+
+        # Small row groups with the data in several batches
+        write_full_file(df.iter_slices(333), full_file, {"AURORA:metadata": "{}"}, row_group_rows=500)
+        assert_frame_equal(pl.read_parquet(full_file), df)
+        file_metadata = pq.read_metadata(full_file)
+        assert file_metadata.num_row_groups > 2
+        cycle_index = file_metadata.schema.names.index("Cycle")
+        stats = [file_metadata.row_group(i).column(cycle_index).statistics for i in range(file_metadata.num_row_groups)]
+        for cycle in range(1, df["Cycle"].max() + 1):
+            assert sum(st.min <= cycle <= st.max for st in stats) == 1
+
+        # Selective reads
+        cycling = get_cycling(sample_id)
+        one_cycle = get_cycling(sample_id, cycles=2, columns=["uts", "V (V)"])
+        assert one_cycle.columns == ["uts", "V (V)"]
+        assert_frame_equal(one_cycle, cycling.filter(pl.col("Cycle") == 2).select("uts", "V (V)"))
+        assert_frame_equal(get_cycling(sample_id, cycles=range(1, 3)), cycling.filter(pl.col("Cycle").is_in([1, 2])))
+        assert get_cycling(sample_id, cycles=[]).is_empty()
+        start, end = cycling["uts"][100], cycling["uts"][200]
+        assert_frame_equal(get_cycling(sample_id, time_range=(start, end)), cycling[100:201])
+        assert_frame_equal(get_cycling(sample_id, time_range=(None, end)), cycling[:201])
+
+    def test_lod(self, reset_all) -> None:
+        """Levels of detail are built with the analysis, and the coarsest level with enough points is read."""
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        with patch.dict(CONFIG, {"LOD levels": [200, 2000]}):
+            df = analyse_sample(sample_id).cycling
+        lod = pl.read_parquet(get_sample_folder(sample_id) / f"lod.{sample_id}.parquet")
+        assert lod.columns == ["uts", "V (V)", "I (A)", "dQ (mAh)", "Cycle", "Points"]
+        for points, level in lod.group_by("Points"):
+            assert len(level) <= points[0]
+            assert level["uts"].is_sorted()
+            assert level["uts"].is_in(df["uts"].implode()).all()
+            # Capacity still adds up after downsampling
+            assert level["dQ (mAh)"].sum() == pytest.approx(df["dQ (mAh)"].sum() - df["dQ (mAh)"][0], rel=1e-4)
+        assert_frame_equal(build_lod(df, [200, 2000]), lod)
+        assert build_lod(df, [len(df)]).is_empty()
+
+        # Coarsest level with enough points in the window, otherwise the full file
+        assert len(get_cycling_lod(sample_id, 100)) == lod.filter(pl.col("Points") == 200).height
+        assert len(get_cycling_lod(sample_id, 1000)) == lod.filter(pl.col("Points") == 2000).height
+        start, end = df["uts"][0], df["uts"][len(df) // 10]
+        window = get_cycling_lod(sample_id, 100, time_range=(start, end))
+        assert window["uts"].is_between(start, end).all()
+        assert len(window) == lod.filter(pl.col("Points") == 2000, pl.col("uts").is_between(start, end)).height
+        assert_frame_equal(
+            get_cycling_lod(sample_id, 10_000, time_range=(start, end)),
+            df.filter(pl.col("uts").is_between(start, end)).select("uts", "V (V)", "I (A)", "dQ (mAh)", "Cycle"),
+        )
+
+    def test_cycle_curves(self, reset_all) -> None:
+        """Half cycles are stored on a common grid, and can be turned back into points for plotting."""
+        # Linear charge and discharge, voltage is exactly proportional to capacity
+        n = 101
+        df = pl.DataFrame(
+            {
+                "uts": np.arange(2 * n, dtype=float),
+                "V (V)": np.concatenate([np.linspace(3.0, 4.0, n), np.linspace(4.0, 3.5, n)]),
+                "dQ (mAh)": np.concatenate([[0], np.full(n - 1, 0.01), [0], np.full(n - 1, -0.01)]),
+                "Cycle": np.ones(2 * n, dtype=np.int32),
+            }
+        )
+        curves = calc_cycle_curves(df, points=11)
+        assert curves["Direction"].to_list() == ["charge", "discharge"]
+        assert curves["Capacity (mAh)"].to_list() == pytest.approx([1.0, 1.0])
+        np.testing.assert_allclose(curves["V at Q (V)"][0].to_numpy(), np.linspace(3.0, 4.0, 11), atol=1e-5)
+        np.testing.assert_allclose(curves["V at Q (V)"][1].to_numpy(), np.linspace(4.0, 3.5, 11), atol=1e-5)
+        np.testing.assert_allclose(curves["Q at V (mAh)"][1].to_numpy(), np.linspace(0, 1, 11), atol=1e-5)
+        points = cycle_curve_points(curves)
+        assert points["Q (mAh)"][-1] == pytest.approx(0, abs=1e-6)
+        assert points["dQ/dV (mAh/V)"][:11].to_numpy() == pytest.approx(1.0, rel=1e-4)
+        assert points["dQ/dV (mAh/V)"][11:].to_numpy() == pytest.approx(-2.0, rel=1e-4)
+
+        # Capacities match the per-cycle summary
+        convert_all_mprs()
+        sample_id = "250116_kigr_gen6_01"
+        results = analyse_sample(sample_id)
+        curves = get_cycle_curves(sample_id)
+        assert curves.schema["V at Q (V)"] == pl.Array(pl.Float32, 256)
+        summary = results.cycles_summary.join(
+            curves.pivot("Direction", index="Cycle", values="Capacity (mAh)"), on="Cycle"
+        )
+        assert summary["charge"].to_numpy() == pytest.approx(summary["Charge capacity (mAh)"].to_numpy(), rel=1e-4)
+        assert summary["discharge"].to_numpy() == pytest.approx(
+            summary["Discharge capacity (mAh)"].to_numpy(), rel=1e-4
+        )
+        assert get_cycle_curves(sample_id, 2)["Cycle"].to_list() == [2, 2]
+
     def test_update_sample_metadata(self, reset_all, test_dir: Path) -> None:
         """Test update sample metadata."""
         sample_id = "250116_kigr_gen6_01"
@@ -244,6 +727,22 @@ class TestAnalysis:
         assert_frame_equal(cycles_before, cycles_after)
         assert_frame_equal(full_data_before, full_data_after)
 
+        # The full file itself is not rewritten, only the sidecar
+        full_file_stat = full_file.stat()
+        update_sample_label("250116_kigr_gen6_01", "Second label")
+        update_sample_metadata(["250116_kigr_gen6_01"])
+        assert full_file.stat().st_mtime_ns == full_file_stat.st_mtime_ns
+        assert read_metadata(full_file)["sample_data"]["Label"] == "Second label"
+
+        # Without the sidecar, it is recreated from the full file
+        metadata_file.unlink()
+        update_sample_metadata("250116_kigr_gen6_01")
+        with metadata_file.open("r") as f:
+            assert json.load(f)["sample_data"]["Label"] == "Second label"
+
+        with pytest.raises(ValueError, match="not found in the database"):
+            update_sample_metadata(["250116_kigr_gen6_01", "not_a_sample"])
+
     def test_dqdv(self) -> None:
         """Test the dQ/dV calculation against analytical derivative."""
         V = np.concatenate([np.linspace(0, 100, 101), np.linspace(100, 0, 101)])
@@ -258,6 +757,33 @@ class TestAnalysis:
         np.testing.assert_almost_equal(res[5:95], dQdV_expected[5:95], decimal=6)
         np.testing.assert_almost_equal(res[105:195], dQdV_expected[105:195], decimal=6)
 
+    def test_dqdv_cycles(self, reset_all) -> None:
+        """Vectorised dQ/dV should match calculating each cycle separately."""
+        convert_all_mprs()
+        df = analyse_sample("250116_kigr_gen6_01").cycling
+        df = df.with_columns(pl.col("dQ (mAh)").cum_sum().alias("Q (mAh)"))
+        # Use non-contiguous cycles and some zero dQ to check all of the masking
+        df = df.with_columns((pl.col("Cycle") % 3).alias("Cycle"), pl.col("dQ (mAh)").fill_nan(0))
+        expected = np.full(len(df), np.nan)
+        for (cycle,), group in df.with_row_index().group_by("Cycle"):
+            assert isinstance(cycle, int)
+            idx = group["index"].to_numpy()
+            expected[idx] = calc_dqdv(
+                group["V (V)"].to_numpy(), group["Q (mAh)"].to_numpy(), group["dQ (mAh)"].to_numpy()
+            )
+        res = calc_dqdv_cycles(
+            df["Cycle"].to_numpy(), df["V (V)"].to_numpy(), df["Q (mAh)"].to_numpy(), df["dQ (mAh)"].to_numpy()
+        )
+        assert np.isfinite(res).sum() > 100
+        np.testing.assert_allclose(res, expected, rtol=1e-6, equal_nan=True)
+
+        # Analytical case from test_dqdv
+        V = np.concatenate([np.linspace(0, 100, 101), np.linspace(100, 0, 101)])
+        Q = np.concatenate([np.linspace(0, 10, 101) ** 2, np.linspace(10, 0, 101) ** 2])
+        dQ = Q - np.pad(Q, (1, 0), mode="edge")[:-1]
+        np.testing.assert_allclose(calc_dqdv_cycles(np.zeros(len(V)), V, Q, dQ), calc_dqdv(V, Q, dQ), equal_nan=True)
+        assert len(calc_dqdv_cycles(*[np.array([])] * 4)) == 0
+
     def test_sort_times(self) -> None:
         """Test _sort_times function."""
         # Normal sort
@@ -25,6 +25,7 @@ from aurora_cycler_manager.database_funcs import (
     get_job_id_from_server,
     get_or_create_job_id_from_server,
     get_sample_data,
+    get_samples_data,
     is_sample,
     remove_batch,
     sample_df_to_db,
@@ -168,6 +169,11 @@ class TestSampleFunctions:
         sample_data = get_sample_data("240620_kigr_gen2_01")
         assert sample_data["Label"] == "bar"
 
+        # Get several samples at once
+        samples_data = get_samples_data(["240620_kigr_gen2_01", "240620_kigr_gen2_02", "thisdoesntexist"])
+        assert set(samples_data) == {"240620_kigr_gen2_01", "240620_kigr_gen2_02"}
+        assert samples_data["240620_kigr_gen2_01"] == sample_data
+
         # Delete some samples
         sample_ids = get_all_sampleids()
         assert "240620_kigr_gen2_01" in sample_ids
@@ -1,18 +1,38 @@
 """Testing functions in the eclab_harvester.py."""
 
-from datetime import datetime
+import json
+import shutil
+import time
+from collections.abc import Callable
+from datetime import datetime, timezone
 from pathlib import Path
 
+import numpy as np
+import polars as pl
 import pytest
 from polars.testing import assert_frame_equal
 from sqlalchemy import MetaData, Table, create_engine, select
 
 import aurora_cycler_manager.database_funcs as dbf
+from aurora_cycler_manager import bulk_convert
 from aurora_cycler_manager.analysis import analyse_sample
+from aurora_cycler_manager.bulk_convert import run_pipeline
 from aurora_cycler_manager.config import get_config
-from aurora_cycler_manager.data_parse import SampleDataBundle, get_cycling
-from aurora_cycler_manager.eclab_harvester import convert_mpr, get_mpr_data, main
+from aurora_cycler_manager.data_parse import SampleDataBundle, get_cycling, get_sample_folder
+from aurora_cycler_manager.eclab_harvester import (
+    MPR_STATE_KEY,
+    _convert_mpr_file,
+    _find_mpr_data_module,
+    _update_mpr_data,
+    convert_all_mprs,
+    convert_mpr,
+    get_eclab_snapshot_folder,
+    get_mpr_data,
+    get_mprs,
+    main,
+)
 from aurora_cycler_manager.setup_logging import setup_logging
+from aurora_cycler_manager.ssh import SSHConnection, harvest_servers
 
 
 def test_main(reset_all, mock_ssh, test_dir: Path, caplog) -> None:
@@ -26,13 +46,11 @@ def test_main(reset_all, mock_ssh, test_dir: Path, caplog) -> None:
         f"C:/aurora/data/{run_id}/{sample_id}/job1.mpl": local_folder / run_id / "1" / (filename + ".mpl"),
         f"C:/aurora/data/{run_id}/{sample_id}/job1.mpr": local_folder / run_id / "1" / (filename + ".mpr"),
     }
-    mock_ssh.add_command_response(
-        command="Get-ChildItem -Path 'C:/aurora/data/'",
-        stdout="\n".join([k for k in files if k.endswith(".mpr")]),
-    )
     for remote_path, local_path in files.items():
         content = local_path.read_bytes()
         mock_ssh.add_sftp_file(remote_path, content)
+    listing = [{"Path": p, "Size": len(mock_ssh.sftp_files[p]), "Modified": 1.7e9} for p in files]
+    mock_ssh.add_command_response(command="Get-ChildItem -Path 'C:/aurora/data/'", stdout=json.dumps(listing))
 
     # Make fake jobs for both files
     dbf.add_or_update_job("job1", {"Sample ID": sample_id, "Job ID on server": "bio-job1", "Server label": "bio"})
@@ -57,6 +75,56 @@ def test_main(reset_all, mock_ssh, test_dir: Path, caplog) -> None:
     last_update = dbf.get_last_harvest({"label": "bio", "hostname": "fakehostname"}, "C:/aurora/data/")
     assert abs(last_update - datetime.now(tz=get_config()["tz"]).timestamp()) < 600
 
+    # Only files which are new or changed size are copied again
+    server = get_config()["Servers"]["bio"]
+    assert dbf.get_new_files(server, "C:/aurora/data/", listing) == []
+    grown = {**listing[1], "Size": listing[1]["Size"] + 100, "Modified": 1.8e9}
+    touched = {**listing[0], "Modified": 1.8e9}
+    assert dbf.get_new_files(server, "C:/aurora/data/", [touched, grown]) == [grown]
+    assert get_mprs(server, "C:/aurora/data/", local_folder) == []
+
+    # Folders harvested before files were recorded are copied once, regardless of the last harvest time
+    dbf.update_harvester(server, "C:/old/", datetime.fromtimestamp(1.75e9, tz=timezone.utc))
+    old_listing = [{**f, "Path": f["Path"].replace("C:/aurora/data/", "C:/old/")} for f in listing]
+    assert dbf.get_new_files(server, "C:/old/", old_listing) == old_listing
+
+
+def test_harvest_servers(reset_all, mock_ssh) -> None:
+    """Servers are harvested concurrently, with one connection per server for all its folders."""
+    servers = [
+        {"label": "a", "hostname": "a", "username": "u", "shell_type": "powershell", "data_path": "C:/a/"},
+        {
+            "label": "b",
+            "hostname": "b",
+            "username": "u",
+            "shell_type": "powershell",
+            "data_path": "C:/b/",
+            "harvester_folders": ["C:/b2/", "C:/broken/"],
+        },
+        {"label": "c", "hostname": "c", "username": "u", "shell_type": "powershell"},
+    ]
+    connections = {}
+
+    def harvest(ssh: SSHConnection, server: dict, folder: str) -> list[Path]:
+        connections.setdefault(server["label"], set()).add(id(ssh))
+        if folder == "C:/broken/":
+            msg = "Folder not found"
+            raise RuntimeError(msg)
+        return [Path(folder) / "file.mpr"]
+
+    files, report = harvest_servers(servers, harvest, workers=2, workers_per_server=2)
+    assert sorted(files) == sorted(Path(f) / "file.mpr" for f in ["C:/a/", "C:/b/", "C:/b2/"])
+    assert {k: len(v) for k, v in connections.items()} == {"a": 1, "b": 1}
+    report = {r["Server"]: r for r in report}
+    assert report["a"]["Status"] == "success"
+    assert report["a"]["Files"] == 1
+    assert report["b"]["Status"] == "failed"
+    assert report["b"]["Folders"] == 3
+    assert report["b"]["Files"] == 2
+    assert "Folder not found" in report["b"]["Error"]
+    assert report["c"]["Folders"] == 0
+    assert all(r["Duration (s)"] >= 0 for r in report.values())
+
 
 def test_convert_data(reset_all, test_dir: Path) -> None:
     """Should be able to convert mprs from different formats."""
@@ -191,6 +259,148 @@ def test_convert_data_update_database(reset_all, test_dir: Path) -> None:
         assert result is not None
 
 
+def test_convert_all_mprs(reset_all, monkeypatch) -> None:
+    """Files are converted in a process pool, an interrupted run resumes from its checkpoint."""
+    checkpoint_path = get_eclab_snapshot_folder() / "convert_checkpoint.json"
+
+    def interrupt(*args, **kwargs) -> None:  # noqa: ANN002, ANN003
+        raise KeyboardInterrupt
+
+    # Interrupted after converting, before analysing
+    with monkeypatch.context() as m:
+        m.setattr(bulk_convert, "analyse_samples", interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            convert_all_mprs(workers=2, analyse=True, progress=False)
+    converted = json.loads(checkpoint_path.read_text())["Converted"]
+    assert len(converted) == 6
+    sample_ids = {c["Sample ID"] for c in converted.values()}
+    assert sample_ids == {"250116_kigr_gen6_01", "commercial_cell_009"}
+    with dbf.engine.connect() as conn:
+        file_stems = conn.execute(select(dbf.dataframes_table.c["File stem"])).scalars().all()
+    for file in converted:
+        assert Path(file).stem in file_stems
+        sample_id = converted[file]["Sample ID"]
+        assert (get_sample_folder(sample_id) / "snapshots" / f"snapshot.{Path(file).stem}.parquet").exists()
+        assert dbf.get_results_from_sample(sample_id)["Last snapshot"]
+
+    # Converted files are not converted again
+    report, analysis_report = convert_all_mprs(analyse=True, progress=False)
+    assert report == []
+    assert {r["Sample ID"] for r in analysis_report} == sample_ids
+    assert all(r["Status"] == "success" for r in analysis_report)
+    assert not checkpoint_path.exists()
+    for sample_id in sample_ids:
+        assert get_cycling(sample_id) is not None
+
+
+def test_run_pipeline(reset_all, tmp_path: Path) -> None:
+    """Samples are analysed while other files are still being harvested."""
+    mpr_files = sorted(get_eclab_snapshot_folder().rglob("*.mpr"))
+    first_sample_id = "250116_kigr_gen6_01"
+    first_files = [f for f in mpr_files if "250116_kigr_gen6" in f.parts]
+    bad_file = tmp_path / "bad.mpr"
+    bad_file.write_bytes(b"not an mpr")
+
+    def harvest(on_file: Callable[[Path], None]) -> None:
+        for file in first_files:
+            on_file(file)
+        # Wait for the first sample to be analysed before copying the rest
+        full_file = get_sample_folder(first_sample_id) / f"full.{first_sample_id}.parquet"
+        t_start = time.monotonic()
+        while not full_file.exists():
+            assert time.monotonic() - t_start < 120, "First sample was not analysed during the harvest"
+            time.sleep(0.1)
+        for file in [*mpr_files, bad_file]:
+            if file not in first_files:
+                on_file(file)
+
+    report = {r["Stage"]: r for r in run_pipeline(harvest, _convert_mpr_file, _update_mpr_data, convert_workers=2)}
+    assert report["harvest"]["Items"] == 7
+    assert report["convert"]["Items"] == 7
+    assert report["convert"]["Failed"] == 1
+    assert report["analyse"]["Items"] >= 2
+    assert report["analyse"]["Failed"] == 0
+    assert all(r["Items/s"] > 0 for r in report.values())
+    assert get_cycling("commercial_cell_009") is not None
+
+
+def test_run_pipeline_holds_converting_samples(reset_all, monkeypatch) -> None:
+    """A sample is not analysed while another of its files is still being converted."""
+    sample_id = "250116_kigr_gen6_01"
+    converting: set[str] = set()
+    analysed: list[tuple[list[str], set[str]]] = []
+
+    def convert_file(file: Path) -> dict:
+        converting.add(file.name)
+        time.sleep(0.5 if file.name == "slow.mpr" else 0)
+        converting.discard(file.name)
+        return {"Sample ID": sample_id, "Last snapshot": "2025-01-01T00:00:00+00:00"}
+
+    def analyse(sample_ids: list[str], **_kwargs) -> list[dict]:  # noqa: ANN003
+        analysed.append((sample_ids, set(converting)))
+        return [{"Status": "success"} for _ in sample_ids]
+
+    def harvest(on_file: Callable[[Path], None]) -> None:
+        on_file(Path("fast.mpr"))
+        on_file(Path("slow.mpr"))
+
+    monkeypatch.setattr(bulk_convert, "analyse_samples", analyse)
+    run_pipeline(harvest, convert_file, lambda _records: None, get_sample_id=lambda _file: sample_id)
+    assert analysed
+    assert all(not busy for _sample_ids, busy in analysed)
+    assert analysed[-1][0] == [sample_id]
+
+
+def truncate_mpr(mpr_file: Path, n_records: int) -> bytes:
+    """Make an mpr file with only the first records, as if it was copied while the job was running."""
+    raw = bytearray(mpr_file.read_bytes())
+    with mpr_file.open("rb") as f:
+        data_module = _find_mpr_data_module(f)
+    assert data_module is not None
+    record_size = data_module["Record size"]
+    header = data_module["Header"].copy()
+    header["length"] = data_module["Records start"] - data_module["Data start"] + n_records * record_size
+    raw[data_module["Position"] + 6 : data_module["Data start"]] = header.tobytes()
+    raw[data_module["Data start"] : data_module["Data start"] + 4] = np.uint32(n_records).tobytes()
+    end = data_module["Records start"] + data_module["Records"] * record_size
+    return bytes(raw[: data_module["Records start"] + n_records * record_size] + raw[end:])
+
+
+def test_convert_mpr_incremental(reset_all, test_dir: Path, tmp_path: Path, caplog) -> None:
+    """Only the records appended to an mpr file are decoded and added to the snapshot."""
+    full_mpr = test_dir / "eclab_harvester" / "test_C01.mpr"
+    mpr = tmp_path / "test_C01.mpr"
+    params = {"update_database": False, "save_file": True, "sample_id": "test"}
+    parquet_file = get_sample_folder("test") / "snapshots" / "snapshot.test_C01.parquet"
+    expected_df, _metadata = convert_mpr(full_mpr, update_database=False, sample_id="test")
+
+    mpr.write_bytes(truncate_mpr(full_mpr, 10000))
+    df, _metadata = convert_mpr(mpr, incremental=True, **params)
+    assert len(df) == 10000
+    assert json.loads(pl.read_parquet_metadata(parquet_file)[MPR_STATE_KEY])["Records"] == 10000
+
+    # The file grows
+    shutil.copy(full_mpr, mpr)
+    with caplog.at_level("INFO"):
+        df, _metadata = convert_mpr(mpr, incremental=True, **params)
+    assert "Decoded 8001 new records" in caplog.text
+    assert_frame_equal(df, expected_df)
+    assert_frame_equal(pl.read_parquet(parquet_file), expected_df)
+    assert json.loads(pl.read_parquet_metadata(parquet_file)[MPR_STATE_KEY])["Records"] == 18001
+
+    # Nothing new
+    df, _metadata = convert_mpr(mpr, incremental=True, **params)
+    assert_frame_equal(df, expected_df)
+
+    # The start of the file changes, it is converted again in full
+    mpr.write_bytes(truncate_mpr(full_mpr, 5000))
+    caplog.clear()
+    with caplog.at_level("INFO"):
+        df, _metadata = convert_mpr(mpr, incremental=True, **params)
+    assert "converting the whole file" in caplog.text
+    assert len(df) == 5000
+
+
 def test_convert_eis(reset_all, test_dir: Path) -> None:
     """Check EIS works without any cycling data."""
     mpr = test_dir / "misc" / "PEIS.mpr"
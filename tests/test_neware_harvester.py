@@ -1,11 +1,23 @@
 """Tests for Neware harvester."""
 
+import json
 import logging
+import zipfile
 from pathlib import Path
 
+from polars.testing import assert_frame_equal
+
 import aurora_cycler_manager.database_funcs as dbf
 from aurora_cycler_manager.data_parse import get_cycling
-from aurora_cycler_manager.neware_harvester import convert_all_neware_data, main
+from aurora_cycler_manager.neware_harvester import (
+    convert_all_neware_data,
+    convert_neware_data,
+    export_ndax,
+    get_neware_ndax_data,
+    get_neware_raw_folder,
+    main,
+    pack_ndax,
+)
 from aurora_cycler_manager.setup_logging import setup_logging
 
 
@@ -16,17 +28,17 @@ def test_main(reset_all, mock_ssh, test_dir: Path, caplog) -> None:
         "C:/aurora/data/120_6_1_36.ndax": local_folder / "nw4-120-6-1-36.ndax",
         "C:/aurora/data/120_9_5_33.ndax": local_folder / "nw4-120-9-5-33.ndax",
     }
+    for remote_path, local_path in files.items():
+        content = local_path.read_bytes()
+        mock_ssh.add_sftp_file(remote_path, content)
     mock_ssh.add_command_response(
         command="Get-ChildItem -Path 'C:/aurora/data/'",
-        stdout="\n".join(files.keys()),
+        stdout=json.dumps([{"Path": p, "Size": len(mock_ssh.sftp_files[p]), "Modified": 1.7e9} for p in files]),
     )
     mock_ssh.add_command_response(
         command="Get-ChildItem -Path 'C:/Neware data/'",
-        stdout="",
+        stdout="[]",
     )
-    for remote_path, local_path in files.items():
-        content = local_path.read_bytes()
-        mock_ssh.add_sftp_file(remote_path, content)
 
     # Make fake jobs for both files
     dbf.add_or_update_job(
@@ -66,7 +78,7 @@ def test_convert_all(reset_all, caplog) -> None:
     )
 
     # Convert the data
-    convert_all_neware_data()
+    convert_all_neware_data(workers=2, progress=False)
 
     # Should not warn/fail
     assert caplog.text == ""
@@ -76,3 +88,34 @@ def test_convert_all(reset_all, caplog) -> None:
     assert df is not None
     df = get_cycling("250127_svfe_gen21_01")
     assert df is not None
+
+
+def test_pack_ndax(reset_all, test_dir: Path, tmp_path: Path) -> None:
+    """Raw folders are packed into stored or compressed ndax files, and can be converted directly."""
+    job_id = "nw4-120-6-1-36"
+    ndax_path = test_dir / "local_snapshots" / "neware_snapshots" / f"{job_id}.ndax"
+    raw_folder = get_neware_raw_folder(job_id)
+
+    # Exporting a packed job does not keep another copy of the raw files
+    export_path = export_ndax(job_id, tmp_path / "export.ndax")
+    assert not raw_folder.exists()
+    with zipfile.ZipFile(export_path) as zf:
+        assert {i.compress_type for i in zf.infolist()} == {zipfile.ZIP_DEFLATED}
+
+    with zipfile.ZipFile(ndax_path) as zf:
+        zf.extractall(raw_folder)
+    stored_path = pack_ndax(raw_folder, tmp_path / "stored.ndax")
+    with zipfile.ZipFile(stored_path) as zf:
+        assert {i.compress_type for i in zf.infolist()} == {zipfile.ZIP_STORED}
+    assert stored_path.stat().st_size > export_path.stat().st_size
+
+    expected = get_neware_ndax_data(ndax_path)
+    assert_frame_equal(get_neware_ndax_data(export_path), expected)
+    assert_frame_equal(get_neware_ndax_data(stored_path), expected)
+
+    # The raw folder of a running job is converted without packing it next to the raw files
+    df, metadata = convert_neware_data(raw_folder, save_file=False)
+    expected_df, expected_metadata = convert_neware_data(ndax_path, save_file=False)
+    assert_frame_equal(df, expected_df)
+    assert metadata["job_data"] == expected_metadata["job_data"]
+    assert sorted(p.name for p in raw_folder.parent.iterdir()) == [job_id]
@@ -0,0 +1,63 @@
+"""Test query.py."""
+
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from aurora_cycler_manager.analysis import analyse_all_samples
+from aurora_cycler_manager.data_parse import get_cycles_summary, get_eis, get_overall_summary
+from aurora_cycler_manager.eclab_harvester import convert_all_mprs, convert_mpr
+from aurora_cycler_manager.query import get_sql_context, query
+
+
+class TestQuery:
+    """Test SQL queries over the database and analysed results."""
+
+    def test_query(self, reset_all, test_dir: Path) -> None:
+        """Tables from the database and the analysed results can be joined."""
+        convert_all_mprs()
+        convert_mpr(test_dir / "eclab_harvester" / "test_C01.mpr", sample_id="240701_svfe_gen6_01")
+        convert_mpr(test_dir / "misc" / "PEIS.mpr", sample_id="240701_svfe_gen6_01")
+        analyse_all_samples(mode="always")
+        sample_id = "250116_kigr_gen6_01"
+
+        df = query(
+            """
+            SELECT o."Sample ID", o."Number of cycles", s."Cathode active material mass (mg)" AS "Mass (mg)"
+            FROM overall o JOIN samples s ON o."Sample ID" = s."Sample ID"
+            WHERE o."Sample ID" = '250116_kigr_gen6_01'
+            """
+        )
+        assert isinstance(df, pl.DataFrame)
+        assert df.row(0) == (
+            sample_id,
+            get_overall_summary(sample_id)["Number of cycles"],
+            get_overall_summary(sample_id)["Cathode active material mass (mg)"],
+        )
+
+        df = query(
+            """
+            SELECT "Sample ID", COUNT(*) AS n, MAX("Cycle") AS last
+            FROM cycles WHERE "Discharge capacity (mAh)" > 0 GROUP BY "Sample ID"
+            """
+        )
+        cycles = get_cycles_summary(sample_id)
+        n_discharged = len(cycles.filter(pl.col("Discharge capacity (mAh)") > 0))
+        assert df.filter(pl.col("Sample ID") == sample_id).select("n").item() == n_discharged
+
+        lf = query('SELECT "Sample ID", COUNT(*) AS n FROM eis GROUP BY "Sample ID"', ["eis"], lazy=True)
+        assert isinstance(lf, pl.LazyFrame)
+        eis_counts = dict(lf.collect().iter_rows())
+        assert eis_counts
+        for eis_sample_id, n in eis_counts.items():
+            assert n == len(get_eis(eis_sample_id))
+
+    def test_empty_tables(self, reset_all) -> None:
+        """Before anything is analysed the tables exist but are empty."""
+        ctx = get_sql_context()
+        assert set(ctx.tables()) == {"samples", "results", "cycles", "overall", "eis"}
+        assert ctx.execute('SELECT "Sample ID" FROM cycles', eager=True).is_empty()
+        assert not ctx.execute('SELECT "Sample ID" FROM samples', eager=True).is_empty()
+        with pytest.raises(ValueError, match="Unknown tables"):
+            get_sql_context(["not_a_table"])
@@ -1,6 +1,8 @@
 """Test server_manager.py module."""
 
 import json
+import zipfile
+from datetime import datetime
 from pathlib import Path
 from time import time
 
@@ -11,6 +13,7 @@ from aurora_unicycler import Protocol
 import aurora_cycler_manager.database_funcs as dbf
 from aurora_cycler_manager.cycler_servers import CyclerServer
 from aurora_cycler_manager.data_parse import get_cycling
+from aurora_cycler_manager.neware_harvester import get_neware_raw_folder, index_neware_raw_files, snapshot_raw_data
 from aurora_cycler_manager.server_manager import ServerManager, _CyclingJob, _Sample
 
 
@@ -222,14 +225,48 @@ def test_start_stop(reset_all, mock_ssh, tmp_path: Path, test_dir: Path) -> None
         content = local_path.read_bytes()
         mock_ssh.add_sftp_file(remote_path, content)
 
-    mock_ssh.add_command_response(
-        command='$file_endings = @(".ndc", "_step.ndc", "_runInfo.ndc", "_log.ndc", "_es.ndc")',
-        stdout=json.dumps(file_paths),
-    )
+    submitted = datetime.fromisoformat(dbf.get_job_data(job_id)["Submitted"]).strftime("%Y%m%d")
+    raw_listing = [
+        {
+            "Folder": "C:/Program Files (x86)/NEWARE/BTSServer80/NdcFile/" + submitted,
+            "Name": f"20250128_161756_270010_0_1_1{ending}",  # matches the job ID on the server
+            "FullName": p,
+            "Length": len(mock_ssh.sftp_files[p]),
+            "LastWriteTime": 1738077476,
+        }
+        for ending, p in file_paths.items()
+    ]
+    mock_ssh.add_command_response(command="$searchFolders = @(", stdout=json.dumps(raw_listing))
 
     sm.snapshot(job_id)
     new_ndax_path = test_dir / "local_snapshots" / "neware_snapshots" / "nw-10-1-1-1.ndax"
     assert new_ndax_path.exists()
+
+    # Nothing has changed on the server, so the files are not downloaded or converted again
+    mtime = new_ndax_path.stat().st_mtime_ns
+    commands = []
+    exec_command = mock_ssh.exec_command
+    mock_ssh.exec_command = lambda command, **kwargs: commands.append(command) or exec_command(command, **kwargs)
+    assert snapshot_raw_data(job_id) is None
+    assert new_ndax_path.stat().st_mtime_ns == mtime
+    assert len(commands) == 1
+
+    # The job records more data, the next snapshot lists the server again and gets it
+    ndc_file = file_paths[".ndc"]
+    mock_ssh.add_sftp_file(ndc_file, mock_ssh.sftp_files[ndc_file] + bytes(100))
+    raw_listing[0] = {**raw_listing[0], "Length": len(mock_ssh.sftp_files[ndc_file]), "LastWriteTime": 1738080000}
+    mock_ssh.add_command_response(command="$searchFolders = @(", stdout=json.dumps(raw_listing))
+    assert snapshot_raw_data(job_id) == new_ndax_path
+    assert len(commands) == 2
+    with zipfile.ZipFile(new_ndax_path) as zf:
+        assert zf.read("data.ndc") == mock_ssh.sftp_files[ndc_file]
+    assert not get_neware_raw_folder(job_id).exists()  # The job has finished, only the packed file is kept
+
+    # Snapshots of many jobs share one listing per server, which is not kept afterwards
+    with index_neware_raw_files([job_id, job_id]):
+        assert snapshot_raw_data(job_id) is None
+    assert len(commands) == 3
+    mock_ssh.exec_command = exec_command
     new_ndax_path.unlink()  # Remove after analysed
 
     # Should have analysed data
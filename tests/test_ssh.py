@@ -0,0 +1,143 @@
+"""Test ssh.py."""
+
+from pathlib import Path
+
+import numpy as np
+import paramiko
+import pytest
+
+from aurora_cycler_manager.ssh import DELTA_BLOCK_BYTES, POOL, SSHConnectionPool, pooled_connection
+
+from .mocks import MockSSHClient
+
+SERVER = {"label": "a", "hostname": "a", "username": "u", "shell_type": "powershell"}
+
+
+def count_connects(mock_ssh: MockSSHClient) -> list[str]:
+    """Record the hostname of every new connection."""
+    connects = []
+    connect = mock_ssh.connect
+
+    def counting_connect(**kwargs) -> None:  # noqa: ANN003
+        connects.append(kwargs["hostname"])
+        connect(**kwargs)
+
+    mock_ssh.connect = counting_connect
+    return connects
+
+
+class TestConnectionPool:
+    """Test reusing SSH connections."""
+
+    def test_reuse(self, reset_all, mock_ssh) -> None:
+        """Operations on one server share a connection until it drops."""
+        connects = count_connects(mock_ssh)
+        with pooled_connection(SERVER) as ssh1:
+            pass
+        with pooled_connection(SERVER) as ssh2:
+            pass
+        assert ssh1 is ssh2
+        assert connects == ["a"]
+        assert mock_ssh.connected
+
+        # A dropped connection is replaced transparently
+        mock_ssh.connected = False
+        with pooled_connection(SERVER) as ssh3:
+            assert ssh3 is not ssh1
+        assert connects == ["a", "a"]
+
+        # As is a connection with changed settings
+        with pooled_connection({**SERVER, "hostname": "b"}) as ssh4:
+            assert ssh4 is not ssh3
+        assert connects == ["a", "a", "b"]
+
+        POOL.close_all()
+        assert not mock_ssh.connected
+
+    def test_failure(self, reset_all, mock_ssh) -> None:
+        """A connection which breaks during an operation is closed, errors are still raised."""
+        with pytest.raises(ValueError), pooled_connection(SERVER) as ssh1:
+            raise ValueError
+        with pooled_connection(SERVER) as ssh2:
+            assert ssh2 is ssh1
+
+        def drop_connection() -> None:
+            with pooled_connection(SERVER):
+                mock_ssh.connected = False
+                raise paramiko.SSHException
+
+        with pytest.raises(paramiko.SSHException):
+            drop_connection()
+        assert "a" not in POOL._connections  # noqa: SLF001
+
+    def test_replace_in_use(self, reset_all, mock_ssh) -> None:
+        """A replaced connection is only closed once every thread using it has released it."""
+        closed = []
+        with pooled_connection(SERVER) as ssh1, pooled_connection(SERVER) as ssh1_again:
+            assert ssh1_again is ssh1
+            ssh1.close = lambda: closed.append(ssh1)
+            with pooled_connection({**SERVER, "hostname": "b"}) as ssh2:
+                assert ssh2 is not ssh1
+            assert closed == []
+        assert closed == [ssh1]
+        assert POOL._connections["a"] is ssh2  # noqa: SLF001
+
+    def test_idle_eviction(self, reset_all, mock_ssh) -> None:
+        """Connections are closed after the idle timeout, but not while they are in use."""
+        pool = SSHConnectionPool(idle_timeout=1e-9)
+        with pool.connection(SERVER):
+            pool.evict_idle()
+            assert mock_ssh.connected
+        pool.evict_idle()
+        assert not mock_ssh.connected
+        assert not pool._connections  # noqa: SLF001
+
+
+class TestGetFiles:
+    """Test downloading files with SFTP."""
+
+    def test_parallel_download(self, reset_all, mock_ssh, tmp_path: Path) -> None:
+        """Files are downloaded over several channels, missing files can be skipped."""
+        remote_files = [f"C:/data/{i}.ndax" for i in range(10)]
+        for i, remote_file in enumerate(remote_files):
+            mock_ssh.add_sftp_file(remote_file, bytes(100 * i))
+        local_files = [tmp_path / "sub" / f"{i}.ndax" for i in range(10)]
+        with pooled_connection(SERVER) as ssh:
+            n_bytes = ssh.get_files(local_files, remote_files, channels=3)
+            assert n_bytes == sum(100 * i for i in range(10))
+            for i, local_file in enumerate(local_files):
+                assert local_file.read_bytes() == bytes(100 * i)
+
+            assert ssh.get_files([tmp_path / "missing"], ["C:/missing"], missing_ok=True) == 0
+            with pytest.raises(FileNotFoundError):
+                ssh.get_files([*local_files, tmp_path / "missing"], [*remote_files, "C:/missing"], channels=4)
+            assert ssh.get_files([], []) == 0
+
+    def test_delta_download(self, reset_all, mock_ssh, tmp_path: Path) -> None:
+        """Only the end of a growing file is downloaded, unless the start has changed."""
+        rng = np.random.default_rng(0)
+        data = rng.bytes(1_000_000)
+        remote_file = "C:/data/data.ndc"
+        local_file = tmp_path / "data.ndc"
+        with pooled_connection(SERVER) as ssh:
+            mock_ssh.add_sftp_file(remote_file, data[:600_000])
+            assert ssh.get_file_delta(local_file, remote_file, min_size=0) == 600_000
+
+            # Appended, and the last block rewritten
+            mock_ssh.add_sftp_file(remote_file, data[:599_000] + bytes(1000) + data[600_000:900_000])
+            n_bytes = ssh.get_file_delta(local_file, remote_file, min_size=0)
+            assert n_bytes == 300_000 + DELTA_BLOCK_BYTES
+            assert local_file.read_bytes() == mock_ssh.sftp_files[remote_file]
+
+            # Changed earlier in the file
+            mock_ssh.add_sftp_file(remote_file, bytes(10) + data[10:1_000_000])
+            assert ssh.get_file_delta(local_file, remote_file, min_size=0) == 1_000_000
+            assert local_file.read_bytes() == mock_ssh.sftp_files[remote_file]
+
+            # Shrunk
+            mock_ssh.add_sftp_file(remote_file, data[:500_000])
+            assert ssh.get_file_delta(local_file, remote_file, min_size=0) == 500_000
+            assert local_file.read_bytes() == data[:500_000]
+
+            # Small files are always downloaded in full
+            assert ssh.get_file_delta(local_file, remote_file) == 500_000
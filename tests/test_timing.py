@@ -0,0 +1,82 @@
+"""Test timing.py."""
+
+from pathlib import Path
+from unittest.mock import patch
+
+import polars as pl
+import pytest
+
+from aurora_cycler_manager.analysis import CONFIG, analyse_sample
+from aurora_cycler_manager.eclab_harvester import convert_all_mprs
+from aurora_cycler_manager.timing import StageTimer, read_timings, summarise_timings
+
+
+class TestTiming:
+    """Test recording and summarising analysis timings."""
+
+    def test_stage_timer(self, tmp_path: Path) -> None:
+        """Stages are written as JSON lines when the timer is closed."""
+        file = tmp_path / "timings.jsonl"
+        timer = StageTimer("my_sample", file)
+        with timer.stage("first", rows=10):
+            pass
+        with timer.stage("second") as record:
+            record["rows"] = 20
+        assert not file.exists()
+        timer.close()
+
+        timings = read_timings(file)
+        assert timings["stage"].to_list() == ["first", "second", "total"]
+        assert timings["rows"].to_list() == [10, 20, 20]
+        assert timings["analysis_id"].n_unique() == 1
+        assert (timings["seconds"] >= 0).all()
+        assert timings["error"].is_null().all()
+
+    def test_stage_timer_disabled(self, tmp_path: Path) -> None:
+        """Without a file nothing is recorded."""
+        timer = StageTimer("my_sample", None)
+        with timer.stage("first", rows=10) as record:
+            record["rows"] = 20
+        timer.close()
+        assert timer.records == []
+
+    def test_analyse_sample_timings(self, reset_all, tmp_path: Path) -> None:
+        """Every analyse_sample call appends its stages, including failed analyses."""
+        convert_all_mprs()
+        file = tmp_path / "timings.jsonl"
+        with patch.dict(CONFIG, {"Analysis timings path": file}):
+            analyse_sample("250116_kigr_gen6_01")
+            analyse_sample("250116_kigr_gen6_01", lazy=True)
+            with pytest.raises(ValueError):
+                analyse_sample("240701_svfe_gen6_01")
+
+        timings = read_timings(file)
+        assert timings["analysis_id"].n_unique() == 3
+        first, lazy, failed = timings.partition_by("analysis_id", maintain_order=True)
+        assert first["stage"].to_list() == [
+            "fingerprint_snapshots",
+            "read_snapshots",
+            "merge_dfs",
+            "merge_metadata",
+            "extract_voltage_crates",
+            "analyse_cycles",
+            "calc_cycle_curves",
+            "analyse_overall",
+            "shrink_df",
+            "build_lod",
+            "write_full_file",
+            "write_results",
+            "update_lake",
+            "total",
+        ]
+        assert "merge_lazy" in lazy["stage"].to_list()
+        assert first.filter(pl.col("stage") == "analyse_cycles")["rows"][0] > 0
+        assert failed["stage"].to_list() == ["fingerprint_snapshots", "read_snapshots", "total"]
+        assert "No valid cycling files" in failed["error"][-1]
+
+        samples, stages = summarise_timings(timings, n=2)
+        assert len(samples) == 2
+        assert samples["total (s)"].is_sorted(descending=True)
+        assert samples["slowest stage"].is_not_null().all()
+        assert set(stages["stage"]) == set(timings["stage"]) - {"total"}
+        assert stages["total (s)"].is_sorted(descending=True)
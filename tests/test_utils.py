@@ -1,16 +1,23 @@
 """Test for utilities module."""
 
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import polars as pl
 import pytest
 
 from aurora_cycler_manager.stdlib_utils import (
     c_to_float,
     check_illegal_text,
+    file_lock,
     max_with_none,
     min_with_none,
     round_c_rate,
     run_from_sample,
 )
-from aurora_cycler_manager.utils import weighted_median
+from aurora_cycler_manager.utils import weighted_median, weighted_median_expr
 
 
 class TestRunFromSample:
@@ -121,6 +128,25 @@ class TestWeightedMedian:
         with pytest.raises(ValueError):
             weighted_median([1.0, 2.0], [1.0])
 
+    def test_grouped(self) -> None:
+        """Polars expression per group should match weighted_median on each group."""
+        rng = np.random.default_rng(0)
+        df = pl.DataFrame(
+            {
+                "group": rng.integers(0, 20, 1000),
+                "value": rng.normal(size=1000).round(1),  # rounded to get ties
+                "weight": rng.random(1000),
+            }
+        )
+        result = df.group_by("group").agg(weighted_median_expr("value", "weight").alias("median"))
+        for group, median in result.iter_rows():
+            group_df = df.filter(pl.col("group") == group)
+            assert median == weighted_median(group_df["value"], group_df["weight"])
+
+        df = pl.DataFrame({"value": [1.0, 2.0, 3.0, 4.0, 5.0], "weight": [0.0, 0.0, 1.0, 1.0, 1.0]})
+        assert df.select(weighted_median_expr(pl.col("value"), pl.col("weight"))).item() == 4.0
+        assert df.head(0).select(weighted_median_expr("value", "weight")).item() is None
+
 
 class TestIllegalText:
     """Test check_illegal_text function."""
@@ -172,3 +198,27 @@ class TestRoundCRate:
         assert round_c_rate(1 / 7 + 1e-15, 10) == round(1 / 7, 10)
         assert round_c_rate(3.14159, 5, tolerance=1e-10) == round(3.14159, 5)
         assert round_c_rate(3.14159, 10, tolerance=1e-1) == round(311 / 99, 10)
+
+
+class TestFileLock:
+    """Test the file_lock context manager."""
+
+    def test_exclusive(self, tmp_path: Path) -> None:
+        """The lock can only be held once, and is released on exit."""
+        lock = tmp_path / ".lock"
+        with file_lock(lock):
+            assert lock.exists()
+            with pytest.raises(TimeoutError), file_lock(lock, timeout=0.1):
+                pass
+        assert not lock.exists()
+        with file_lock(lock, timeout=0.1):
+            pass
+
+    def test_stale(self, tmp_path: Path) -> None:
+        """A lock file left behind by a crashed process is ignored after a while."""
+        lock = tmp_path / ".lock"
+        lock.touch()
+        os.utime(lock, (time.time() - 1000, time.time() - 1000))
+        with file_lock(lock, timeout=0.1, stale_after=600):
+            pass
+        assert not lock.exists()